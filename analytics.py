@@ -0,0 +1,234 @@
+# analytics.py - Thống kê phản ánh và thời gian phản hồi diễn đàn, chỉ đọc từ bảng tổng hợp
+from datetime import datetime, timedelta
+
+from geo import decode_geohash
+from storage import get_storage
+from timeutils import DAY_FORMAT, VIETNAM_TZ, vietnam_day_key, vietnam_range_bounds
+
+# Các chỉ số được trigger cập nhật (xem database.TRIGGERS / storage.PG_TRIGGERS)
+METRICS = ('reports', 'questions', 'answered', 'resolved')
+METRIC_LABELS = {
+    'reports': 'Phản ánh',
+    'questions': 'Câu hỏi',
+    'answered': 'Đã trả lời',
+    'resolved': 'Đã xử lý',
+}
+# Chỉ số có total_seconds -> khóa cộng dồn số giây trong mỗi điểm dữ liệu
+SECONDS_KEYS = {
+    'answered': 'answer_seconds',
+    'resolved': 'resolve_seconds',
+}
+
+
+# ================ KHOẢNG NGÀY ================
+def day_range(start_day, end_day):
+    """Danh sách khóa ngày 'YYYY-MM-DD' từ start_day tới end_day (bao gồm cả hai đầu)"""
+    day = datetime.strptime(start_day, DAY_FORMAT).date()
+    last = datetime.strptime(end_day, DAY_FORMAT).date()
+    days = []
+    while day <= last:
+        days.append(day.strftime(DAY_FORMAT))
+        day += timedelta(days=1)
+    return days
+
+
+def last_days(days, today=None):
+    """(ngày bắt đầu, hôm nay) cho khoảng `days` ngày gần nhất theo giờ Việt Nam"""
+    today = today or vietnam_day_key()
+    start = datetime.strptime(today, DAY_FORMAT).date() - timedelta(days=days - 1)
+    return start.strftime(DAY_FORMAT), today
+
+
+# ================ CHUỖI SỐ LIỆU ================
+def _empty_point():
+    point = {metric: 0 for metric in METRICS}
+    for key in SECONDS_KEYS.values():
+        point[key] = 0
+    return point
+
+
+def _add_row(point, metric, count, total_seconds):
+    point[metric] = point.get(metric, 0) + count
+    if metric in SECONDS_KEYS:
+        point[SECONDS_KEYS[metric]] += total_seconds
+
+
+def daily_series(start_day, end_day, storage=None):
+    """{day: {'reports', 'questions', 'answered', 'resolved', '..._seconds'}} - ngày không có dữ liệu = 0"""
+    storage = storage or get_storage()
+    series = {day: _empty_point() for day in day_range(start_day, end_day)}
+    for metric, day, count, total_seconds in storage.analytics_daily(start_day, end_day):
+        if day in series:
+            _add_row(series[day], metric, count, total_seconds)
+    return series
+
+
+def monthly_series(start_day, end_day, storage=None):
+    """{'YYYY-MM': {...}} cộng dồn từ bảng theo ngày"""
+    series = {}
+    for day, point in daily_series(start_day, end_day, storage).items():
+        month = series.setdefault(day[:7], _empty_point())
+        for key, value in point.items():
+            month[key] += value
+    return series
+
+
+def hourly_series(start_day, end_day, storage=None):
+    """{'HH:00 dd/mm': {...}} theo giờ Việt Nam cho khoảng ngày ngắn (ví dụ 1-2 ngày gần nhất)"""
+    storage = storage or get_storage()
+    start_ts, end_ts = vietnam_range_bounds(start_day, end_day)
+    series = {}
+    for hour_ts in range(start_ts - start_ts % 3600, end_ts, 3600):
+        label = datetime.fromtimestamp(hour_ts, VIETNAM_TZ).strftime('%H:00 %d/%m')
+        series[hour_ts] = (label, _empty_point())
+    for metric, hour_ts, count, total_seconds in storage.analytics_hourly(start_ts, end_ts):
+        if hour_ts in series:
+            _add_row(series[hour_ts][1], metric, count, total_seconds)
+    return dict(series.values())
+
+
+# ================ TỔNG HỢP ================
+def average_answer_seconds(point):
+    """Thời gian chờ phản hồi chính thức đầu tiên trung bình (giây), None nếu chưa có"""
+    if not point['answered']:
+        return None
+    return point['answer_seconds'] / point['answered']
+
+
+def average_resolve_seconds(point):
+    """Thời gian trung bình từ lúc gửi phản ánh tới lúc xử lý xong (giây), None nếu chưa có"""
+    if not point['resolved']:
+        return None
+    return point['resolve_seconds'] / point['resolved']
+
+
+def summary(start_day, end_day, storage=None):
+    """Số liệu tổng trong khoảng ngày và số câu hỏi còn chờ trả lời (toàn thời gian)"""
+    storage = storage or get_storage()
+    total = _empty_point()
+    for point in daily_series(start_day, end_day, storage).values():
+        for key, value in point.items():
+            total[key] += value
+
+    totals = storage.analytics_totals()
+    asked = totals.get('questions', (0, 0))[0]
+    answered = totals.get('answered', (0, 0))[0]
+    return {
+        'reports': total['reports'],
+        'questions': total['questions'],
+        'answered': total['answered'],
+        'resolved': total['resolved'],
+        'avg_answer_seconds': average_answer_seconds(total),
+        'avg_resolve_seconds': average_resolve_seconds(total),
+        'pending': max(asked - answered, 0),
+    }
+
+
+def format_duration(seconds):
+    """Hiển thị thời lượng dạng '2 giờ 15 phút'"""
+    if seconds is None:
+        return "N/A"
+    minutes = int(seconds) // 60
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days} ngày {hours} giờ"
+    if hours:
+        return f"{hours} giờ {minutes} phút"
+    return f"{minutes} phút"
+
+
+# ================ BẢN ĐỒ NHIỆT ================
+def heatmap_points(start_day, end_day, storage=None):
+    """[(lat, lon, count)] tâm mỗi ô lưới có phản ánh - đọc từ report_cells, không quét phản ánh"""
+    storage = storage or get_storage()
+    return [(*decode_geohash(cell), count)
+            for cell, count in storage.report_cell_counts(start_day, end_day)]
+
+
+# ================ GIAO DIỆN QUẢN TRỊ ================
+def _series_frame(series, index_name):
+    """DataFrame cho biểu đồ - pandas chỉ được import khi mở trang thống kê"""
+    import pandas as pd
+
+    frame = pd.DataFrame.from_dict(series, orient='index')
+    frame.index.name = index_name
+    return frame
+
+
+def render_dashboard():
+    """Tab thống kê cho tài khoản admin (gọi bên trong `with tab:` của Streamlit)"""
+    import streamlit as st
+
+    st.subheader("📊 Thống kê phản ánh & diễn đàn")
+
+    period = st.selectbox("Khoảng thời gian", [7, 30, 90, 365], index=1,
+                          format_func=lambda d: f"{d} ngày gần nhất")
+    start_day, end_day = last_days(period)
+    stats = summary(start_day, end_day)
+
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+    with col1:
+        st.metric("Phản ánh", stats['reports'])
+    with col2:
+        st.metric("Câu hỏi", stats['questions'])
+    with col3:
+        st.metric("Đã trả lời", stats['answered'])
+    with col4:
+        st.metric("Đang chờ", stats['pending'])
+    with col5:
+        st.metric("Phản hồi TB", format_duration(stats['avg_answer_seconds']))
+    with col6:
+        st.metric("Xử lý TB", format_duration(stats['avg_resolve_seconds']),
+                  help=f"{stats['resolved']} phản ánh đã xử lý xong trong khoảng này")
+
+    daily = daily_series(start_day, end_day)
+    labels = [METRIC_LABELS[m] for m in METRICS]
+    frame = _series_frame(daily, 'Ngày')[list(METRICS)]
+    frame.columns = labels
+
+    if period > 90:
+        st.markdown("#### 📅 Theo tháng")
+        monthly = _series_frame(monthly_series(start_day, end_day), 'Tháng')[list(METRICS)]
+        monthly.columns = labels
+        st.bar_chart(monthly)
+    else:
+        st.markdown("#### 📅 Theo ngày")
+        st.bar_chart(frame)
+
+    st.markdown("#### ⏱️ Thời gian phản hồi chính thức đầu tiên (giờ)")
+    response = _series_frame(
+        {day: {'Giờ': average_answer_seconds(point) / 3600 if point['answered'] else None}
+         for day, point in daily.items()},
+        'Ngày',
+    )
+    st.line_chart(response)
+
+    st.markdown("#### 🕐 48 giờ qua")
+    hourly = _series_frame(hourly_series(last_days(2)[0], end_day), 'Giờ')[list(METRICS)]
+    hourly.columns = labels
+    st.bar_chart(hourly)
+
+
+def render_heatmap():
+    """Bản đồ điểm nóng phản ánh cho tài khoản công an"""
+    import pandas as pd
+    import streamlit as st
+
+    st.subheader("🗺️ Bản đồ điểm nóng phản ánh")
+
+    period = st.selectbox("Khoảng thời gian", [7, 30, 90, 180, 365], index=2,
+                          format_func=lambda d: f"{d} ngày gần nhất", key="heatmap_period")
+    points = heatmap_points(*last_days(period))
+    if not points:
+        st.info("Chưa có phản ánh nào kèm tọa độ trong khoảng thời gian này.")
+        return
+
+    frame = pd.DataFrame(points, columns=['lat', 'lon', 'count'])
+    peak = frame['count'].max()
+    # Ô càng nhiều phản ánh càng to và càng đỏ
+    frame['size'] = 150 + 850 * frame['count'] / peak
+    frame['color'] = [f"#ff{int(200 * (1 - c / peak)):02x}00c0" for c in frame['count']]
+    st.map(frame, latitude='lat', longitude='lon', size='size', color='color')
+    st.caption(f"{int(frame['count'].sum())} phản ánh có tọa độ • {len(frame)} ô lưới • "
+               f"ô đông nhất: {int(peak)} phản ánh")
@@ -0,0 +1,296 @@
+# archive.py - Chuyển phản ánh / chủ đề diễn đàn cũ sang file database theo tháng
+#
+# Database đang dùng (community_app.db) chỉ giữ dữ liệu "nóng" để vừa page cache.
+# Dòng cũ được chuyển sang archive/community_YYYY_MM.db (tháng theo giờ Việt Nam)
+# và chỉ được ATTACH chế độ chỉ đọc khi cần tìm kiếm / thống kê.
+#
+# Chạy định kỳ (cron):  python archive.py --retention-days 180 --vacuum
+import argparse
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+import database
+from data_access import like_pattern
+from timeutils import VIETNAM_TZ, now_epoch
+
+ARCHIVE_DIR = 'archive'
+RETENTION_DAYS = 180
+ARCHIVE_ALIAS = 'arch'
+
+# Tháng (giờ Việt Nam) của một cột epoch, dạng 'YYYY_MM' - trùng với tên file lưu trữ
+MONTH_EXPR = "strftime('%Y_%m', {col}, 'unixepoch', '+7 hours')"
+
+# Điều kiện chọn dòng cần lưu trữ (tham số: cutoff, month)
+# Chỉ chuyển phản ánh đã xử lý xong; phản ánh chưa ai nhận / đang xử lý vẫn ở hàng đợi trong database chính
+REPORT_WHERE = (f"created_ts < ? AND status = '{database.REPORT_RESOLVED}' "
+                f"AND {MONTH_EXPR.format(col='created_ts')} = ?")
+# Chỉ chuyển chủ đề đã được trả lời; câu hỏi chờ trả lời vẫn ở database chính
+POST_WHERE = f"created_ts < ? AND is_answered = 1 AND {MONTH_EXPR.format(col='created_ts')} = ?"
+
+REPORT_COLUMNS = 'id, title, description, location, incident_time, created_ts, email_sent'
+POST_COLUMNS = 'id, title, content, category, anonymous_id, created_ts, reply_count, is_answered'
+
+
+def archive_path(month, archive_dir=ARCHIVE_DIR):
+    """Đường dẫn file lưu trữ của tháng 'YYYY_MM'"""
+    return os.path.join(archive_dir, f'community_{month}.db')
+
+
+def list_archive_months(archive_dir=ARCHIVE_DIR):
+    """Các tháng đã có file lưu trữ, tăng dần"""
+    if not os.path.isdir(archive_dir):
+        return []
+    months = []
+    for name in os.listdir(archive_dir):
+        if name.startswith('community_') and name.endswith('.db'):
+            months.append(name[len('community_'):-len('.db')])
+    return sorted(months)
+
+
+def month_key(ts):
+    return datetime.fromtimestamp(ts, VIETNAM_TZ).strftime('%Y_%m')
+
+
+def month_end_ts(month):
+    """Epoch đầu tháng kế tiếp (giờ Việt Nam) của tháng 'YYYY_MM'"""
+    year, mon = (int(part) for part in month.split('_'))
+    year, mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+    return int(VIETNAM_TZ.localize(datetime(year, mon, 1)).timestamp())
+
+
+def archive_months_between(start_ts=None, end_ts=None, archive_dir=ARCHIVE_DIR):
+    """Các file lưu trữ có thể chứa dữ liệu trong khoảng [start_ts, end_ts)"""
+    months = list_archive_months(archive_dir)
+    if start_ts is not None:
+        months = [m for m in months if m >= month_key(start_ts)]
+    if end_ts is not None:
+        months = [m for m in months if m <= month_key(end_ts - 1)]
+    return months
+
+
+# ================ GHI: CHUYỂN DỮ LIỆU CŨ ================
+def _ensure_archive_table(conn, table):
+    """Tạo bảng trong file lưu trữ theo cột của bảng chính (thêm cột mới nếu thiếu)"""
+    hot_columns = [(row[1], row[2]) for row in conn.execute(f'PRAGMA main.table_info({table})')]
+    archived = {row[1] for row in conn.execute(f'PRAGMA {ARCHIVE_ALIAS}.table_info({table})')}
+
+    if not archived:
+        columns = ', '.join(
+            f'{name} INTEGER PRIMARY KEY' if name == 'id' else f'{name} {decl}'
+            for name, decl in hot_columns
+        )
+        conn.execute(f'CREATE TABLE {ARCHIVE_ALIAS}.{table} ({columns})')
+        conn.execute(f'CREATE INDEX {ARCHIVE_ALIAS}.idx_{table}_created_ts ON {table}(created_ts)')
+    else:
+        for name, decl in hot_columns:
+            if name not in archived:
+                conn.execute(f'ALTER TABLE {ARCHIVE_ALIAS}.{table} ADD COLUMN {name} {decl}')
+
+    return ', '.join(name for name, _ in hot_columns)
+
+
+def _archive_month(conn, month, cutoff, archive_dir):
+    conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_ALIAS}', (archive_path(month, archive_dir),))
+    try:
+        columns = {table: _ensure_archive_table(conn, table)
+                   for table in ('security_reports', 'forum_posts', 'forum_replies')}
+        params = (cutoff, month)
+        reply_where = f'post_id IN (SELECT id FROM main.forum_posts WHERE {POST_WHERE})'
+
+        # Một transaction: cờ 'archiving' tắt trigger trừ bộ đếm, rồi sao chép + xóa.
+        # INSERT OR REPLACE giúp chạy lại an toàn nếu lần trước bị ngắt giữa chừng.
+        conn.execute('INSERT OR REPLACE INTO maintenance_flags (name) VALUES (?)', (database.ARCHIVING_FLAG,))
+        moved = {}
+        for table, where in (('security_reports', REPORT_WHERE),
+                             ('forum_replies', reply_where),
+                             ('forum_posts', POST_WHERE)):
+            cols = columns[table]
+            conn.execute(f'''
+                INSERT OR REPLACE INTO {ARCHIVE_ALIAS}.{table} ({cols})
+                SELECT {cols} FROM main.{table} WHERE {where}
+            ''', params)
+            moved[table] = conn.execute(f'DELETE FROM main.{table} WHERE {where}', params).rowcount
+        conn.execute('DELETE FROM maintenance_flags WHERE name = ?', (database.ARCHIVING_FLAG,))
+        conn.commit()
+        return moved
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute(f'DETACH DATABASE {ARCHIVE_ALIAS}')
+
+
+def archive_old_rows(db_path=None, retention_days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR, now=None):
+    """Chuyển phản ánh đã xử lý và chủ đề đã trả lời cũ hơn retention_days sang file theo tháng"""
+    cutoff = (now if now is not None else now_epoch()) - retention_days * 86400
+    os.makedirs(archive_dir, exist_ok=True)
+
+    totals = {'security_reports': 0, 'forum_posts': 0, 'forum_replies': 0}
+    conn = database.get_connection(db_path)
+    try:
+        months = {row[0] for row in conn.execute(
+            f"SELECT DISTINCT {MONTH_EXPR.format(col='created_ts')} FROM security_reports "
+            f"WHERE created_ts < ? AND status = ?", (cutoff, database.REPORT_RESOLVED))}
+        months |= {row[0] for row in conn.execute(
+            f"SELECT DISTINCT {MONTH_EXPR.format(col='created_ts')} FROM forum_posts "
+            f"WHERE created_ts < ? AND is_answered = 1", (cutoff,))}
+
+        for month in sorted(months):
+            for table, count in _archive_month(conn, month, cutoff, archive_dir).items():
+                totals[table] += count
+    finally:
+        conn.close()
+    return totals
+
+
+def vacuum(db_path=None):
+    """Thu hồi dung lượng của database chính sau khi lưu trữ"""
+    conn = database.get_connection(db_path)
+    try:
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+
+# ================ ĐỌC: TRUY VẤN XUYÊN LƯU TRỮ ================
+@contextmanager
+def attached_archive(conn, month, archive_dir=ARCHIVE_DIR, alias=ARCHIVE_ALIAS):
+    """ATTACH file lưu trữ chế độ chỉ đọc (conn phải mở với uri=True)"""
+    uri = f'file:{os.path.abspath(archive_path(month, archive_dir))}?mode=ro'
+    conn.execute(f'ATTACH DATABASE ? AS {alias}', (uri,))
+    try:
+        yield alias
+    finally:
+        conn.execute(f'DETACH DATABASE {alias}')
+
+
+def _range_filter(start_ts, end_ts):
+    clauses, params = [], []
+    if start_ts is not None:
+        clauses.append('created_ts >= ?')
+        params.append(start_ts)
+    if end_ts is not None:
+        clauses.append('created_ts < ?')
+        params.append(end_ts)
+    return clauses, params
+
+
+def _search(table, columns, text_columns, keyword, start_ts, end_ts, limit,
+            db_path, archive_dir, include_archive):
+    clauses, params = _range_filter(start_ts, end_ts)
+    if keyword:
+        # % và _ người dùng gõ là ký tự thường, không phải ký tự đại diện
+        clauses.append('(' + ' OR '.join(f"{col} LIKE ? ESCAPE '\\'" for col in text_columns) + ')')
+        params.extend([like_pattern(keyword)] * len(text_columns))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+
+    def query(schema, source):
+        return conn.execute(f'''
+            SELECT {columns}, ? FROM {schema}.{table} {where}
+            ORDER BY created_ts DESC LIMIT ?
+        ''', (source, *params, limit)).fetchall()
+
+    conn = database.get_connection(db_path, uri=True)
+    try:
+        rows = query('main', 'hot')
+        if include_archive:
+            # Tháng mới trước; dừng khi limit dòng mới nhất đều mới hơn cả tháng kế tiếp
+            for month in reversed(archive_months_between(start_ts, end_ts, archive_dir)):
+                rows.sort(key=lambda row: row[5], reverse=True)
+                if len(rows) >= limit and rows[limit - 1][5] >= month_end_ts(month):
+                    break
+                with attached_archive(conn, month, archive_dir) as alias:
+                    rows.extend(query(alias, month))
+    finally:
+        conn.close()
+
+    rows.sort(key=lambda row: row[5], reverse=True)
+    return rows[:limit]
+
+
+def search_reports(keyword='', start_ts=None, end_ts=None, limit=100,
+                   db_path=None, archive_dir=ARCHIVE_DIR, include_archive=True):
+    """
+    Tìm phản ánh trong database chính và các file lưu trữ.
+    Mỗi dòng: (id, title, description, location, incident_time, created_ts, email_sent, nguồn)
+    với nguồn = 'hot' hoặc tháng 'YYYY_MM'.
+    """
+    return _search('security_reports', REPORT_COLUMNS, ('title', 'description', 'location'),
+                   keyword, start_ts, end_ts, limit, db_path, archive_dir, include_archive)
+
+
+def search_forum_posts(keyword='', start_ts=None, end_ts=None, limit=100,
+                       db_path=None, archive_dir=ARCHIVE_DIR, include_archive=True):
+    """Tìm câu hỏi diễn đàn (cột như data_access.POST_COLUMNS + nguồn)"""
+    return _search('forum_posts', POST_COLUMNS, ('content',),
+                   keyword, start_ts, end_ts, limit, db_path, archive_dir, include_archive)
+
+
+def count_reports_between(start_ts, end_ts, db_path=None, archive_dir=ARCHIVE_DIR):
+    """Đếm phản ánh trong [start_ts, end_ts) kể cả dữ liệu đã lưu trữ (quét theo index)"""
+    conn = database.get_connection(db_path, uri=True)
+    try:
+        total = database.count_reports_between(conn, start_ts, end_ts)
+        for month in archive_months_between(start_ts, end_ts, archive_dir):
+            with attached_archive(conn, month, archive_dir) as alias:
+                total += conn.execute(
+                    f'SELECT COUNT(*) FROM {alias}.security_reports WHERE created_ts >= ? AND created_ts < ?',
+                    (start_ts, end_ts)
+                ).fetchone()[0]
+        return total
+    finally:
+        conn.close()
+
+
+def archived_rollup_rows(db_path=None, archive_dir=ARCHIVE_DIR):
+    """
+    Bộ đếm, thống kê giờ / ngày và ô lưới tính từ mọi file lưu trữ (ATTACH chỉ đọc từng file),
+    để storage.rebuild_rollups cộng vào phần tính từ database chính.
+    """
+    rows = {'counters': [], 'hourly': [], 'daily': [], 'cells': []}
+    months = list_archive_months(archive_dir)
+    if not months:
+        return rows
+
+    # Chỉ SELECT (không mở transaction) nên DETACH được ngay sau mỗi tháng
+    conn = database.get_connection(db_path, uri=True)
+    try:
+        for month in months:
+            with attached_archive(conn, month, archive_dir) as alias:
+                rows['counters'] += database.counter_rows(conn, alias)
+                hourly, daily = database.analytics_rows(conn, alias)
+                rows['hourly'] += hourly
+                rows['daily'] += daily
+                rows['cells'] += database.report_cell_rows(conn, alias)
+    finally:
+        conn.close()
+    return rows
+
+
+# ================ CHẠY TỪ DÒNG LỆNH ================
+def main():
+    from storage import load_storage_config
+
+    parser = argparse.ArgumentParser(description="Lưu trữ phản ánh và chủ đề diễn đàn cũ theo tháng")
+    parser.add_argument('--db', help="Đường dẫn database SQLite (mặc định theo cấu hình)")
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    parser.add_argument('--retention-days', type=int, default=RETENTION_DAYS)
+    parser.add_argument('--vacuum', action='store_true', help="VACUUM database chính sau khi chuyển")
+    args = parser.parse_args()
+
+    config = load_storage_config()
+    if config['backend'] != 'sqlite' and not args.db:
+        parser.error("Lưu trữ theo file tháng chỉ áp dụng cho backend SQLite")
+    db_path = args.db or config['path']
+
+    moved = archive_old_rows(db_path, args.retention_days, args.archive_dir)
+    print(f"✅ Đã lưu trữ: {moved['security_reports']} phản ánh, "
+          f"{moved['forum_posts']} câu hỏi, {moved['forum_replies']} bình luận")
+    if args.vacuum:
+        vacuum(db_path)
+        print("🧹 Đã VACUUM database chính")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+# data_access.py - Đọc dữ liệu diễn đàn thẳng từ cursor sqlite3, không qua pandas
+from database import REPORT_ASSIGNED, REPORT_RECEIVED
+from timeutils import format_epochs
+
+# Thứ tự cột SELECT mà các bản ghi bên dưới mong đợi
+POST_COLUMNS = 'id, title, content, category, anonymous_id, created_ts, reply_count, is_answered'
+REPLY_COLUMNS = 'id, content, author_type, display_name, is_official, created_ts'
+# Danh sách phản ánh chỉ đọc cột ngắn; nội dung đầy đủ chỉ tải khi mở chi tiết
+REPORT_COLUMNS = 'id, title, location, is_urgent, email_sent, status, assigned_to, created_ts'
+REPORT_DETAIL_COLUMNS = ('id, title, description, location, incident_time, latitude, longitude, '
+                         'is_urgent, email_sent, status, assigned_to, assigned_ts, resolved_ts, created_ts')
+
+
+# ================ BẢN GHI GỌN NHẸ ================
+class ForumPost:
+    """Một bài đăng diễn đàn (dùng __slots__ để tiết kiệm bộ nhớ)"""
+    __slots__ = ('id', 'title', 'content', 'category', 'anonymous_id',
+                 'created_ts', 'reply_count', 'is_answered', 'formatted_date')
+
+    def __init__(self, id, title, content, category, anonymous_id,
+                 created_ts, reply_count, is_answered, formatted_date="N/A"):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.category = category
+        self.anonymous_id = anonymous_id
+        self.created_ts = created_ts
+        self.reply_count = reply_count
+        self.is_answered = is_answered
+        self.formatted_date = formatted_date
+
+
+class ForumReply:
+    """Một bình luận của bài đăng"""
+    __slots__ = ('id', 'content', 'author_type', 'display_name',
+                 'is_official', 'created_ts', 'formatted_date')
+
+    def __init__(self, id, content, author_type, display_name,
+                 is_official, created_ts, formatted_date="N/A"):
+        self.id = id
+        self.content = content
+        self.author_type = author_type
+        self.display_name = display_name
+        self.is_official = is_official
+        self.created_ts = created_ts
+        self.formatted_date = formatted_date
+
+
+class ReportSummary:
+    """Một dòng trong danh sách phản ánh của công an (không kèm nội dung)"""
+    __slots__ = ('id', 'title', 'location', 'is_urgent', 'email_sent', 'status', 'assigned_to',
+                 'created_ts', 'formatted_date')
+
+    def __init__(self, id, title, location, is_urgent, email_sent, status, assigned_to,
+                 created_ts, formatted_date="N/A"):
+        self.id = id
+        self.title = title
+        self.location = location
+        self.is_urgent = bool(is_urgent)
+        self.email_sent = bool(email_sent)
+        self.status = status
+        self.assigned_to = assigned_to
+        self.created_ts = created_ts
+        self.formatted_date = formatted_date
+
+
+class ReportDetail:
+    """Toàn bộ nội dung một phản ánh"""
+    __slots__ = ('id', 'title', 'description', 'location', 'incident_time', 'latitude', 'longitude',
+                 'is_urgent', 'email_sent', 'status', 'assigned_to', 'assigned_ts', 'resolved_ts',
+                 'created_ts', 'formatted_date')
+
+    def __init__(self, id, title, description, location, incident_time, latitude, longitude,
+                 is_urgent, email_sent, status, assigned_to, assigned_ts, resolved_ts,
+                 created_ts, formatted_date="N/A"):
+        self.id = id
+        self.title = title
+        self.description = description
+        self.location = location
+        self.incident_time = incident_time
+        self.latitude = latitude
+        self.longitude = longitude
+        self.is_urgent = bool(is_urgent)
+        self.email_sent = bool(email_sent)
+        self.status = status
+        self.assigned_to = assigned_to
+        self.assigned_ts = assigned_ts
+        self.resolved_ts = resolved_ts
+        self.created_ts = created_ts
+        self.formatted_date = formatted_date
+
+
+def _build_records(record_cls, rows, time_index):
+    # Chuyển epoch UTC sang giờ Việt Nam cho cả tập kết quả trong một bước
+    formatted = format_epochs([row[time_index] for row in rows])
+    return [record_cls(*row, formatted_date) for row, formatted_date in zip(rows, formatted)]
+
+
+def build_forum_posts(rows):
+    """Dựng list[ForumPost] từ các dòng theo thứ tự POST_COLUMNS (dùng cho mọi backend)"""
+    return _build_records(ForumPost, rows, 5)
+
+
+def build_forum_replies(rows):
+    """Dựng list[ForumReply] từ các dòng theo thứ tự REPLY_COLUMNS"""
+    return _build_records(ForumReply, rows, 5)
+
+
+def build_report_summaries(rows):
+    """Dựng list[ReportSummary] từ các dòng theo thứ tự REPORT_COLUMNS"""
+    return _build_records(ReportSummary, rows, 7)
+
+
+def build_report_detail(row):
+    """ReportDetail từ một dòng theo thứ tự REPORT_DETAIL_COLUMNS (None nếu không có)"""
+    if row is None:
+        return None
+    return _build_records(ReportDetail, [row], 13)[0]
+
+
+# ================ LỌC PHẢN ÁNH ================
+# Cú pháp khác nhau giữa hai backend. Điều kiện email_sent được viết đúng như
+# predicate của idx_reports_unsent để bộ lập kế hoạch dùng được index từng phần.
+REPORT_FILTER_DIALECTS = {
+    'sqlite': {'param': '?', 'sent': 'email_sent = 1', 'unsent': 'email_sent = 0', 'like': 'LIKE'},
+    'postgres': {'param': '%s', 'sent': 'email_sent', 'unsent': 'NOT email_sent', 'like': 'ILIKE'},
+}
+
+# Cột được tìm theo từ khóa
+REPORT_KEYWORD_COLUMNS = ('title', 'location', 'description')
+
+
+def like_pattern(keyword):
+    """Mẫu LIKE '%từ khóa%' với %, _ và \\ trong từ khóa được thoát (dùng kèm ESCAPE '\\')"""
+    escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def report_page_query(dialect, start_ts, end_ts, email_sent=None, keyword=None, before=None, limit=25):
+    """
+    (sql, params) cho một trang phản ánh mới nhất trước, lọc theo khoảng epoch [start_ts, end_ts),
+    trạng thái email (None = tất cả) và từ khóa.
+
+    Phân trang theo khóa: before = (created_ts, id) của dòng cuối trang trước, nên trang
+    sau cũng chỉ đọc tiếp trên index created_ts, không bỏ qua OFFSET dòng như LIMIT/OFFSET.
+    """
+    syntax = REPORT_FILTER_DIALECTS[dialect]
+    p = syntax['param']
+    where = [f'created_ts >= {p}', f'created_ts < {p}']
+    params = [start_ts, end_ts]
+    if email_sent is not None:
+        where.append(syntax['sent'] if email_sent else syntax['unsent'])
+    if before is not None:
+        where.append(f'(created_ts, id) < ({p}, {p})')
+        params.extend(before)
+    keyword = (keyword or '').strip()
+    if keyword:
+        pattern = like_pattern(keyword)
+        where.append('(' + ' OR '.join(f"{column} {syntax['like']} {p} ESCAPE '\\'"
+                                        for column in REPORT_KEYWORD_COLUMNS) + ')')
+        params.extend([pattern] * len(REPORT_KEYWORD_COLUMNS))
+    params.append(limit)
+    sql = f'''
+        SELECT {REPORT_COLUMNS}
+        FROM security_reports
+        WHERE {' AND '.join(where)}
+        ORDER BY created_ts DESC, id DESC
+        LIMIT {p}
+    '''
+    return sql, params
+
+
+def report_queue_query(dialect, assigned_to=None, after=None, limit=25):
+    """
+    (sql, params) cho hàng đợi phản ánh đang mở, cũ nhất trước: assigned_to=None là phản ánh
+    chưa ai nhận, ngược lại là phản ánh cán bộ đó đang xử lý. after = (created_ts, id) của dòng cuối trang trước.
+
+    Điều kiện status được viết thẳng vào câu lệnh (không qua tham số) để khớp predicate của
+    idx_reports_unassigned / idx_reports_assignee_open - chỉ đọc phản ánh đang mở, bất kể
+    đã có bao nhiêu phản ánh xử lý xong.
+    """
+    p = REPORT_FILTER_DIALECTS[dialect]['param']
+    if assigned_to is None:
+        where = [f"status = '{REPORT_RECEIVED}'"]
+        params = []
+    else:
+        where = [f"status = '{REPORT_ASSIGNED}'", f'assigned_to = {p}']
+        params = [assigned_to]
+    if after is not None:
+        where.append(f'(created_ts, id) > ({p}, {p})')
+        params.extend(after)
+    params.append(limit)
+    sql = f'''
+        SELECT {REPORT_COLUMNS}
+        FROM security_reports
+        WHERE {' AND '.join(where)}
+        ORDER BY created_ts, id
+        LIMIT {p}
+    '''
+    return sql, params
+
+
+# ================ TRUY VẤN ================
+def fetch_forum_posts(conn, category=None, limit=50):
+    """Lấy danh sách bài đăng mới nhất dạng list[ForumPost]"""
+    query = f'SELECT {POST_COLUMNS} FROM forum_posts'
+    params = []
+    if category:
+        query += " WHERE category = ?"
+        params.append(category)
+    query += " ORDER BY created_ts DESC LIMIT ?"
+    params.append(limit)
+
+    rows = conn.execute(query, params).fetchall()
+    return build_forum_posts(rows)
+
+
+def fetch_unanswered_posts(conn, after=None, limit=25):
+    """
+    Câu hỏi chưa có phản hồi chính thức, cũ nhất trước, dạng list[ForumPost].
+    Đọc theo idx_forum_posts_unanswered (chỉ chứa is_answered = 0); after = (created_ts, id) của dòng cuối trang trước.
+    """
+    query = f'SELECT {POST_COLUMNS} FROM forum_posts WHERE is_answered = 0'
+    params = []
+    if after is not None:
+        query += ' AND (created_ts, id) > (?, ?)'
+        params.extend(after)
+    query += ' ORDER BY created_ts, id LIMIT ?'
+    params.append(limit)
+    return build_forum_posts(conn.execute(query, params).fetchall())
+
+
+def fetch_forum_replies(conn, post_id):
+    """Lấy bình luận của một bài đăng dạng list[ForumReply]"""
+    rows = conn.execute(f'''
+        SELECT {REPLY_COLUMNS}
+        FROM forum_replies
+        WHERE post_id = ?
+        ORDER BY created_ts ASC, id ASC
+    ''', (post_id,)).fetchall()
+    return build_forum_replies(rows)
+
+
+def fetch_report_page(conn, start_ts, end_ts, email_sent=None, keyword=None, before=None, limit=25):
+    """Một trang phản ánh dạng list[ReportSummary] (xem report_page_query)"""
+    sql, params = report_page_query('sqlite', start_ts, end_ts, email_sent, keyword, before, limit)
+    return build_report_summaries(conn.execute(sql, params).fetchall())
+
+
+def fetch_report_queue(conn, assigned_to=None, after=None, limit=25):
+    """Một trang hàng đợi phản ánh đang mở dạng list[ReportSummary] (xem report_queue_query)"""
+    sql, params = report_queue_query('sqlite', assigned_to, after, limit)
+    return build_report_summaries(conn.execute(sql, params).fetchall())
+
+
+def fetch_report_detail(conn, report_id):
+    """Nội dung đầy đủ một phản ánh theo khóa chính"""
+    row = conn.execute(f'SELECT {REPORT_DETAIL_COLUMNS} FROM security_reports WHERE id = ?',
+                       (report_id,)).fetchone()
+    return build_report_detail(row)
+
+
+# ================ CHUYỂN SANG PANDAS (CHỈ CHO PHÂN TÍCH) ================
+def to_dataframe(records):
+    """Chuyển danh sách bản ghi sang DataFrame - pandas chỉ được import khi thật sự cần"""
+    import pandas as pd
+
+    if not records:
+        return pd.DataFrame()
+    columns = type(records[0]).__slots__
+    return pd.DataFrame([[getattr(r, col) for col in columns] for r in records], columns=columns)
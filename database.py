@@ -0,0 +1,585 @@
+# database.py - Kết nối và lược đồ SQLite dùng chung cho main.py / main1.py
+import sqlite3
+
+from geo import CELL_PRECISION
+
+# ================ CẤU HÌNH DATABASE ================
+DB_PATH = 'community_app.db'
+
+# Tăng khi lược đồ/trigger thay đổi; lưu trong PRAGMA user_version
+SCHEMA_VERSION = 9
+# Phiên bản cuối cùng đổi cách tính bucket: database cũ hơn phải đếm lại
+COUNTER_REBUILD_VERSION = 2
+
+# Bucket rỗng = tổng toàn thời gian, bucket 'YYYY-MM-DD' = theo ngày (giờ VN)
+TOTAL_BUCKET = ''
+
+# Trạng thái email trong hàng đợi gửi (outbox.py)
+OUTBOX_PENDING = 'pending'
+OUTBOX_SENDING = 'sending'
+OUTBOX_SENT = 'sent'
+OUTBOX_DEAD = 'dead'
+
+# Quy trình xử lý phản ánh: tiếp nhận -> cán bộ nhận xử lý -> đã xử lý
+REPORT_RECEIVED = 'received'
+REPORT_ASSIGNED = 'assigned'
+REPORT_RESOLVED = 'resolved'
+# Phản ánh có từ trước khi có quy trình (nâng cấp database cũ) coi như đã xử lý xong lúc gửi:
+# không làm ngập hàng đợi và vẫn được lưu trữ. Không có cán bộ xử lý (assigned_to NULL) nên
+# không tính vào thời gian xử lý của bảng tổng hợp.
+LEGACY_REPORTS_RESOLVED = f"UPDATE security_reports SET status = '{REPORT_RESOLVED}', resolved_ts = created_ts"
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS security_reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        location TEXT,
+        incident_time TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_ts INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+        ip_hash TEXT,
+        email_sent BOOLEAN DEFAULT 0,
+        latitude REAL,
+        longitude REAL,
+        geohash TEXT,
+        is_urgent BOOLEAN DEFAULT 0,
+        idempotency_key TEXT,
+        status TEXT NOT NULL DEFAULT 'received',
+        assigned_to TEXT,
+        assigned_ts INTEGER,
+        resolved_ts INTEGER
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS forum_posts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT DEFAULT 'Câu hỏi từ người dân',
+        content TEXT NOT NULL,
+        category TEXT DEFAULT 'Hỏi đáp pháp luật',
+        anonymous_id TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_ts INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+        reply_count INTEGER DEFAULT 0,
+        is_answered BOOLEAN DEFAULT 0,
+        first_answer_ts INTEGER,
+        idempotency_key TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS forum_replies (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        post_id INTEGER,
+        content TEXT NOT NULL,
+        author_type TEXT DEFAULT 'anonymous',
+        author_id TEXT,
+        display_name TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_ts INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+        is_official BOOLEAN DEFAULT 0,
+        FOREIGN KEY (post_id) REFERENCES forum_posts(id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS police_users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        badge_number TEXT UNIQUE NOT NULL,
+        display_name TEXT NOT NULL,
+        password_hash TEXT NOT NULL,
+        role TEXT DEFAULT 'officer'
+    )
+    ''',
+    # Bảng tổng hợp thống kê (analytics.py): metric = reports | questions | answered;
+    # total_seconds cộng dồn thời gian chờ phản hồi chính thức đầu tiên của 'answered'
+    '''
+    CREATE TABLE IF NOT EXISTS analytics_hourly (
+        metric TEXT NOT NULL,
+        hour_ts INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        total_seconds INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour_ts, metric)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS analytics_daily (
+        metric TEXT NOT NULL,
+        day TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        total_seconds INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, metric)
+    ) WITHOUT ROWID
+    ''',
+    # Số phản ánh theo ngày (giờ VN) và ô lưới geohash CELL_PRECISION - dữ liệu bản đồ nhiệt
+    '''
+    CREATE TABLE IF NOT EXISTS report_cells (
+        day TEXT NOT NULL,
+        cell TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, cell)
+    ) WITHOUT ROWID
+    ''',
+    # Email thông báo ghi cùng transaction với phản ánh, luồng nền gửi sau (outbox.py)
+    '''
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        report_id INTEGER,
+        payload TEXT NOT NULL,
+        urgent BOOLEAN NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_ts INTEGER NOT NULL,
+        last_error TEXT,
+        created_ts INTEGER NOT NULL,
+        sent_ts INTEGER
+    )
+    ''',
+    # Token bucket dùng chung giữa các tiến trình gửi email (rate_limit.SharedTokenBucket)
+    '''
+    CREATE TABLE IF NOT EXISTS rate_buckets (
+        name TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated REAL NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    # Lượt gửi bài theo khóa máy khách (rate_limit.SharedSlidingWindow), dọn dần khi hết hạn
+    '''
+    CREATE TABLE IF NOT EXISTS rate_events (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        ts REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS maintenance_flags (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 1
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_counters (
+        name TEXT NOT NULL,
+        bucket TEXT NOT NULL DEFAULT '',
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (name, bucket)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Cột thêm sau khi bảng đã có dữ liệu: (bảng, cột, khai báo, câu lệnh điền dữ liệu cũ)
+COLUMN_MIGRATIONS = [
+    ('security_reports', 'created_ts', 'INTEGER',
+     "UPDATE security_reports SET created_ts = CAST(strftime('%s', created_at) AS INTEGER) WHERE created_ts IS NULL"),
+    ('forum_posts', 'created_ts', 'INTEGER',
+     "UPDATE forum_posts SET created_ts = CAST(strftime('%s', created_at) AS INTEGER) WHERE created_ts IS NULL"),
+    ('forum_replies', 'created_ts', 'INTEGER',
+     "UPDATE forum_replies SET created_ts = CAST(strftime('%s', created_at) AS INTEGER) WHERE created_ts IS NULL"),
+    ('forum_posts', 'first_answer_ts', 'INTEGER',
+     '''UPDATE forum_posts SET first_answer_ts = (
+            SELECT MIN(created_ts) FROM forum_replies
+            WHERE forum_replies.post_id = forum_posts.id AND forum_replies.is_official = 1
+        )'''),
+    ('security_reports', 'latitude', 'REAL', None),
+    ('security_reports', 'longitude', 'REAL', None),
+    ('security_reports', 'geohash', 'TEXT', None),
+    ('security_reports', 'is_urgent', 'BOOLEAN DEFAULT 0', None),
+    ('email_outbox', 'urgent', 'BOOLEAN NOT NULL DEFAULT 0', None),
+    ('security_reports', 'idempotency_key', 'TEXT', None),
+    ('forum_posts', 'idempotency_key', 'TEXT', None),
+    ('security_reports', 'assigned_to', 'TEXT', None),
+    ('security_reports', 'assigned_ts', 'INTEGER', None),
+    ('security_reports', 'resolved_ts', 'INTEGER', None),
+    ('security_reports', 'status', "TEXT NOT NULL DEFAULT 'received'", LEGACY_REPORTS_RESOLVED),
+]
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_forum_replies_post_ts ON forum_replies(post_id, created_ts)',
+    'CREATE INDEX IF NOT EXISTS idx_reports_created_ts ON security_reports(created_ts)',
+    'CREATE INDEX IF NOT EXISTS idx_forum_posts_created_ts ON forum_posts(created_ts)',
+    'CREATE INDEX IF NOT EXISTS idx_forum_posts_category_ts ON forum_posts(category, created_ts)',
+    # Chỉ phản ánh có tọa độ: tra theo tiền tố geohash (khu vực)
+    'CREATE INDEX IF NOT EXISTS idx_reports_geohash ON security_reports(geohash) WHERE geohash IS NOT NULL',
+    # Chỉ email chưa gửi xong: tìm email tới hạn gửi không phải quét lịch sử đã gửi
+    '''CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(next_attempt_ts)
+       WHERE status IN ('pending', 'sending')''',
+    # Chỉ phản ánh chưa báo được cho công an: công cụ gửi lại (replay.py) không quét cả bảng
+    'CREATE INDEX IF NOT EXISTS idx_reports_unsent ON security_reports(created_ts, id) WHERE email_sent = 0',
+    # Email dead theo phản ánh: gửi lại thành công thì đóng luôn dòng outbox tương ứng
+    "CREATE INDEX IF NOT EXISTS idx_email_outbox_dead ON email_outbox(report_id) WHERE status = 'dead'",
+    'CREATE INDEX IF NOT EXISTS idx_rate_events_key ON rate_events(name, key, ts)',
+    # Mỗi lần điền biểu mẫu có một khóa: bấm gửi lại / rerun không tạo phản ánh, câu hỏi, email trùng
+    '''CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_idempotency ON security_reports(idempotency_key)
+       WHERE idempotency_key IS NOT NULL''',
+    '''CREATE UNIQUE INDEX IF NOT EXISTS idx_forum_posts_idempotency ON forum_posts(idempotency_key)
+       WHERE idempotency_key IS NOT NULL''',
+    # Hàng đợi công việc chỉ chứa phản ánh đang mở: phản ánh đã xử lý không làm index phình ra
+    f"CREATE INDEX IF NOT EXISTS idx_reports_unassigned ON security_reports(created_ts, id) "
+    f"WHERE status = '{REPORT_RECEIVED}'",
+    f"CREATE INDEX IF NOT EXISTS idx_reports_assignee_open ON security_reports(assigned_to, created_ts, id) "
+    f"WHERE status = '{REPORT_ASSIGNED}'",
+    # Câu hỏi chờ trả lời: hàng đợi của công an chỉ đọc phần chưa trả lời, bất kể diễn đàn lớn bao nhiêu
+    'CREATE INDEX IF NOT EXISTS idx_forum_posts_unanswered ON forum_posts(created_ts, id) WHERE is_answered = 0',
+]
+
+# Index của phiên bản cũ đã được thay thế
+OBSOLETE_INDEXES = ['idx_forum_replies_post']
+
+# ================ BỘ ĐẾM DUY TRÌ BẰNG TRIGGER ================
+# Mỗi lần thêm/xóa dòng, trigger cộng/trừ bộ đếm tổng và bộ đếm theo ngày
+# (created_ts là epoch UTC nên +7 giờ để ra ngày theo giờ Việt Nam).
+# Khi lưu trữ (archive.py) chuyển dòng sang file tháng, cờ 'archiving' được bật
+# trong cùng transaction để trigger DELETE không trừ bộ đếm toàn thời gian.
+ARCHIVING_FLAG = 'archiving'
+NOT_ARCHIVING = f"NOT EXISTS (SELECT 1 FROM maintenance_flags WHERE name = '{ARCHIVING_FLAG}')"
+
+COUNTER_DAY_EXPR = "date(COALESCE({row}.created_ts, CAST(strftime('%s', 'now') AS INTEGER)), 'unixepoch', '+7 hours')"
+
+
+def _counter_trigger(name, table, counter, event, delta):
+    row = 'NEW' if event == 'INSERT' else 'OLD'
+    day = COUNTER_DAY_EXPR.format(row=row)
+    when = f'WHEN {NOT_ARCHIVING}' if event == 'DELETE' else ''
+    return f'''
+    CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} {when}
+    BEGIN
+        INSERT INTO stats_counters (name, bucket, value) VALUES ('{counter}', '', {delta})
+            ON CONFLICT(name, bucket) DO UPDATE SET value = value + ({delta});
+        INSERT INTO stats_counters (name, bucket, value) VALUES ('{counter}', {day}, {delta})
+            ON CONFLICT(name, bucket) DO UPDATE SET value = value + ({delta});
+    END
+    '''
+
+
+TRIGGERS = [
+    _counter_trigger('trg_reports_count_ins', 'security_reports', 'reports', 'INSERT', 1),
+    _counter_trigger('trg_reports_count_del', 'security_reports', 'reports', 'DELETE', -1),
+    _counter_trigger('trg_posts_count_ins', 'forum_posts', 'posts', 'INSERT', 1),
+    _counter_trigger('trg_posts_count_del', 'forum_posts', 'posts', 'DELETE', -1),
+    _counter_trigger('trg_replies_count_ins', 'forum_replies', 'replies', 'INSERT', 1),
+    _counter_trigger('trg_replies_count_del', 'forum_replies', 'replies', 'DELETE', -1),
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_post_reply_count_ins AFTER INSERT ON forum_replies
+    BEGIN
+        UPDATE forum_posts SET reply_count = reply_count + 1 WHERE id = NEW.post_id;
+    END
+    ''',
+    # Lưu trữ xóa bình luận trước khi chép câu hỏi: giữ nguyên reply_count để bản lưu trữ đúng số
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_post_reply_count_del AFTER DELETE ON forum_replies WHEN {NOT_ARCHIVING}
+    BEGIN
+        UPDATE forum_posts SET reply_count = MAX(reply_count - 1, 0) WHERE id = OLD.post_id;
+    END
+    ''',
+]
+
+# ================ TỔNG HỢP THỐNG KÊ THEO GIỜ / NGÀY ================
+# Chỉ có trigger INSERT: lưu trữ (xóa khỏi database chính) không làm thay đổi lịch sử.
+ROW_TS = "COALESCE(NEW.created_ts, CAST(strftime('%s', 'now') AS INTEGER))"
+HOUR_EXPR = f"(({ROW_TS}) / 3600) * 3600"
+DAY_EXPR = f"date({ROW_TS}, 'unixepoch', '+7 hours')"
+
+
+def _rollup_upsert(table, bucket_column, bucket_expr, metric, seconds_expr='0', source='', where=''):
+    """INSERT ... ON CONFLICT cộng dồn vào một bảng tổng hợp"""
+    select = f"SELECT '{metric}', {bucket_expr}, 1, {seconds_expr} {source} WHERE {where or '1'}"
+    return f'''
+        INSERT INTO {table} (metric, {bucket_column}, count, total_seconds)
+        {select}
+        ON CONFLICT(metric, {bucket_column}) DO UPDATE SET
+            count = count + excluded.count,
+            total_seconds = total_seconds + excluded.total_seconds;'''
+
+
+def _rollup_trigger(name, table, metric):
+    return f'''
+    CREATE TRIGGER IF NOT EXISTS {name} AFTER INSERT ON {table}
+    BEGIN
+        {_rollup_upsert('analytics_hourly', 'hour_ts', HOUR_EXPR, metric)}
+        {_rollup_upsert('analytics_daily', 'day', DAY_EXPR, metric)}
+    END
+    '''
+
+
+# Phản hồi chính thức ĐẦU TIÊN của một câu hỏi: cộng 'answered' kèm thời gian chờ,
+# rồi ghi first_answer_ts để các phản hồi sau không bị tính lại
+_FIRST_ANSWER_SOURCE = 'FROM forum_posts p'
+_FIRST_ANSWER_WHERE = 'p.id = NEW.post_id AND p.first_answer_ts IS NULL'
+_FIRST_ANSWER_SECONDS = f'MAX({ROW_TS} - COALESCE(p.created_ts, {ROW_TS}), 0)'
+
+# Thời điểm xử lý xong: bucket theo resolved_ts thay vì created_ts
+_RESOLVED_TS = "COALESCE(NEW.resolved_ts, CAST(strftime('%s', 'now') AS INTEGER))"
+_RESOLVED_HOUR = f"(({_RESOLVED_TS}) / 3600) * 3600"
+_RESOLVED_DAY = f"date({_RESOLVED_TS}, 'unixepoch', '+7 hours')"
+_RESOLVED_SECONDS = f'MAX({_RESOLVED_TS} - COALESCE(NEW.created_ts, {_RESOLVED_TS}), 0)'
+
+TRIGGERS += [
+    _rollup_trigger('trg_analytics_reports', 'security_reports', 'reports'),
+    _rollup_trigger('trg_analytics_questions', 'forum_posts', 'questions'),
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_analytics_first_answer AFTER INSERT ON forum_replies
+    WHEN NEW.is_official = 1
+    BEGIN
+        {_rollup_upsert('analytics_hourly', 'hour_ts', HOUR_EXPR, 'answered',
+                        _FIRST_ANSWER_SECONDS, _FIRST_ANSWER_SOURCE, _FIRST_ANSWER_WHERE)}
+        {_rollup_upsert('analytics_daily', 'day', DAY_EXPR, 'answered',
+                        _FIRST_ANSWER_SECONDS, _FIRST_ANSWER_SOURCE, _FIRST_ANSWER_WHERE)}
+        UPDATE forum_posts SET first_answer_ts = {ROW_TS}
+        WHERE id = NEW.post_id AND first_answer_ts IS NULL;
+    END
+    ''',
+    # Phản ánh chuyển sang 'resolved' (một lần): cộng 'resolved' kèm thời gian từ lúc gửi tới lúc xử lý xong
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_analytics_resolved AFTER UPDATE OF status ON security_reports
+    WHEN NEW.status = '{REPORT_RESOLVED}' AND OLD.status <> '{REPORT_RESOLVED}'
+    BEGIN
+        {_rollup_upsert('analytics_hourly', 'hour_ts', _RESOLVED_HOUR, 'resolved', _RESOLVED_SECONDS)}
+        {_rollup_upsert('analytics_daily', 'day', _RESOLVED_DAY, 'resolved', _RESOLVED_SECONDS)}
+    END
+    ''',
+    # Ô lưới bản đồ nhiệt: cũng chỉ INSERT, lưu trữ không làm mất điểm nóng cũ
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_report_cells AFTER INSERT ON security_reports
+    WHEN NEW.geohash IS NOT NULL
+    BEGIN
+        INSERT INTO report_cells (day, cell, count)
+        VALUES ({DAY_EXPR}, substr(NEW.geohash, 1, {CELL_PRECISION}), 1)
+        ON CONFLICT(day, cell) DO UPDATE SET count = count + 1;
+    END
+    ''',
+]
+
+
+def get_connection(db_path=None, uri=False):
+    """Mở kết nối SQLite tới database của ứng dụng (uri=True để ATTACH file chỉ đọc)"""
+    return sqlite3.connect(db_path or DB_PATH, uri=uri)
+
+
+def _trigger_name(ddl):
+    return ddl.split('CREATE TRIGGER IF NOT EXISTS', 1)[1].split()[0]
+
+
+def _table_exists(conn, name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def _column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f'PRAGMA table_info({table})'))
+
+
+def add_column(conn, table, column, decl, backfill_sql=None):
+    """Thêm cột cho database cũ (bỏ qua nếu đã có) và điền dữ liệu cho các dòng cũ"""
+    if _column_exists(conn, table, column):
+        return False
+    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+    if backfill_sql:
+        conn.execute(backfill_sql)
+    return True
+
+
+# ---- Tính lại từ dữ liệu gốc ----
+# Mỗi hàm *_rows tổng hợp các bảng của một schema: 'main' hoặc file lưu trữ đã ATTACH
+# (archive.archived_rollup_rows), để dòng đã lưu trữ vẫn được tính khi tính lại.
+COUNTED_TABLES = (('reports', 'security_reports'), ('posts', 'forum_posts'), ('replies', 'forum_replies'))
+
+
+def counter_rows(conn, schema='main'):
+    """[(name, bucket, value)] bộ đếm toàn thời gian và theo ngày của các bảng trong schema"""
+    rows = []
+    for counter, table in COUNTED_TABLES:
+        rows += conn.execute(f"SELECT ?, '', COUNT(*) FROM {schema}.{table}", (counter,)).fetchall()
+        rows += conn.execute(f'''
+            SELECT ?, {COUNTER_DAY_EXPR.format(row='src')}, COUNT(*)
+            FROM {schema}.{table} AS src
+            WHERE created_ts IS NOT NULL
+            GROUP BY 2
+        ''', (counter,)).fetchall()
+    return rows
+
+
+def analytics_rows(conn, schema='main'):
+    """([(metric, hour_ts, count, total_seconds)], [(metric, day, count, total_seconds)]) của schema"""
+    sources = [
+        ('reports', f'''SELECT created_ts AS ts, 0 AS seconds
+                        FROM {schema}.security_reports WHERE created_ts IS NOT NULL'''),
+        ('questions', f'''SELECT created_ts AS ts, 0 AS seconds
+                          FROM {schema}.forum_posts WHERE created_ts IS NOT NULL'''),
+        ('answered', f'''SELECT first_answer_ts AS ts, MAX(first_answer_ts - created_ts, 0) AS seconds
+                         FROM {schema}.forum_posts WHERE first_answer_ts IS NOT NULL'''),
+        ('resolved', f'''SELECT resolved_ts AS ts, MAX(resolved_ts - created_ts, 0) AS seconds
+                         FROM {schema}.security_reports
+                         WHERE status = '{REPORT_RESOLVED}' AND resolved_ts IS NOT NULL
+                           AND assigned_to IS NOT NULL'''),
+    ]
+    hourly, daily = [], []
+    for metric, source in sources:
+        hourly += conn.execute(f'''
+            SELECT ?, (ts / 3600) * 3600, COUNT(*), SUM(seconds)
+            FROM ({source})
+            GROUP BY 2
+        ''', (metric,)).fetchall()
+        daily += conn.execute(f'''
+            SELECT ?, date(ts, 'unixepoch', '+7 hours'), COUNT(*), SUM(seconds)
+            FROM ({source})
+            GROUP BY 2
+        ''', (metric,)).fetchall()
+    return hourly, daily
+
+
+def report_cell_rows(conn, schema='main'):
+    """[(day, cell, count)] số phản ánh theo ngày và ô lưới của schema"""
+    return conn.execute(f'''
+        SELECT date(created_ts, 'unixepoch', '+7 hours'), substr(geohash, 1, {CELL_PRECISION}), COUNT(*)
+        FROM {schema}.security_reports
+        WHERE geohash IS NOT NULL AND created_ts IS NOT NULL
+        GROUP BY 1, 2
+    ''').fetchall()
+
+
+def rebuild_counters(conn, archived=()):
+    """
+    Tính lại toàn bộ bộ đếm từ dữ liệu gốc (chỉ dùng khi nâng cấp/khôi phục).
+    archived = counter_rows của các file lưu trữ, cộng thêm để lưu trữ không làm mất lịch sử.
+    """
+    c = conn.cursor()
+    c.execute('DELETE FROM stats_counters')
+    c.executemany('''
+        INSERT INTO stats_counters (name, bucket, value) VALUES (?, ?, ?)
+        ON CONFLICT(name, bucket) DO UPDATE SET value = value + excluded.value
+    ''', counter_rows(conn) + list(archived))
+    c.execute('''
+        UPDATE forum_posts SET reply_count = (
+            SELECT COUNT(*) FROM forum_replies WHERE forum_replies.post_id = forum_posts.id
+        )
+    ''')
+
+
+def rebuild_analytics(conn, archived=((), ())):
+    """Tính lại bảng tổng hợp từ dữ liệu gốc; archived = (hourly, daily) của các file lưu trữ"""
+    c = conn.cursor()
+    hourly, daily = analytics_rows(conn)
+    for table, bucket_column, rows, extra in (('analytics_hourly', 'hour_ts', hourly, archived[0]),
+                                              ('analytics_daily', 'day', daily, archived[1])):
+        c.execute(f'DELETE FROM {table}')
+        c.executemany(f'''
+            INSERT INTO {table} (metric, {bucket_column}, count, total_seconds) VALUES (?, ?, ?, ?)
+            ON CONFLICT(metric, {bucket_column}) DO UPDATE SET
+                count = count + excluded.count,
+                total_seconds = total_seconds + excluded.total_seconds
+        ''', rows + list(extra))
+
+
+def rebuild_report_cells(conn, archived=()):
+    """Tính lại số phản ánh theo ngày và ô lưới; archived = report_cell_rows của các file lưu trữ"""
+    c = conn.cursor()
+    c.execute('DELETE FROM report_cells')
+    c.executemany('''
+        INSERT INTO report_cells (day, cell, count) VALUES (?, ?, ?)
+        ON CONFLICT(day, cell) DO UPDATE SET count = count + excluded.count
+    ''', report_cell_rows(conn) + list(archived))
+
+
+def init_schema(conn):
+    """Tạo bảng, index và trigger; nâng cấp database cũ lên SCHEMA_VERSION"""
+    c = conn.cursor()
+    # WAL: người đọc không chặn luồng ghi (và ngược lại); lưu vĩnh viễn trong file
+    c.execute('PRAGMA journal_mode=WAL')
+    version = c.execute('PRAGMA user_version').fetchone()[0]
+    has_counters = _table_exists(conn, 'stats_counters')
+    has_analytics = _table_exists(conn, 'analytics_daily')
+    has_report_cells = _table_exists(conn, 'report_cells')
+
+    for ddl in TABLES:
+        c.execute(ddl)
+    for table, column, decl, backfill_sql in COLUMN_MIGRATIONS:
+        add_column(conn, table, column, decl, backfill_sql)
+    for name in OBSOLETE_INDEXES:
+        c.execute(f'DROP INDEX IF EXISTS {name}')
+    for ddl in INDEXES:
+        c.execute(ddl)
+
+    # Trigger đã đổi định nghĩa giữa các phiên bản: tạo lại toàn bộ
+    if version < SCHEMA_VERSION:
+        for ddl in TRIGGERS:
+            c.execute(f'DROP TRIGGER IF EXISTS {_trigger_name(ddl)}')
+    for ddl in TRIGGERS:
+        c.execute(ddl)
+
+    # Database cũ (chưa có bộ đếm hoặc bucket tính theo cách cũ): đếm lại một lần
+    if not has_counters or version < COUNTER_REBUILD_VERSION:
+        rebuild_counters(conn)
+    if not has_analytics:
+        rebuild_analytics(conn)
+    if not has_report_cells:
+        rebuild_report_cells(conn)
+
+    if version < SCHEMA_VERSION:
+        c.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+
+# ================ ĐỌC THỐNG KÊ ================
+def get_quick_stats(conn, today):
+    """Lấy số phản ánh, số câu hỏi và số phản ánh hôm nay bằng tra cứu khóa chính"""
+    rows = conn.execute('''
+        SELECT name, bucket, value FROM stats_counters
+        WHERE name IN ('reports', 'posts') AND bucket IN (?, ?)
+    ''', (TOTAL_BUCKET, today)).fetchall()
+
+    counters = {(name, bucket): value for name, bucket, value in rows}
+    return {
+        'total_reports': counters.get(('reports', TOTAL_BUCKET), 0),
+        'total_posts': counters.get(('posts', TOTAL_BUCKET), 0),
+        'today_reports': counters.get(('reports', today), 0),
+    }
+
+
+def count_reports_between(conn, start_ts, end_ts):
+    """Đếm phản ánh trong khoảng epoch [start_ts, end_ts) - quét theo index created_ts"""
+    row = conn.execute(
+        'SELECT COUNT(*) FROM security_reports WHERE created_ts >= ? AND created_ts < ?',
+        (start_ts, end_ts)
+    ).fetchone()
+    return row[0]
+
+
+def get_reply_count(conn, post_id):
+    """Số bình luận của một bài đăng (cột do trigger duy trì)"""
+    row = conn.execute('SELECT reply_count FROM forum_posts WHERE id = ?', (post_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def get_analytics_daily(conn, start_day, end_day):
+    """Các dòng tổng hợp theo ngày (metric, day, count, total_seconds) trong khoảng [start_day, end_day]"""
+    return conn.execute('''
+        SELECT metric, day, count, total_seconds FROM analytics_daily
+        WHERE day BETWEEN ? AND ?
+        ORDER BY day
+    ''', (start_day, end_day)).fetchall()
+
+
+def get_analytics_hourly(conn, start_ts, end_ts):
+    """Các dòng tổng hợp theo giờ (metric, hour_ts, count, total_seconds) trong [start_ts, end_ts)"""
+    return conn.execute('''
+        SELECT metric, hour_ts, count, total_seconds FROM analytics_hourly
+        WHERE hour_ts >= ? AND hour_ts < ?
+        ORDER BY hour_ts
+    ''', (start_ts, end_ts)).fetchall()
+
+
+def get_analytics_totals(conn):
+    """{metric: (count, total_seconds)} cộng dồn trên bảng theo ngày (vài trăm dòng mỗi năm)"""
+    rows = conn.execute('''
+        SELECT metric, SUM(count), SUM(total_seconds) FROM analytics_daily GROUP BY metric
+    ''').fetchall()
+    return {metric: (count, seconds) for metric, count, seconds in rows}
+
+
+def get_report_cell_counts(conn, start_day, end_day):
+    """[(cell, count)] số phản ánh mỗi ô lưới trong [start_day, end_day] - đọc bảng report_cells"""
+    return conn.execute('''
+        SELECT cell, SUM(count) FROM report_cells
+        WHERE day BETWEEN ? AND ?
+        GROUP BY cell
+    ''', (start_day, end_day)).fetchall()
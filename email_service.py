@@ -1,168 +1,879 @@
-# email_service.py - Gửi email thật bằng SendGrid
-import streamlit as st
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Content, To, From, Subject
-from datetime import datetime
+# email_service.py - Gửi email thông báo qua SendGrid hoặc SMTP (giữ kết nối, template biên dịch sẵn)
+import html
+import http.client
+import json
 import os
+import queue
+import re
+import smtplib
+import threading
+import time
+from email.headerregistry import Address
+from email.message import EmailMessage
+from urllib.parse import urlsplit
 
-def send_email_report(report_data):
+from rate_limit import DEFAULT_BURST, DEFAULT_RATE_PER_SECOND, SharedTokenBucket, TokenBucket
+
+SENDGRID_API_BASE = 'https://api.sendgrid.com'
+SEND_PATH = '/v3/mail/send'
+# Số kết nối giữ sẵn (bằng số luồng gửi của outbox.py)
+MAX_IDLE_CONNECTIONS = 4
+REQUEST_TIMEOUT_SECONDS = 10
+# Kết nối rảnh lâu hơn mức này không dùng lại (máy chủ thường đã tự đóng kết nối keep-alive)
+IDLE_CONNECTION_SECONDS = 30
+
+TRANSPORT_SENDGRID = 'sendgrid'
+TRANSPORT_SMTP = 'smtp'
+
+
+# ================ CẤU HÌNH (ĐỌC MỘT LẦN) ================
+class EmailConfig:
+    """Cấu hình gửi email đã phân giải từ secrets hoặc biến môi trường"""
+    __slots__ = ('transport', 'api_key', 'from_email', 'to_email', 'sender_name', 'api_base',
+                 'smtp_server', 'smtp_port', 'smtp_username', 'smtp_password', 'smtp_ssl',
+                 'rate_per_second', 'rate_burst', 'rate_shared')
+
+    def __init__(self, api_key=None, from_email=None, to_email=None, sender_name=None,
+                 api_base=SENDGRID_API_BASE, transport=TRANSPORT_SENDGRID, smtp_server=None,
+                 smtp_port=587, smtp_username=None, smtp_password=None, smtp_ssl=False,
+                 rate_per_second=DEFAULT_RATE_PER_SECOND, rate_burst=DEFAULT_BURST, rate_shared=False):
+        self.transport = transport
+        self.api_key = api_key
+        self.from_email = from_email
+        self.to_email = to_email
+        self.sender_name = sender_name
+        self.api_base = api_base
+        self.smtp_server = smtp_server
+        self.smtp_port = int(smtp_port)
+        self.smtp_username = smtp_username
+        self.smtp_password = smtp_password
+        # Cổng 465 = SMTP over SSL; các cổng khác dùng STARTTLS
+        self.smtp_ssl = smtp_ssl
+        # Giới hạn gọi email API; rate_shared = một hạn mức chung cho mọi replica (qua database)
+        self.rate_per_second = float(rate_per_second)
+        self.rate_burst = int(rate_burst)
+        self.rate_shared = rate_shared
+
+
+def _secrets_config():
+    import streamlit as st
+
+    if "sendgrid" in st.secrets:
+        section = st.secrets["sendgrid"]
+        return EmailConfig(
+            api_key=section["api_key"],
+            from_email=section["from_email"],
+            to_email=section["to_email"],
+            sender_name=section.get("sender_name", "Hệ thống Phản ánh"),
+            api_base=section.get("api_base", SENDGRID_API_BASE),
+            **_rate_settings(section),
+        )
+
+    # [email] theo README: máy chủ SMTP (Gmail...)
+    section = st.secrets["email"]
+    port = int(section.get("smtp_port", 587))
+    return EmailConfig(
+        transport=TRANSPORT_SMTP,
+        from_email=section.get("from_email", section["username"]),
+        to_email=section["to_email"],
+        sender_name=section.get("sender_name", "Hệ thống Phản ánh"),
+        smtp_server=section["smtp_server"],
+        smtp_port=port,
+        smtp_username=section["username"],
+        smtp_password=section["password"],
+        smtp_ssl=bool(section.get("use_ssl", port == 465)),
+        **_rate_settings(section),
+    )
+
+
+def _rate_settings(section):
+    return {
+        'rate_per_second': section.get("rate_per_second", DEFAULT_RATE_PER_SECOND),
+        'rate_burst': section.get("rate_burst", DEFAULT_BURST),
+        'rate_shared': bool(section.get("rate_shared", False)),
+    }
+
+
+def _environment_config():
+    port = int(os.environ.get('SMTP_PORT', 587))
+    smtp_server = os.environ.get('SMTP_SERVER')
+    api_key = os.environ.get('SENDGRID_API_KEY')
+    transport = os.environ.get('EMAIL_TRANSPORT') or (
+        TRANSPORT_SMTP if smtp_server and not api_key else TRANSPORT_SENDGRID
+    )
+    return EmailConfig(
+        transport=transport,
+        api_key=api_key,
+        from_email=os.environ.get('FROM_EMAIL') or os.environ.get('EMAIL_USER')
+                   or 'phảnánh@tiepnhancapthanhmieu.streamlit.app',
+        to_email=os.environ.get('TO_EMAIL', 'congan.diaphuong@gmail.com'),
+        sender_name="Hệ thống Tiếp nhận Phản ánh",
+        api_base=os.environ.get('SENDGRID_API_BASE', SENDGRID_API_BASE),
+        smtp_server=smtp_server,
+        smtp_port=port,
+        smtp_username=os.environ.get('EMAIL_USER'),
+        smtp_password=os.environ.get('EMAIL_PASS'),
+        smtp_ssl=os.environ.get('SMTP_SSL', '1' if port == 465 else '0') == '1',
+        rate_per_second=os.environ.get('EMAIL_RATE_PER_SECOND', DEFAULT_RATE_PER_SECOND),
+        rate_burst=os.environ.get('EMAIL_RATE_BURST', DEFAULT_BURST),
+        rate_shared=os.environ.get('EMAIL_RATE_SHARED', '0') == '1',
+    )
+
+
+def load_email_config():
+    """Ưu tiên Streamlit secrets ([sendgrid] hoặc [email]), không có thì dùng biến môi trường"""
+    try:
+        return _secrets_config()
+    except Exception:
+        return _environment_config()
+
+
+_config = None
+_transport = None
+_setup_lock = threading.Lock()
+
+
+def get_email_config():
+    """Cấu hình dùng chung cho cả tiến trình (đọc secrets một lần)"""
+    global _config
+    if _config is None:
+        with _setup_lock:
+            if _config is None:
+                _config = load_email_config()
+    return _config
+
+
+def email_configured():
+    """Đã đủ cấu hình để gửi email hay chưa"""
+    config = get_email_config()
+    if config.transport == TRANSPORT_SMTP:
+        return bool(config.smtp_server)
+    return bool(config.api_key)
+
+
+# ================ CLIENT HTTP GIỮ KẾT NỐI ================
+class SendGridClient:
     """
-    Hàm gửi email thông qua SendGrid API
+    Client SendGrid v3 tối giản trên http.client.
+
+    Kết nối HTTPS được giữ lại (keep-alive) trong một pool nhỏ nên các email
+    sau không phải bắt tay TCP/TLS lại. An toàn khi nhiều luồng gửi cùng lúc.
     """
-    try:
-        # Lấy API Key từ secrets.toml hoặc biến môi trường
-        # CÁCH 1: Dùng Streamlit secrets (tốt nhất)
+
+    def __init__(self, api_key, api_base=SENDGRID_API_BASE, max_idle=MAX_IDLE_CONNECTIONS,
+                 timeout=REQUEST_TIMEOUT_SECONDS, idle_seconds=IDLE_CONNECTION_SECONDS):
+        url = urlsplit(api_base)
+        self.api_key = api_key
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        # (kết nối, thời điểm trả về pool)
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self.requests = 0
+        self.connections_opened = 0
+
+    def _new_connection(self):
+        connection_cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        self.connections_opened += 1
+        return connection_cls(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self):
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_connection()
+            if time.monotonic() - released_at < self.idle_seconds:
+                return conn
+            conn.close()
+
+    def _release(self, conn):
         try:
-            api_key = st.secrets["sendgrid"]["api_key"]
-            from_email = st.secrets["sendgrid"]["from_email"]
-            to_email = st.secrets["sendgrid"]["to_email"]
-            sender_name = st.secrets["sendgrid"].get("sender_name", "Hệ thống Phản ánh")
-        except:
-            # CÁCH 2: Dùng biến môi trường
-            api_key = os.environ.get('SENDGRID_API_KEY')
-            from_email = os.environ.get('FROM_EMAIL', 'phảnánh@tiepnhancapthanhmieu.streamlit.app')
-            to_email = os.environ.get('TO_EMAIL', 'congan.diaphuong@gmail.com')
-            sender_name = "Hệ thống Tiếp nhận Phản ánh"
-        
-        if not api_key:
-            return False, "❌ Chưa cấu hình SendGrid API Key"
-        
-        # Tạo tiêu đề email
-        subject = f"🚨 PHẢN ÁNH AN NINH #{report_data['report_id']:06d}: {report_data['title'][:50]}"
-        
-        # Nội dung HTML đẹp
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ 
-                    background: linear-gradient(135deg, #dc3545 0%, #ff6b6b 100%);
-                    color: white; 
-                    padding: 20px; 
-                    text-align: center; 
-                    border-radius: 10px 10px 0 0;
-                }}
-                .content {{ 
-                    background: #f8f9fa; 
-                    padding: 25px; 
-                    border-radius: 0 0 10px 10px;
-                    border: 1px solid #dee2e6;
-                }}
-                .field {{ margin-bottom: 15px; }}
-                .label {{ font-weight: bold; color: #495057; font-size: 14px; }}
-                .value {{ 
-                    color: #212529; 
-                    background: white; 
-                    padding: 10px; 
-                    border-radius: 5px; 
-                    border-left: 4px solid #007bff;
-                    margin-top: 5px;
-                }}
-                .report-id {{ 
-                    background: #dc3545; 
-                    color: white; 
-                    padding: 5px 15px; 
-                    border-radius: 20px; 
-                    display: inline-block;
-                    font-weight: bold;
-                }}
-                .footer {{ 
-                    margin-top: 30px; 
-                    font-size: 12px; 
-                    color: #6c757d; 
-                    text-align: center;
-                    border-top: 1px solid #dee2e6;
-                    padding-top: 15px;
-                }}
-                .urgent {{ color: #dc3545; font-weight: bold; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🚨 PHẢN ÁNH AN NINH TRẬT TỰ</h1>
-                    <div class="report-id">Mã: PA-{report_data['report_id']:06d}</div>
-                </div>
-                
-                <div class="content">
-                    <div class="field">
-                        <div class="label">TIÊU ĐỀ:</div>
-                        <div class="value">{report_data.get('title', 'Không có tiêu đề')}</div>
-                    </div>
-                    
-                    <div class="field">
-                        <div class="label">MÔ TẢ CHI TIẾT:</div>
-                        <div class="value">{report_data.get('description', 'Không có mô tả').replace(chr(10), '<br>')}</div>
-                    </div>
-                    
-                    <div class="field">
-                        <div class="label">ĐỊA ĐIỂM:</div>
-                        <div class="value">{report_data.get('location', 'Không cung cấp')}</div>
-                    </div>
-                    
-                    <div class="field">
-                        <div class="label">THỜI GIAN SỰ VIỆC:</div>
-                        <div class="value">{report_data.get('incident_time', 'Không cung cấp')}</div>
-                    </div>
-                    
-                    <div class="field">
-                        <div class="label">THỜI GIAN TIẾP NHẬN:</div>
-                        <div class="value">{datetime.now().strftime('%H:%M %d/%m/%Y')}</div>
-                    </div>
-                </div>
-                
-                <div class="footer">
-                    <p class="urgent">📞 LIÊN HỆ KHẨN CẤP: 113</p>
-                    <p>📧 Email tự động từ <strong>Cổng Tiếp nhận Phản ánh Cộng đồng</strong></p>
-                    <p>🏛️ Hệ thống tiếp nhận và xử lý phản ánh trực tuyến</p>
-                </div>
-            </div>
-        </body>
-        </html>
+            self._idle.put_nowait((conn, time.monotonic()))
+        except queue.Full:
+            conn.close()
+
+    def post(self, path, payload):
         """
-        
-        # Plain text version cho client không hỗ trợ HTML
-        plain_text = f"""
-        PHẢN ÁNH AN NINH TRẬT TỰ
-        
-        MÃ PHẢN ÁNH: PA-{report_data['report_id']:06d}
-        TIÊU ĐỀ: {report_data.get('title', 'Không có tiêu đề')}
-        
-        MÔ TẢ:
-        {report_data.get('description', 'Không có mô tả')}
-        
-        ĐỊA ĐIỂM: {report_data.get('location', 'Không cung cấp')}
-        THỜI GIAN: {report_data.get('incident_time', 'Không cung cấp')}
-        
-        THỜI GIAN TIẾP NHẬN: {datetime.now().strftime('%H:%M %d/%m/%Y')}
-        
-        ---
-        📞 LIÊN HỆ KHẨN CẤP: 113
-        🏛️ Cổng Tiếp nhận Phản ánh Cộng đồng
+        POST JSON, trả về (status, body).
+
+        Chỉ thử lại (một lần, kết nối mới) khi lỗi xảy ra lúc GỬI request - kết nối cũ đã bị
+        đóng, không kết nối được: máy chủ chưa nhận trọn request nên chắc chắn chưa gửi email.
+        Lỗi trong lúc chờ phản hồi thì ném ra ngay, vì máy chủ có thể đã nhận và gửi email;
+        outbox ghi nhận lỗi và tự quyết định gửi lại.
         """
-        
-        # Tạo email object
-        message = Mail(
-            from_email=From(from_email, sender_name),
-            to_emails=To(to_email),
-            subject=Subject(subject),
-            html_content=html_content,
-            plain_text_content=plain_text
-        )
-        
-        # Gửi email
-        sg = SendGridAPIClient(api_key)
-        response = sg.send(message)
-        
-        # Kiểm tra kết quả
-        if response.status_code == 202:
-            return True, f"✅ Email đã gửi thành công đến Công an! (Mã: PA-{report_data['report_id']:06d})"
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+        }
+        for attempt in range(2):
+            conn = self._acquire()
+            try:
+                conn.request('POST', self.prefix + path, body, headers)
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                conn.close()
+                raise
+            try:
+                response = conn.getresponse()
+                data = response.read()
+            except Exception:
+                conn.close()
+                raise
+            self.requests += 1
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return response.status, data
+
+    def send(self, message):
+        return self.post(SEND_PATH, message)
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+    def stats(self):
+        """Số request và số kết nối đã mở - lý tưởng là connections_opened << requests"""
+        return {'requests': self.requests, 'connections_opened': self.connections_opened}
+
+
+# ================ GIAO DIỆN GỬI EMAIL ================
+class MailTransport:
+    """
+    Cách chuyển một email tới hộp thư công an.
+
+    message là dict trung lập: to, from_email, sender_name, subject, text, html.
+    send() trả về (thành công, chi tiết) và không ném lỗi mạng ra ngoài.
+    """
+
+    name = 'base'
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class SendGridTransport(MailTransport):
+    """SendGrid HTTP API v3 qua SendGridClient giữ kết nối"""
+
+    name = TRANSPORT_SENDGRID
+
+    def __init__(self, api_key, api_base=SENDGRID_API_BASE, max_idle=MAX_IDLE_CONNECTIONS):
+        self.client = SendGridClient(api_key, api_base, max_idle=max_idle)
+
+    def send(self, message):
+        payload = {
+            'personalizations': [{'to': [{'email': message['to']}]}],
+            'from': {'email': message['from_email'], 'name': message['sender_name']},
+            'subject': message['subject'],
+            'content': [
+                {'type': 'text/plain', 'value': message['text']},
+                {'type': 'text/html', 'value': message['html']},
+            ],
+        }
+        try:
+            status, _ = self.client.send(payload)
+        except Exception as e:
+            return False, f"❌ Lỗi hệ thống: {str(e)[:100]}"
+        if status == 202:
+            return True, "SendGrid 202"
+        return False, f"⚠️ Lỗi gửi email (Mã lỗi: {status})"
+
+    def close(self):
+        self.client.close()
+
+    def stats(self):
+        return self.client.stats()
+
+
+class SMTPTransport(MailTransport):
+    """
+    SMTP với pool nhỏ các kết nối đã đăng nhập.
+
+    Mỗi kết nối chỉ bắt tay TLS + AUTH một lần rồi được dùng lại cho các
+    email sau. Kết nối nằm trong pool quá idle_seconds bị bỏ (máy chủ thường đã
+    đóng); kết nối bị máy chủ đóng giữa chừng được mở lại.
+    """
+
+    name = TRANSPORT_SMTP
+
+    def __init__(self, host, port=587, username=None, password=None, use_ssl=False,
+                 starttls=True, max_idle=MAX_IDLE_CONNECTIONS, timeout=REQUEST_TIMEOUT_SECONDS,
+                 idle_seconds=IDLE_CONNECTION_SECONDS):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.starttls = starttls and not use_ssl
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        # (kết nối, thời điểm trả về pool)
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self.messages = 0
+        self.connections_opened = 0
+
+    def _new_connection(self):
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
         else:
-            return False, f"⚠️ Lỗi gửi email (Mã lỗi: {response.status_code})"
-            
-    except Exception as e:
-        return False, f"❌ Lỗi hệ thống: {str(e)[:100]}"
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                conn.starttls()
+            if self.username:
+                conn.login(self.username, self.password)
+        except Exception:
+            # Bắt tay TLS / đăng nhập lỗi: đóng socket thay vì để rò
+            conn.close()
+            raise
+        self.connections_opened += 1
+        return conn
+
+    def _acquire(self):
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_connection()
+            if time.monotonic() - released_at < self.idle_seconds:
+                return conn
+            # Không gửi QUIT: máy chủ có thể đã im lặng đóng, chờ trả lời sẽ mất cả timeout
+            conn.close()
+
+    def _release(self, conn):
+        try:
+            self._idle.put_nowait((conn, time.monotonic()))
+        except queue.Full:
+            self._quit(conn)
+
+    @staticmethod
+    def _quit(conn):
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    @staticmethod
+    def build_email(message):
+        email = EmailMessage()
+        email['Subject'] = message['subject']
+        email['From'] = Address(message['sender_name'], addr_spec=message['from_email'])
+        email['To'] = message['to']
+        email.set_content(message['text'])
+        email.add_alternative(message['html'], subtype='html')
+        return email
+
+    def send(self, message):
+        try:
+            email = self.build_email(message)
+        except (ValueError, TypeError) as e:
+            return False, f"⚠️ Địa chỉ email không hợp lệ: {str(e)[:100]}"
+        for attempt in range(2):
+            try:
+                conn = self._acquire()
+            except Exception as e:
+                return False, f"❌ Lỗi kết nối SMTP: {str(e)[:100]}"
+            try:
+                conn.send_message(email)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # Kết nối cũ đã bị đóng: mở kết nối mới và thử lại một lần
+                conn.close()
+                if attempt:
+                    return False, "❌ Máy chủ SMTP ngắt kết nối"
+                continue
+            except smtplib.SMTPException as e:
+                # Lỗi theo từng email (địa chỉ bị từ chối...): kết nối vẫn dùng được
+                self._release(conn)
+                return False, f"⚠️ Lỗi gửi email SMTP: {str(e)[:100]}"
+            except Exception as e:
+                conn.close()
+                return False, f"❌ Lỗi hệ thống: {str(e)[:100]}"
+            self.messages += 1
+            self._release(conn)
+            return True, "SMTP OK"
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(conn)
+
+    def stats(self):
+        """Số email và số lần đăng nhập SMTP - lý tưởng là connections_opened << messages"""
+        return {'messages': self.messages, 'connections_opened': self.connections_opened}
+
+
+class RateLimitedTransport(MailTransport):
+    """
+    Bọc một transport bằng token bucket: email vượt hạn mức phải xếp hàng chờ
+    token thay vì bị nhà cung cấp từ chối hàng loạt.
+    """
+
+    def __init__(self, transport, limiter):
+        self.transport = transport
+        self.limiter = limiter
+        self.name = transport.name
+
+    def send(self, message):
+        try:
+            acquired = self.limiter.acquire()
+        except Exception as e:
+            return False, f"❌ Lỗi giới hạn tốc độ: {str(e)[:100]}"
+        if not acquired:
+            # Hàng chờ quá dài: để outbox thử lại theo backoff
+            return False, "⏳ Vượt giới hạn tốc độ gửi email, sẽ thử lại sau"
+        return self.transport.send(message)
+
+    def close(self):
+        self.transport.close()
+
+    def stats(self):
+        return {**self.transport.stats(), 'rate_limit': self.limiter.stats()}
+
+
+def create_limiter(config):
+    """Token bucket theo cấu hình: trong tiến trình, hoặc dùng chung qua bảng rate_buckets"""
+    if config.rate_shared:
+        from storage import get_storage
+
+        return SharedTokenBucket(get_storage(), f'email:{config.transport}',
+                                 config.rate_per_second, config.rate_burst)
+    return TokenBucket(config.rate_per_second, config.rate_burst)
+
+
+def create_transport(config):
+    """Transport theo cấu hình: 'sendgrid' (mặc định) hoặc 'smtp'"""
+    if config.transport == TRANSPORT_SMTP:
+        return SMTPTransport(config.smtp_server, config.smtp_port, config.smtp_username,
+                             config.smtp_password, use_ssl=config.smtp_ssl)
+    if config.transport == TRANSPORT_SENDGRID:
+        return SendGridTransport(config.api_key, config.api_base)
+    raise ValueError(f"Transport email không hỗ trợ: {config.transport}")
+
+
+def get_transport():
+    """Transport dùng chung (tạo một lần, giữ kết nối giữa các email, giới hạn tốc độ gọi API)"""
+    global _transport
+    if _transport is None:
+        config = get_email_config()
+        with _setup_lock:
+            if _transport is None:
+                transport = create_transport(config)
+                if config.rate_per_second > 0:
+                    transport = RateLimitedTransport(transport, create_limiter(config))
+                _transport = transport
+    return _transport
+
+
+# ================ TEMPLATE BIÊN DỊCH SẴN ================
+# {{ ten_truong }}, {{ ten_truong|nl2br }} hoặc {{ ten_truong|raw }} (HTML đã render, không escape)
+_FIELD_PATTERN = re.compile(r'\{\{\s*(\w+)(?:\|(\w+))?\s*\}\}')
+
+
+class EmailTemplate:
+    """
+    Template được tách sẵn thành (đoạn tĩnh, trường) lúc import.
+    render() chỉ còn ghép chuỗi; autoescape=True thì mọi giá trị người dân
+    nhập đều được html.escape trước khi chèn vào HTML.
+    """
+
+    def __init__(self, source, autoescape=True):
+        pieces = _FIELD_PATTERN.split(source)
+        # pieces = [tĩnh, tên, bộ lọc, tĩnh, tên, bộ lọc, ..., tĩnh]
+        self._parts = [(pieces[i], pieces[i + 1], pieces[i + 2]) for i in range(0, len(pieces) - 1, 3)]
+        self._tail = pieces[-1]
+        self.autoescape = autoescape
+
+    def render(self, context):
+        out = []
+        for literal, name, filter_name in self._parts:
+            out.append(literal)
+            value = str(context.get(name, ''))
+            if self.autoescape and filter_name != 'raw':
+                value = html.escape(value)
+            if filter_name == 'nl2br':
+                value = value.replace('\n', '<br>')
+            out.append(value)
+        out.append(self._tail)
+        return ''.join(out)
+
+
+REPORT_HTML_SOURCE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+        .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+        .header {
+            background: linear-gradient(135deg, #dc3545 0%, #ff6b6b 100%);
+            color: white;
+            padding: 20px;
+            text-align: center;
+            border-radius: 10px 10px 0 0;
+        }
+        .content {
+            background: #f8f9fa;
+            padding: 25px;
+            border-radius: 0 0 10px 10px;
+            border: 1px solid #dee2e6;
+        }
+        .field { margin-bottom: 15px; }
+        .label { font-weight: bold; color: #495057; font-size: 14px; }
+        .value {
+            color: #212529;
+            background: white;
+            padding: 10px;
+            border-radius: 5px;
+            border-left: 4px solid #007bff;
+            margin-top: 5px;
+        }
+        .report-id {
+            background: #dc3545;
+            color: white;
+            padding: 5px 15px;
+            border-radius: 20px;
+            display: inline-block;
+            font-weight: bold;
+        }
+        .footer {
+            margin-top: 30px;
+            font-size: 12px;
+            color: #6c757d;
+            text-align: center;
+            border-top: 1px solid #dee2e6;
+            padding-top: 15px;
+        }
+        .urgent { color: #dc3545; font-weight: bold; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>🚨 PHẢN ÁNH AN NINH TRẬT TỰ</h1>
+            <div class="report-id">Mã: {{ code }}</div>
+        </div>
+
+        <div class="content">
+            <div class="field">
+                <div class="label">TIÊU ĐỀ:</div>
+                <div class="value">{{ title }}</div>
+            </div>
+
+            <div class="field">
+                <div class="label">MÔ TẢ CHI TIẾT:</div>
+                <div class="value">{{ description|nl2br }}</div>
+            </div>
+
+            <div class="field">
+                <div class="label">ĐỊA ĐIỂM:</div>
+                <div class="value">{{ location }}</div>
+            </div>
+
+            <div class="field">
+                <div class="label">THỜI GIAN SỰ VIỆC:</div>
+                <div class="value">{{ incident_time }}</div>
+            </div>
+
+            <div class="field">
+                <div class="label">THỜI GIAN TIẾP NHẬN:</div>
+                <div class="value">{{ created_at }}</div>
+            </div>
+        </div>
+
+        <div class="footer">
+            <p class="urgent">📞 LIÊN HỆ KHẨN CẤP: 113</p>
+            <p>📧 Email tự động từ <strong>Cổng Tiếp nhận Phản ánh Cộng đồng</strong></p>
+            <p>🏛️ Hệ thống tiếp nhận và xử lý phản ánh trực tuyến</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+REPORT_TEXT_SOURCE = """PHẢN ÁNH AN NINH TRẬT TỰ
+
+MÃ PHẢN ÁNH: {{ code }}
+TIÊU ĐỀ: {{ title }}
+
+MÔ TẢ:
+{{ description }}
+
+ĐỊA ĐIỂM: {{ location }}
+THỜI GIAN: {{ incident_time }}
+
+THỜI GIAN TIẾP NHẬN: {{ created_at }}
+
+---
+📞 LIÊN HỆ KHẨN CẤP: 113
+🏛️ Cổng Tiếp nhận Phản ánh Cộng đồng
+"""
+
+REPORT_HTML = EmailTemplate(REPORT_HTML_SOURCE)
+REPORT_TEXT = EmailTemplate(REPORT_TEXT_SOURCE, autoescape=False)
+
+# Email tổng hợp nhiều phản ánh không khẩn (chế độ digest của outbox.py)
+DIGEST_HTML_SOURCE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body { font-family: Arial, sans-serif; line-height: 1.5; color: #333; }
+        .container { max-width: 700px; margin: 0 auto; padding: 20px; }
+        .header {
+            background: #1e3c72;
+            color: white;
+            padding: 16px 20px;
+            border-radius: 10px 10px 0 0;
+        }
+        .item {
+            background: #f8f9fa;
+            border-left: 4px solid #007bff;
+            padding: 12px 16px;
+            margin-top: 12px;
+        }
+        .meta { color: #6c757d; font-size: 13px; }
+        .footer { margin-top: 24px; font-size: 12px; color: #6c757d; text-align: center; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h2>📋 TỔNG HỢP {{ count }} PHẢN ÁNH AN NINH</h2>
+            <div>Từ {{ first_at }} đến {{ last_at }}</div>
+        </div>
+        {{ items|raw }}
+        <div class="footer">
+            <p>Phản ánh được đánh dấu khẩn cấp luôn được gửi riêng, ngay lập tức.</p>
+            <p>📞 LIÊN HỆ KHẨN CẤP: 113</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+DIGEST_ITEM_HTML_SOURCE = """
+        <div class="item">
+            <strong>{{ code }}: {{ title }}</strong>
+            <div class="meta">Tiếp nhận: {{ created_at }} • Địa điểm: {{ location }}</div>
+            <div>{{ description|nl2br }}</div>
+        </div>"""
+
+DIGEST_TEXT_SOURCE = """TỔNG HỢP {{ count }} PHẢN ÁNH AN NINH
+Từ {{ first_at }} đến {{ last_at }}
+{{ items }}
+---
+Phản ánh khẩn cấp luôn được gửi riêng, ngay lập tức.
+📞 LIÊN HỆ KHẨN CẤP: 113
+"""
+
+DIGEST_ITEM_TEXT_SOURCE = """
+[{{ code }}] {{ title }}
+Tiếp nhận: {{ created_at }} - Địa điểm: {{ location }}
+{{ description }}
+"""
+
+DIGEST_HTML = EmailTemplate(DIGEST_HTML_SOURCE)
+DIGEST_ITEM_HTML = EmailTemplate(DIGEST_ITEM_HTML_SOURCE)
+DIGEST_TEXT = EmailTemplate(DIGEST_TEXT_SOURCE, autoescape=False)
+DIGEST_ITEM_TEXT = EmailTemplate(DIGEST_ITEM_TEXT_SOURCE, autoescape=False)
+
+
+def _report_context(report_data):
+    """Giá trị hiển thị của phản ánh (trường trống -> 'Không cung cấp')"""
+    return {
+        'code': f"PA-{report_data['report_id']:06d}",
+        'title': report_data.get('title') or 'Không có tiêu đề',
+        'description': report_data.get('description') or 'Không có mô tả',
+        'location': report_data.get('location') or 'Không cung cấp',
+        'incident_time': report_data.get('incident_time') or 'Không cung cấp',
+        'created_at': report_data.get('created_at') or 'N/A',
+    }
+
+
+def build_report_message(report_data, config):
+    """Email (dạng dict trung lập cho mọi transport) cho một phản ánh"""
+    context = _report_context(report_data)
+    urgent = "[KHẨN] " if report_data.get('urgent') else ""
+    return {
+        'to': config.to_email,
+        'from_email': config.from_email,
+        'sender_name': config.sender_name,
+        'subject': f"🚨 {urgent}PHẢN ÁNH AN NINH #{report_data['report_id']:06d}: {context['title'][:50]}",
+        'text': REPORT_TEXT.render(context),
+        'html': REPORT_HTML.render(context),
+    }
+
+
+def build_digest_message(reports, config):
+    """Một email tổng hợp cho danh sách report_data (theo thứ tự tiếp nhận)"""
+    contexts = [_report_context(report) for report in reports]
+    summary = {
+        'count': len(contexts),
+        'first_at': contexts[0]['created_at'],
+        'last_at': contexts[-1]['created_at'],
+    }
+    codes = f"{contexts[0]['code']} → {contexts[-1]['code']}"
+    return {
+        'to': config.to_email,
+        'from_email': config.from_email,
+        'sender_name': config.sender_name,
+        'subject': f"📋 TỔNG HỢP {len(contexts)} PHẢN ÁNH AN NINH ({codes})",
+        'text': DIGEST_TEXT.render({**summary, 'items': ''.join(DIGEST_ITEM_TEXT.render(c) for c in contexts)}),
+        'html': DIGEST_HTML.render({**summary, 'items': ''.join(DIGEST_ITEM_HTML.render(c) for c in contexts)}),
+    }
+
+
+# ================ GỬI EMAIL ================
+def send_email_report(report_data):
+    """
+    Hàm gửi email phản ánh qua transport đã cấu hình (SendGrid hoặc SMTP)
+    """
+    if not email_configured():
+        return False, "❌ Chưa cấu hình gửi email (SendGrid API Key hoặc máy chủ SMTP)"
+
+    success, detail = get_transport().send(build_report_message(report_data, get_email_config()))
+    if success:
+        return True, f"✅ Email đã gửi thành công đến Công an! (Mã: PA-{report_data['report_id']:06d})"
+    return False, detail
+
+
+def send_email_digest(reports):
+    """Gửi một email tổng hợp cho nhiều phản ánh không khẩn"""
+    if not email_configured():
+        return False, "❌ Chưa cấu hình gửi email (SendGrid API Key hoặc máy chủ SMTP)"
+
+    success, detail = get_transport().send(build_digest_message(reports, get_email_config()))
+    if success:
+        return True, f"✅ Đã gửi email tổng hợp {len(reports)} phản ánh"
+    return False, detail
+
+
+# ================ ĐO HIỆU NĂNG VỚI MÁY CHỦ GIẢ LẬP ================
+def _start_mock_server():
+    """Máy chủ HTTP/1.1 cục bộ trả 202 như SendGrid (giữ kết nối keep-alive)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.send_response(202)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _start_mock_smtp():
+    """Máy chủ SMTP cục bộ bằng aiosmtpd (chỉ cần khi đo/thử nghiệm: pip install aiosmtpd)"""
+    import socket
+
+    from aiosmtpd.controller import Controller
+
+    class Handler:
+        async def handle_DATA(self, server, session, envelope):
+            return '250 OK'
+
+    # Controller cần cổng cụ thể: lấy một cổng trống của hệ điều hành
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    controller = Controller(Handler(), hostname='127.0.0.1', port=port)
+    controller.start()
+    return controller
+
+
+def _timed(count, send):
+    start = time.perf_counter()
+    for _ in range(count):
+        send()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def benchmark(count=500):
+    """
+    So sánh cách cũ (mỗi email một client / kết nối mới) với transport dùng chung
+    trên máy chủ giả lập; kèm thời gian dựng nội dung một email.
+    """
+    server = _start_mock_server()
+    api_base = f'http://127.0.0.1:{server.server_address[1]}'
+    config = EmailConfig('bench-key', 'from@example.com', 'to@example.com', 'Bench', api_base)
+    report = {
+        'report_id': 1, 'title': 'Trộm xe <script>', 'description': 'Dòng 1\nDòng 2 & "3"',
+        'location': 'Đường ABC', 'incident_time': '', 'created_at': '08:00 01/01/2025',
+    }
+
+    results = {'render': _timed(count, lambda: build_report_message(report, config))}
+    message = build_report_message(report, config)
+    print(f"Render    (µs/email):  {results['render']:.1f}")
+
+    def compare(label, make_transport):
+        """Mỗi email một transport (kết nối mới) so với một transport dùng chung"""
+        created = []
+
+        def one_shot():
+            transport = make_transport()
+            created.append(transport)
+            transport.send(message)
+            transport.close()
+
+        shared = make_transport()
+        results[f'{label}_new'] = _timed(count, one_shot)
+        results[f'{label}_new_connections'] = sum(t.stats()['connections_opened'] for t in created)
+        results[f'{label}_shared'] = _timed(count, lambda: shared.send(message))
+        results[f'{label}_shared_connections'] = shared.stats()['connections_opened']
+        shared.close()
+        print(f"{label:9} (µs/email):  kết nối mới {results[f'{label}_new']:.1f} "
+              f"({results[f'{label}_new_connections']} kết nối)  |  "
+              f"dùng chung {results[f'{label}_shared']:.1f} "
+              f"({results[f'{label}_shared_connections']} kết nối)")
+
+    compare('SendGrid', lambda: SendGridTransport(config.api_key, api_base))
+    server.shutdown()
+
+    try:
+        controller = _start_mock_smtp()
+    except ImportError:
+        print("SMTP: bỏ qua (cần pip install aiosmtpd)")
+        return results
+
+    compare('SMTP', lambda: SMTPTransport(controller.hostname, controller.port, starttls=False))
+    controller.stop()
+    return results
+
+
+if __name__ == '__main__':
+    # python email_service.py [số email] - đo trên máy chủ giả lập, không gửi email thật
+    import sys
+
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
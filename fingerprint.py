@@ -0,0 +1,138 @@
+# fingerprint.py - Khóa ẩn danh của một người dùng (máy khách) để giới hạn tốc độ, không lưu IP thật
+import hashlib
+import hmac
+import ipaddress
+import os
+import secrets
+
+# Số reverse proxy tin cậy đứng trước ứng dụng. Mỗi proxy NỐI địa chỉ nó nhìn thấy vào cuối
+# X-Forwarded-For, nên IP thật nằm ở vị trí thứ `hops` tính từ phải; các mục bên trái do
+# máy khách tự gửi, giả mạo được. 0 = không có proxy, dùng địa chỉ kết nối của Streamlit.
+DEFAULT_TRUSTED_PROXY_HOPS = 1
+
+# Không xác định được IP đáng tin: mọi máy khách như vậy dùng chung một giới hạn,
+# thay vì mỗi phiên (mỗi lần tải lại trang) một giới hạn mới
+UNKNOWN_CLIENT = 'unknown'
+
+_salt = None
+_trusted_hops = None
+
+
+def _load_salt():
+    """[security] fingerprint_salt trong secrets hoặc FINGERPRINT_SALT; thiếu thì muối ngẫu nhiên theo tiến trình"""
+    try:
+        import streamlit as st
+
+        value = st.secrets["security"]["fingerprint_salt"]
+    except Exception:
+        value = os.environ.get('FINGERPRINT_SALT')
+    return value.encode() if value else secrets.token_bytes(32)
+
+
+def get_salt():
+    global _salt
+    if _salt is None:
+        _salt = _load_salt()
+    return _salt
+
+
+def _load_trusted_hops():
+    """[security] trusted_proxy_hops trong secrets hoặc TRUSTED_PROXY_HOPS"""
+    try:
+        import streamlit as st
+
+        value = st.secrets["security"].get("trusted_proxy_hops", DEFAULT_TRUSTED_PROXY_HOPS)
+    except Exception:
+        value = os.environ.get('TRUSTED_PROXY_HOPS', DEFAULT_TRUSTED_PROXY_HOPS)
+    return max(int(value), 0)
+
+
+def get_trusted_hops():
+    global _trusted_hops
+    if _trusted_hops is None:
+        _trusted_hops = _load_trusted_hops()
+    return _trusted_hops
+
+
+def _request_headers():
+    """Header HTTP của phiên Streamlit hiện tại (API mới st.context, hoặc API cũ của websocket)"""
+    try:
+        import streamlit as st
+
+        return dict(st.context.headers)
+    except Exception:
+        pass
+    try:
+        from streamlit.web.server.websocket_headers import _get_websocket_headers
+
+        return _get_websocket_headers() or {}
+    except Exception:
+        return {}
+
+
+def _remote_address():
+    """Địa chỉ kết nối trực tiếp tới Streamlit (st.context.ip_address, bản Streamlit mới)"""
+    try:
+        import streamlit as st
+
+        return st.context.ip_address or ''
+    except Exception:
+        return ''
+
+
+def _valid_ip(value):
+    value = (value or '').strip()
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return None
+
+
+def client_ip(headers, trusted_hops, remote_address=''):
+    """
+    IP máy khách đáng tin, hoặc None.
+
+    Sau `trusted_hops` proxy: mục thứ trusted_hops tính từ PHẢI của X-Forwarded-For (do proxy
+    ngoài cùng ghi), hoặc X-Real-IP nếu proxy không ghi X-Forwarded-For. Thiếu mục
+    (request không đi qua đủ số proxy) thì không tin. Không có proxy: địa chỉ kết nối.
+    """
+    if trusted_hops == 0:
+        return _valid_ip(remote_address)
+    forwarded = [entry.strip() for entry in headers.get('x-forwarded-for', '').split(',') if entry.strip()]
+    if forwarded:
+        return _valid_ip(forwarded[-trusted_hops]) if len(forwarded) >= trusted_hops else None
+    return _valid_ip(headers.get('x-real-ip'))
+
+
+def fingerprint(*parts):
+    """HMAC-SHA256 có muối của các thành phần - không đảo ngược được ra IP / trình duyệt"""
+    message = '\x1f'.join(str(part) for part in parts).encode()
+    return hmac.new(get_salt(), message, hashlib.sha256).hexdigest()[:16]
+
+
+def anonymous_tag(idempotency_key=None):
+    """
+    8 ký tự hex cho mã ẩn danh của bài đăng.
+
+    Băm khóa idempotency (không muối, để mọi tiến trình cho cùng kết quả): đăng lại vẫn
+    nhận đúng mã cũ mà mã công khai không để lộ phần nào của khóa. Không có khóa thì ngẫu nhiên.
+    """
+    if not idempotency_key:
+        return secrets.token_hex(4)
+    return hashlib.sha256(f'anonymous-id\x1f{idempotency_key}'.encode()).hexdigest()[:8]
+
+
+def client_fingerprint():
+    """
+    Khóa của máy khách đang gửi request.
+
+    Chỉ dùng IP đáng tin (client_ip): đổi User-Agent, tải lại trang hay tự thêm
+    X-Forwarded-For đều không thoát được giới hạn. Không có IP đáng tin thì mọi máy khách
+    như vậy dùng chung khóa UNKNOWN_CLIENT.
+    """
+    headers = {key.lower(): value for key, value in _request_headers().items()}
+    hops = get_trusted_hops()
+    ip = client_ip(headers, hops, _remote_address() if hops == 0 else '')
+    if ip:
+        return fingerprint('ip', ip)
+    return fingerprint(UNKNOWN_CLIENT)
@@ -0,0 +1,65 @@
+# forum_html.py - HTML đã escape của bài đăng và bình luận diễn đàn, cache theo id + phiên bản dòng
+#
+# Nội dung do người dân nhập được escape trước khi ghép vào HTML hiển thị bằng
+# unsafe_allow_html. Khóa cache gồm id bài đăng và (reply_count, is_answered):
+# bình luận mới làm đổi phiên bản nên khóa cũ không còn được đọc và bị đẩy ra theo LRU,
+# còn luồng không đổi chỉ tốn một lần tra dict mỗi lần chạy lại script.
+from html import escape
+
+from read_cache import ReadCache
+
+# Cache riêng, không theo bump_generation() của cache đọc: phiên bản đã nằm trong khóa
+render_cache = ReadCache(max_entries=512)
+
+
+def escape_text(text):
+    """Escape nội dung người dùng để chèn vào HTML, giữ xuống dòng"""
+    return escape(text or "").replace("\n", "<br>")
+
+
+def post_version(post):
+    """Phiên bản hiển thị của bài đăng - đổi khi có bình luận mới hoặc được trả lời"""
+    return post.reply_count, bool(post.is_answered)
+
+
+def post_html(post):
+    """Khối người đăng + trạng thái + nội dung của bài đăng"""
+    return render_cache.get_or_load('post_html', (post.id, post_version(post)),
+                                    lambda: _build_post_html(post))
+
+
+def thread_html(post, load_replies):
+    """Toàn bộ bình luận của bài đăng; load_replies(post_id) chỉ được gọi khi chưa có trong cache"""
+    return render_cache.get_or_load('thread_html', (post.id, post_version(post)),
+                                    lambda: _build_thread_html(load_replies(post.id)))
+
+
+def _build_post_html(post):
+    status_badge = "✅ Đã trả lời" if post.is_answered else "⏳ Chờ trả lời"
+    badge_color = "#28a745" if post.is_answered else "#ffc107"
+    return f"""
+    <div style="margin-bottom: 1rem;">
+        <strong>👤 {escape(post.anonymous_id or "")}</strong> •
+        <span style="background-color: {badge_color}; color: white; padding: 2px 8px; border-radius: 10px; font-size: 0.8em;">
+            {status_badge}
+        </span>
+    </div>
+    <div style="background: #f8f9fa; padding: 1rem; border-radius: 5px; margin-bottom: 1rem;">
+        {escape_text(post.content)}
+    </div>
+    """
+
+
+def _build_thread_html(replies):
+    parts = []
+    for reply in replies:
+        reply_class = "official-reply" if reply.is_official else "user-reply"
+        author_icon = "👮" if reply.is_official else "👤"
+        parts.append(f"""
+        <div class="{reply_class}" style="padding: 1rem; margin: 0.5rem 0; border-radius: 5px;">
+            <strong>{author_icon} {escape(reply.display_name or "")}</strong>
+            <small style="color: #666;">({escape(reply.formatted_date or "")})</small>
+            <p style="margin-top: 0.5rem;">{escape_text(reply.content)}</p>
+        </div>
+        """)
+    return "".join(parts)
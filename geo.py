@@ -0,0 +1,78 @@
+# geo.py - Tọa độ phản ánh: geohash, ô lưới cho bản đồ nhiệt
+import re
+
+# Độ chính xác geohash lưu trên từng phản ánh (7 ký tự ~ 150m x 150m)
+GEOHASH_PRECISION = 7
+# Kích thước ô lưới của bản đồ nhiệt (6 ký tự ~ 1.2km x 0.6km) - tiền tố của geohash ở trên
+CELL_PRECISION = 6
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {ch: i for i, ch in enumerate(_BASE32)}
+
+# "10.7769, 106.7009" hoặc "10.7769 106.7009" (dán từ Google Maps)
+_COORDINATE_PATTERN = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*[,;\s]\s*(-?\d+(?:\.\d+)?)\s*$')
+
+
+def parse_coordinates(text):
+    """
+    Đọc "vĩ độ, kinh độ" do người dân nhập.
+    Trả về (lat, lon), None nếu để trống; ValueError nếu sai định dạng.
+    """
+    if not text or not text.strip():
+        return None
+    match = _COORDINATE_PATTERN.match(text)
+    if not match:
+        raise ValueError("Tọa độ phải có dạng 'vĩ độ, kinh độ', ví dụ 10.7769, 106.7009")
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("Tọa độ nằm ngoài phạm vi hợp lệ")
+    return lat, lon
+
+
+def encode_geohash(lat, lon, precision=GEOHASH_PRECISION):
+    """Mã geohash của một điểm - các điểm gần nhau có chung tiền tố"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def decode_geohash(geohash):
+    """Tâm (lat, lon) của ô geohash"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for ch in geohash:
+        value = _DECODE[ch]
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def cell_of(geohash):
+    """Ô lưới bản đồ nhiệt chứa một geohash"""
+    return geohash[:CELL_PRECISION] if geohash else None
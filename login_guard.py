@@ -0,0 +1,134 @@
+# login_guard.py - Chặn dò mật khẩu công an trước khi chạy PBKDF2, giới hạn số luồng băm mật khẩu
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from rate_limit import SlidingWindowLimiter
+
+# Mỗi số hiệu: tối đa 5 lần đăng nhập sai trong 5 phút (chặn dò mật khẩu CA001...)
+BADGE_MAX_ATTEMPTS = 5
+BADGE_WINDOW_SECONDS = 300
+# Mỗi máy khách: tối đa 20 lần trong 5 phút, bất kể thử số hiệu nào
+CLIENT_MAX_ATTEMPTS = 20
+CLIENT_WINDOW_SECONDS = 300
+# PBKDF2 chỉ chạy trên tối đa VERIFY_WORKERS luồng; hàng chờ đầy thì từ chối ngay,
+# để phần còn lại của máy (tiếp nhận phản ánh) không bị băm mật khẩu chiếm hết CPU
+VERIFY_WORKERS = 2
+MAX_PENDING_VERIFICATIONS = 8
+VERIFY_TIMEOUT_SECONDS = 10
+
+
+def _check_password(password_hash, password):
+    # werkzeug chỉ nạp ở lần đăng nhập đầu tiên, không làm chậm lúc khởi động
+    from werkzeug.security import check_password_hash
+
+    return check_password_hash(password_hash, password)
+
+
+class LoginResult:
+    """Kết quả đăng nhập: user (tuple tài khoản) hoặc thông báo lỗi cho người dùng"""
+    __slots__ = ('user', 'error')
+
+    def __init__(self, user=None, error=None):
+        self.user = user
+        self.error = error
+
+
+class LoginGuard:
+    """
+    Cửa sổ trượt theo số hiệu và theo máy khách được kiểm tra TRƯỚC khi đọc
+    database hay băm mật khẩu: lần thử vượt giới hạn bị từ chối gần như không tốn CPU.
+    """
+
+    def __init__(self, badge_limiter=None, client_limiter=None, workers=VERIFY_WORKERS,
+                 max_pending=MAX_PENDING_VERIFICATIONS):
+        self.badge_limiter = badge_limiter or SlidingWindowLimiter(BADGE_MAX_ATTEMPTS, BADGE_WINDOW_SECONDS)
+        self.client_limiter = client_limiter or SlidingWindowLimiter(CLIENT_MAX_ATTEMPTS, CLIENT_WINDOW_SECONDS)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-verify')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.busy_rejections = 0
+        self.verify_timeouts = 0
+
+    def _throttle(self, badge_number, client_key):
+        """(số giây phải chờ, token lượt máy khách, token lượt số hiệu)"""
+        wait, client_token = self.client_limiter.hit(client_key)
+        if wait:
+            return wait, None, None
+        wait, badge_token = self.badge_limiter.hit(badge_number)
+        if wait:
+            # Lượt đã ghi cho máy khách không được dùng tới
+            self.client_limiter.forgive(client_key, client_token)
+        return wait, client_token, badge_token
+
+    def _verify(self, password_hash, password):
+        """True/False; None nếu hàng chờ băm đầy (chưa thử mật khẩu); FutureTimeout nếu băm quá lâu"""
+        if not self._slots.acquire(blocking=False):
+            self.busy_rejections += 1
+            return None
+        try:
+            future = self._pool.submit(_check_password, password_hash, password)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=VERIFY_TIMEOUT_SECONDS)
+        except FutureTimeout:
+            self.verify_timeouts += 1
+            raise
+
+    def login(self, badge_number, password, client_key, load_user):
+        """
+        Đăng nhập với load_user(badge_number) -> tuple tài khoản hoặc None.
+        Lần đăng nhập đúng không tính vào giới hạn số hiệu.
+        """
+        badge_number = (badge_number or '').strip()
+        if not badge_number or not password:
+            return LoginResult(error="Vui lòng nhập số hiệu và mật khẩu!")
+
+        wait, client_token, badge_token = self._throttle(badge_number.upper(), client_key)
+        if wait:
+            return LoginResult(error=f"Đăng nhập sai quá nhiều lần. Vui lòng thử lại sau {int(wait // 60) + 1} phút.")
+
+        user = load_user(badge_number)
+        if not user:
+            return LoginResult(error="Sai số hiệu hoặc mật khẩu!")
+
+        try:
+            verified = self._verify(user[2], password)
+        except FutureTimeout:
+            # Mật khẩu vẫn đang được thử trong luồng băm: tính là một lần đoán, nếu không
+            # kẻ dò chỉ cần làm máy chậm đi là thử được vô hạn
+            return LoginResult(error="Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        if verified is None:
+            # Hàng chờ đầy, chưa kiểm tra mật khẩu: không tính là một lần đoán
+            self.badge_limiter.forgive(badge_number.upper(), badge_token)
+            self.client_limiter.forgive(client_key, client_token)
+            return LoginResult(error="Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        if not verified:
+            return LoginResult(error="Sai số hiệu hoặc mật khẩu!")
+
+        self.badge_limiter.forgive(badge_number.upper(), badge_token)
+        return LoginResult(user=user)
+
+    def stats(self):
+        return {
+            'badge': self.badge_limiter.stats(),
+            'client': self.client_limiter.stats(),
+            'busy_rejections': self.busy_rejections,
+            'verify_timeouts': self.verify_timeouts,
+        }
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def get_login_guard():
+    """LoginGuard dùng chung cho mọi phiên trong tiến trình"""
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                _guard = LoginGuard()
+    return _guard
@@ -4,43 +4,18 @@ TÍCH HỢP GIỌNG NÓI - DÙNG STREAMLIT-MIC-RECORDER (DỄ DÀNG)
 """
 
 import streamlit as st
-import sqlite3
-import pandas as pd
-from datetime import datetime, timedelta
-import hashlib
+from datetime import datetime, timezone
 import secrets
-import time
 import os
 
 # ================ CẤU HÌNH GIỜ VIỆT NAM ================
-import pytz
-
-# Múi giờ Việt Nam (UTC+7)
-VIETNAM_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
-
-def get_vietnam_time():
-    """Lấy thời gian hiện tại theo giờ Việt Nam"""
-    utc_now = datetime.utcnow()
-    vietnam_time = utc_now + timedelta(hours=7)
-    return vietnam_time.replace(tzinfo=VIETNAM_TZ)
-
-def format_vietnam_time(dt, format_str='%H:%M %d/%m/%Y'):
-    """Định dạng thời gian theo giờ Việt Nam"""
-    if dt is None:
-        return "N/A"
-    
-    if isinstance(dt, str):
-        try:
-            dt = datetime.strptime(dt, '%Y-%m-%d %H:%M:%S')
-        except:
-            return dt
-    
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=VIETNAM_TZ)
-    
-    return dt.strftime(format_str)
+from timeutils import (
+    get_vietnam_time, format_vietnam_time, vietnam_day_key
+)
 
 # ================ IMPORT THƯ VIỆN ================
+from startup import module_available, warm_up
+
 try:
     from streamlit_mic_recorder import mic_recorder
     MIC_RECORDER_AVAILABLE = True
@@ -48,23 +23,33 @@ except ImportError:
     MIC_RECORDER_AVAILABLE = False
     st.warning("⚠️ Thư viện streamlit-mic-recorder chưa cài đặt. Vui lòng chạy: pip install streamlit-mic-recorder")
 
-SPEECH_AVAILABLE = False
-try:
-    import speech_recognition as sr
-    SPEECH_AVAILABLE = True
-except ImportError:
-    SPEECH_AVAILABLE = False
-
-from werkzeug.security import generate_password_hash, check_password_hash
+# speech_recognition / pydub chỉ được import khi thật sự chuyển giọng nói thành văn bản
+SPEECH_AVAILABLE = module_available('speech_recognition')
 
 try:
-    from email_service import send_email_report
-    SENDGRID_AVAILABLE = True
+    from email_service import (
+        send_email_report, send_email_digest, email_configured, get_email_config, get_transport,
+    )
+    # Cấu hình được đọc một lần và giữ cho cả tiến trình (SendGrid hoặc SMTP)
+    EMAIL_AVAILABLE = email_configured()
 except ImportError:
-    SENDGRID_AVAILABLE = False
+    EMAIL_AVAILABLE = False
 
 # ================ CẤU HÌNH DATABASE ================
-DB_PATH = 'community_app.db'
+from storage import get_storage
+from write_queue import get_writer
+from forum_html import post_html, render_cache, thread_html
+from read_cache import configure_read_cache, read_cache
+from session_memory import SessionMemory, format_bytes, session_registry
+from outbox import EMAIL_NOT_CONFIGURED, EMAIL_QUEUED, get_dispatcher
+from analytics import render_dashboard, render_heatmap
+from replay import render_replay_panel
+from report_browser import render_report_browser
+from question_queue import render_question_queue
+from geo import parse_coordinates
+from fingerprint import anonymous_tag, client_fingerprint
+from login_guard import get_login_guard
+from spam_guard import FORUM_POST, REPORT, get_spam_guard
 
 # ================ CẤU HÌNH TRANG ================
 st.set_page_config(
@@ -168,6 +153,7 @@ def process_audio_to_text(audio_bytes, language='vi-VN'):
         return None, "Thư viện speech_recognition chưa cài đặt"
     
     try:
+        import speech_recognition as sr
         recognizer = sr.Recognizer()
         
         import tempfile
@@ -200,6 +186,9 @@ def create_mic_recorder_component(key_suffix, label="Ghi âm"):
         st.warning("⚠️ Thư viện streamlit-mic-recorder chưa khả dụng")
         return None
     
+    recorder_key = f"recorder_{key_suffix}"
+    SessionMemory(st.session_state).touch(recorder_key, f"{recorder_key}_output")
+    
     with st.container():
         st.markdown(f"<div class='mic-recorder-container'>", unsafe_allow_html=True)
         st.markdown(f"### 🎤 {label}")
@@ -207,7 +196,7 @@ def create_mic_recorder_component(key_suffix, label="Ghi âm"):
         audio = mic_recorder(
             start_prompt=f"🎤 Bắt đầu ghi âm",
             stop_prompt="⏹️ Dừng ghi âm",
-            key=f"recorder_{key_suffix}",
+            key=recorder_key,
             format="wav"
         )
         
@@ -239,149 +228,117 @@ def show_vietnam_time():
     """, unsafe_allow_html=True)
 
 # ================ KHỞI TẠO DATABASE ================
+def init_shared_resources():
+    """Tạo bảng, tài khoản mặc định và đánh thức outbox - chạy một lần cho cả tiến trình"""
+    storage = get_storage()
+    configure_read_cache(storage)
+    storage.init_schema()
+    
+    if not storage.get_police_user('CA001'):
+        from werkzeug.security import generate_password_hash
+        password_hash = generate_password_hash("congan123", method='pbkdf2:sha256')
+        storage.create_police_user('CA001', 'Admin Công An', password_hash, 'admin')
+    
+    # Gửi nốt email còn trong outbox từ lần chạy trước
+    if EMAIL_AVAILABLE:
+        get_dispatcher(send_email_report, send_email_digest).wake()
+
 def init_database():
-    """Khởi tạo tất cả bảng database"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS security_reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                description TEXT NOT NULL,
-                location TEXT,
-                incident_time TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                ip_hash TEXT,
-                email_sent BOOLEAN DEFAULT 0
-            )
-        ''')
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS forum_posts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT DEFAULT 'Câu hỏi từ người dân',
-                content TEXT NOT NULL,
-                category TEXT DEFAULT 'Hỏi đáp pháp luật',
-                anonymous_id TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                reply_count INTEGER DEFAULT 0,
-                is_answered BOOLEAN DEFAULT 0
-            )
-        ''')
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS forum_replies (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                post_id INTEGER,
-                content TEXT NOT NULL,
-                author_type TEXT DEFAULT 'anonymous',
-                author_id TEXT,
-                display_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_official BOOLEAN DEFAULT 0,
-                FOREIGN KEY (post_id) REFERENCES forum_posts(id)
-            )
-        ''')
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS police_users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                badge_number TEXT UNIQUE NOT NULL,
-                display_name TEXT NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT DEFAULT 'officer'
-            )
-        ''')
-        
-        c.execute("SELECT COUNT(*) FROM police_users WHERE badge_number = 'CA001'")
-        if c.fetchone()[0] == 0:
-            password_hash = generate_password_hash("congan123", method='pbkdf2:sha256')
-            c.execute('''
-                INSERT INTO police_users (badge_number, display_name, password_hash, role)
-                VALUES (?, ?, ?, ?)
-            ''', ('CA001', 'Admin Công An', password_hash, 'admin'))
-        
-        conn.commit()
-        conn.close()
-        
-    except Exception as e:
-        st.error(f"Lỗi khởi tạo database: {str(e)}")
+    """Khởi tạo database ở lần chạy đầu tiên của tiến trình; các phiên sau không chạy lại DDL"""
+    error = warm_up(init_shared_resources)
+    if error:
+        st.error(f"Lỗi khởi tạo database: {error}")
+
+# ================ KHÓA IDEMPOTENCY CỦA BIỂU MẪU ================
+def form_idempotency_key(form_name):
+    """Khóa của lần điền biểu mẫu hiện tại - giữ nguyên qua các lần rerun / bấm gửi lại"""
+    state_key = f"{form_name}_idempotency_key"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = secrets.token_hex(16)
+    return st.session_state[state_key]
+
+def reset_form_idempotency_key(form_name):
+    """Gửi thành công: lần điền tiếp theo là một bài mới"""
+    st.session_state.pop(f"{form_name}_idempotency_key", None)
 
 # ================ HÀM XỬ LÝ PHẢN ÁNH ================
-def save_to_database(title, description, location="", incident_time=""):
-    """Lưu phản ánh vào database"""
+def find_submission(lookup, idempotency_key):
+    """id bài đã lưu với khóa idempotency (gửi lại / rerun); None nếu là bài mới hoặc không tra được"""
+    if not idempotency_key:
+        return None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        ip_hash = hashlib.md5(str(time.time()).encode()).hexdigest()[:8]
-        
-        c.execute('''
-            INSERT INTO security_reports (title, description, location, incident_time, ip_hash)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (title, description, location, incident_time, ip_hash))
+        return lookup(idempotency_key)
+    except Exception:
+        # Không tra được thì coi như bài mới - vẫn qua chống spam, database tự khử trùng lặp
+        return None
+
+def save_to_database(title, description, location="", incident_time="", coordinates=None, urgent=False,
+                     client_key=None, idempotency_key=None):
+    """Lưu phản ánh vào database (coordinates = (vĩ độ, kinh độ) nếu người dân cung cấp)"""
+    try:
+        # Khóa máy khách đã băm có muối (không lưu IP thật)
+        ip_hash = client_key or client_fingerprint()
         
-        conn.commit()
-        report_id = c.lastrowid
-        conn.close()
+        # Gom vào transaction chung của luồng ghi để không tranh khóa ghi;
+        # email thông báo được ghi vào outbox trong cùng transaction đó
+        latitude, longitude = coordinates or (None, None)
+        report_id = get_writer().write('submit_report', title, description, location, incident_time, ip_hash,
+                                       latitude, longitude, urgent, idempotency_key)
+        read_cache.bump_generation()
         
         return report_id
     except Exception as e:
         return None
 
-def handle_security_report(title, description, location, incident_time):
-    """Xử lý phản ánh và gửi email"""
-    report_id = save_to_database(title, description, location, incident_time)
+def handle_security_report(title, description, location, incident_time, coordinates=None, urgent=False,
+                           idempotency_key=None):
+    """
+    Lưu phản ánh; email được luồng nền gửi từ outbox (khẩn: gửi ngay, không gom tổng hợp).
+    Gửi lại cùng idempotency_key trả về phản ánh đã lưu, không tạo phản ánh / email thứ hai.
+    Trả về (report_id, trạng thái email EMAIL_QUEUED / EMAIL_NOT_CONFIGURED hoặc None nếu lỗi, thông báo).
+    """
+    # Bấm gửi lại / rerun của phản ánh đã lưu: trả về phản ánh cũ, không tính vào giới hạn chống spam
+    report_id = find_submission(get_storage().find_report_by_idempotency_key, idempotency_key)
+    if report_id is None:
+        # Phản ánh mới: chặn spam trước khi chạm tới database hay email
+        client_key = client_fingerprint()
+        limit_error = get_spam_guard().check(REPORT, client_key)
+        if limit_error:
+            return None, None, limit_error
+        
+        report_id = save_to_database(title, description, location, incident_time, coordinates, urgent,
+                                     client_key, idempotency_key)
     
     if not report_id:
-        return None, False, "Lỗi lưu database"
-    
-    report_data = {
-        'title': title,
-        'description': description,
-        'location': location,
-        'incident_time': incident_time,
-        'report_id': report_id,
-        'created_at': format_vietnam_time(get_vietnam_time())
-    }
+        return None, None, "Lỗi lưu phản ánh. Vui lòng thử lại!"
     
-    if SENDGRID_AVAILABLE:
-        email_success, email_message = send_email_report(report_data)
-    else:
-        email_success = False
-        email_message = "Tính năng email chưa được cấu hình"
+    if not EMAIL_AVAILABLE:
+        # Email vẫn nằm trong outbox, sẽ được gửi khi cấu hình xong
+        return report_id, EMAIL_NOT_CONFIGURED, "Email thông báo chưa được cấu hình, sẽ gửi khi cấu hình xong"
     
-    if email_success:
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute('UPDATE security_reports SET email_sent = 1 WHERE id = ?', (report_id,))
-            conn.commit()
-            conn.close()
-        except:
-            pass
-    
-    return report_id, email_success, email_message
+    # Chỉ mới xếp hàng: luồng nền gửi sau (và thử lại nếu email API lỗi)
+    get_dispatcher(send_email_report, send_email_digest).wake()
+    return report_id, EMAIL_QUEUED, "📧 Email thông báo đã vào hàng đợi, sẽ được gửi tới Công an trong giây lát"
 
 # ================ HÀM DIỄN ĐÀN ================
-def save_forum_post(content, category):
-    """Lưu bài đăng diễn đàn (không cần tiêu đề)"""
+def save_forum_post(content, category, idempotency_key=None):
+    """Lưu bài đăng diễn đàn (không cần tiêu đề); cùng idempotency_key thì trả về câu hỏi đã đăng"""
+    # Mã ẩn danh băm từ khóa idempotency: đăng lại vẫn nhận đúng mã của câu hỏi đã đăng
+    anonymous_id = f"NgườiDân_{anonymous_tag(idempotency_key)}"
+    
+    # Đăng lại câu hỏi đã lưu không tính vào giới hạn chống spam
+    post_id = find_submission(get_storage().find_forum_post_by_idempotency_key, idempotency_key)
+    if post_id is not None:
+        return post_id, anonymous_id, None
+    
+    limit_error = get_spam_guard().check(FORUM_POST, client_fingerprint())
+    if limit_error:
+        return None, None, limit_error
+    
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        anonymous_id = f"NgườiDân_{secrets.token_hex(4)}"
-        
-        c.execute('''
-            INSERT INTO forum_posts (title, content, category, anonymous_id)
-            VALUES (?, ?, ?, ?)
-        ''', ('Câu hỏi từ người dân', content, category, anonymous_id))
-        
-        conn.commit()
-        post_id = c.lastrowid
-        conn.close()
+        post_id = get_writer().write('insert_forum_post', 'Câu hỏi từ người dân', content, category, anonymous_id,
+                                     idempotency_key)
+        read_cache.bump_generation()
         
         return post_id, anonymous_id, None
         
@@ -394,28 +351,11 @@ def save_forum_reply(post_id, content, is_police=False, police_info=None):
         if not is_police or not police_info:
             return None, "Chỉ công an mới được bình luận và trả lời câu hỏi."
         
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        author_type = "police"
-        author_id = police_info['badge_number']
-        display_name = police_info['display_name']
-        is_official = 1
-        
-        c.execute('''
-            INSERT INTO forum_replies (post_id, content, author_type, author_id, display_name, is_official)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (post_id, content, author_type, author_id, display_name, is_official))
-        
-        c.execute('UPDATE forum_posts SET is_answered = 1 WHERE id = ?', (post_id,))
-        
-        c.execute('SELECT COUNT(*) FROM forum_replies WHERE post_id = ?', (post_id,))
-        reply_count = c.fetchone()[0]
-        c.execute('UPDATE forum_posts SET reply_count = ? WHERE id = ?', (reply_count, post_id))
-        
-        conn.commit()
-        reply_id = c.lastrowid
-        conn.close()
+        reply_id = get_writer().write(
+            'insert_forum_reply', post_id, content,
+            "police", police_info['badge_number'], police_info['display_name'], True
+        )
+        read_cache.bump_generation()
         
         return reply_id, "Bình luận đã được gửi thành công!"
         
@@ -423,82 +363,115 @@ def save_forum_reply(post_id, content, is_police=False, police_info=None):
         return None, f"Lỗi hệ thống: {str(e)}"
 
 def get_forum_posts(category_filter="Tất cả"):
-    """Lấy danh sách bài đăng với thời gian VN"""
+    """Lấy danh sách bài đăng với thời gian VN (qua cache đọc)"""
+    category = None if category_filter == "Tất cả" else category_filter
     try:
-        conn = sqlite3.connect(DB_PATH)
-        
-        query = '''
-            SELECT id, title, content, category, anonymous_id, 
-                   created_at, reply_count, is_answered
-            FROM forum_posts
-        '''
-        
-        params = []
-        if category_filter != "Tất cả":
-            query += " WHERE category = ?"
-            params.append(category_filter)
-        
-        query += " ORDER BY created_at DESC LIMIT 50"
-        
-        df = pd.read_sql_query(query, conn, params=params)
-        conn.close()
-        
-        if not df.empty and 'created_at' in df.columns:
-            df['formatted_date'] = df['created_at'].apply(
-                lambda x: format_vietnam_time(x, '%H:%M %d/%m/%Y') if pd.notnull(x) else "N/A"
-            )
-        
-        return df
+        return read_cache.get_or_load('forum_posts', (category,),
+                                      lambda: get_storage().list_forum_posts(category))
     except:
-        return pd.DataFrame()
+        return []
 
-def get_forum_replies(post_id):
-    """Lấy bình luận của bài đăng với thời gian VN"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        query = '''
-            SELECT id, content, author_type, display_name, is_official, created_at
-            FROM forum_replies
-            WHERE post_id = ?
-            ORDER BY created_at ASC
-        '''
-        df = pd.read_sql_query(query, conn, params=(post_id,))
-        conn.close()
-        
-        if not df.empty and 'created_at' in df.columns:
-            df['formatted_date'] = df['created_at'].apply(
-                lambda x: format_vietnam_time(x, '%H:%M %d/%m/%Y') if pd.notnull(x) else "N/A"
+def get_sidebar_stats():
+    """Thống kê nhanh cho sidebar (qua cache đọc)"""
+    today = vietnam_day_key()
+    return read_cache.get_or_load('quick_stats', (today,), lambda: get_storage().quick_stats(today))
+
+# ================ CHI TIẾT BÀI ĐĂNG DIỄN ĐÀN ================
+def render_forum_post_detail(post):
+    """Nội dung, bình luận, ghi âm và form trả lời - chỉ dựng cho bài đăng đang được chọn"""
+    # HTML đã escape lấy từ cache theo (id, reply_count, is_answered); bình luận chỉ đọc khi luồng đổi
+    st.markdown(post_html(post), unsafe_allow_html=True)
+    st.markdown(f"**💬 Bình luận ({post.reply_count})**")
+    
+    if post.reply_count:
+        try:
+            st.markdown(thread_html(post, get_storage().list_forum_replies), unsafe_allow_html=True)
+        except Exception as e:
+            st.warning(f"Không tải được bình luận: {e}")
+    else:
+        st.info("Chưa có bình luận nào.")
+    
+    # Form bình luận cho công an VỚI GHI ÂM
+    if st.session_state.police_user:
+        memory = SessionMemory(st.session_state)
+        if MIC_RECORDER_AVAILABLE:
+            st.markdown("### 🎤 Ghi âm bình luận")
+            reply_audio_text = create_mic_recorder_component(f"reply_audio_{post.id}", "Bình luận bằng giọng nói")
+            if reply_audio_text:
+                st.session_state.speech_texts[f'reply_{post.id}'] = reply_audio_text
+    
+        with st.form(f"reply_form_{post.id}"):
+            # Nội dung bình luận
+            reply_content_value = ""
+            if 'speech_texts' in st.session_state and f'reply_{post.id}' in st.session_state.speech_texts:
+                reply_content_value = st.session_state.speech_texts[f'reply_{post.id}']
+                memory.touch_text(f'reply_{post.id}')
+    
+            reply_content = st.text_area(
+                "Bình luận của bạn:",
+                height=80,
+                placeholder="Viết câu trả lời hoặc ý kiến...",
+                value=reply_content_value,
+                key=f"reply_input_{post.id}"
             )
-        
-        return df
-    except:
-        return pd.DataFrame()
+    
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                submitted_reply = st.form_submit_button(
+                    f"👮 Trả lời ({st.session_state.police_user['display_name']})",
+                    use_container_width=True,
+                    type="primary"
+                )
+            with col2:
+                clear_reply = st.form_submit_button("🗑️ Xóa", use_container_width=True)
+    
+            if clear_reply:
+                if f'reply_{post.id}' in st.session_state.speech_texts:
+                    del st.session_state.speech_texts[f'reply_{post.id}']
+                memory.release(f"reply_audio_{post.id}")
+                st.rerun()
+    
+            if submitted_reply:
+                if not reply_content.strip():
+                    st.error("Vui lòng nhập nội dung bình luận!")
+                else:
+                    result = save_forum_reply(
+                        post.id, 
+                        reply_content, 
+                        is_police=True,
+                        police_info=st.session_state.police_user
+                    )
+    
+                    if result[0]:
+                        st.success(f"✅ Đã gửi trả lời lúc {format_vietnam_time(get_vietnam_time())}!")
+                        if f'reply_{post.id}' in st.session_state.speech_texts:
+                            del st.session_state.speech_texts[f'reply_{post.id}']
+                        memory.release(f"reply_audio_{post.id}")
+                        st.rerun()
+                    else:
+                        st.error(f"❌ {result[1]}")
+    else:
+        st.warning("🔒 **Chỉ công an mới được bình luận và trả lời câu hỏi.**")
 
 # ================ ĐĂNG NHẬP CÔNG AN ================
 def police_login(badge_number, password):
-    """Đăng nhập công an"""
+    """
+    Đăng nhập công an; trả về (user, thông báo lỗi).
+    Lần thử vượt giới hạn bị từ chối trước khi đọc database hay băm mật khẩu.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        c.execute('''
-            SELECT badge_number, display_name, password_hash, role 
-            FROM police_users 
-            WHERE badge_number = ?
-        ''', (badge_number,))
-        
-        user = c.fetchone()
-        conn.close()
-        
-        if user and check_password_hash(user[2], password):
+        result = get_login_guard().login(badge_number, password, client_fingerprint(),
+                                         get_storage().get_police_user)
+        if result.user:
+            user = result.user
             return {
                 'badge_number': user[0],
                 'display_name': user[1],
                 'role': user[3]
-            }
-        return None
+            }, None
+        return None, result.error
     except Exception as e:
-        return None
+        return None, "Không thể đăng nhập lúc này, vui lòng thử lại!"
 
 # ================ GIAO DIỆN CHÍNH ================
 def main():
@@ -520,6 +493,10 @@ def main():
     if 'speech_texts' not in st.session_state:
         st.session_state.speech_texts = {}
     
+    # Giải phóng audio / văn bản lâu không dùng trước khi dựng widget nếu phiên vượt ngân sách bộ nhớ
+    memory = SessionMemory(st.session_state)
+    memory.begin_run()
+    
     # Header với thời gian VN
     vietnam_now = get_vietnam_time()
     st.markdown(f"""
@@ -542,13 +519,13 @@ def main():
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Đăng nhập", type="primary", use_container_width=True):
-                    user = police_login(badge, password)
+                    user, login_error = police_login(badge, password)
                     if user:
                         st.session_state.police_user = user
                         st.success(f"Xin chào {user['display_name']}!")
                         st.rerun()
                     else:
-                        st.error("Sai số hiệu hoặc mật khẩu!")
+                        st.error(login_error)
             with col2:
                 st.button("Đăng xuất", disabled=True, use_container_width=True)
         else:
@@ -569,33 +546,57 @@ def main():
         st.markdown("### 📊 Thống kê nhanh")
         
         try:
-            conn = sqlite3.connect(DB_PATH)
-            today = get_vietnam_time().strftime('%Y-%m-%d')
+            stats = get_sidebar_stats()
             
             col1, col2, col3 = st.columns(3)
             with col1:
-                total_reports = pd.read_sql_query("SELECT COUNT(*) FROM security_reports", conn)
-                st.metric("Phản ánh", int(total_reports.iloc[0,0]))
+                st.metric("Phản ánh", stats['total_reports'])
             with col2:
-                total_posts = pd.read_sql_query("SELECT COUNT(*) FROM forum_posts", conn)
-                st.metric("Câu hỏi", int(total_posts.iloc[0,0]))
+                st.metric("Câu hỏi", stats['total_posts'])
             with col3:
-                today_reports = pd.read_sql_query(
-                    "SELECT COUNT(*) FROM security_reports WHERE DATE(created_at) = ?", 
-                    conn, params=(today,)
-                )
-                st.metric("Hôm nay", int(today_reports.iloc[0,0]))
-            
-            conn.close()
+                st.metric("Hôm nay", stats['today_reports'])
         except:
             st.warning("Không thể kết nối database")
         
+        if st.session_state.police_user:
+            cache_stats = read_cache.stats()
+            st.caption(
+                f"⚡ Cache đọc: {cache_stats['hit_rate']:.0%} trúng "
+                f"({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}) • "
+                f"{cache_stats['entries']}/{cache_stats['max_entries']} mục"
+            )
+            sessions = session_registry.totals()
+            st.caption(
+                f"🧠 Bộ nhớ phiên: {format_bytes(memory.usage()['bytes'])}/{format_bytes(memory.budget_bytes)} • "
+                f"máy chủ: {format_bytes(sessions['bytes'])} cho {sessions['sessions']} phiên • "
+                f"đã giải phóng {format_bytes(sessions['evicted_bytes'])}"
+            )
+            html_stats = render_cache.stats()
+            st.caption(
+                f"🧩 Cache HTML diễn đàn: {html_stats['hit_rate']:.0%} trúng • "
+                f"{html_stats['entries']}/{html_stats['max_entries']} mục"
+            )
+            try:
+                outbox = get_storage().outbox_counts()
+                st.caption(
+                    f"📧 Email chờ gửi: {outbox.get('pending', 0) + outbox.get('sending', 0)} • "
+                    f"không gửi được: {outbox.get('dead', 0)}"
+                )
+                throttle = get_transport().stats().get('rate_limit') if EMAIL_AVAILABLE else None
+                if throttle:
+                    st.caption(
+                        f"🚦 Giới hạn gửi: {throttle['waiting']} email đang chờ lượt • "
+                        f"đã chờ {throttle['throttle_seconds']:.0f}s ({throttle['throttled']} lần)"
+                    )
+            except Exception:
+                pass
+        
         # Thông tin tính năng
         st.markdown("---")
-        if SENDGRID_AVAILABLE:
-            st.success("✅ SendGrid: Đã kết nối")
+        if EMAIL_AVAILABLE:
+            st.success(f"✅ Email ({get_email_config().transport}): Đã kết nối")
         else:
-            st.warning("⚠️ SendGrid: Chưa cấu hình")
+            st.warning("⚠️ Email: Chưa cấu hình")
         
         if MIC_RECORDER_AVAILABLE:
             st.success("🎤 Ghi âm: Sẵn sàng (streamlit-mic-recorder)")
@@ -608,7 +609,15 @@ def main():
             st.warning("📝 Nhận diện giọng nói: Cần speech_recognition")
     
     # Main tabs
-    tab1, tab2, tab3 = st.tabs(["📢 PHẢN ÁNH AN NINH", "💬 DIỄN ĐÀN", "ℹ️ THÔNG TIN"])
+    tab_names = ["📢 PHẢN ÁNH AN NINH", "💬 DIỄN ĐÀN", "ℹ️ THÔNG TIN"]
+    # Tab thống kê chỉ dành cho tài khoản admin
+    is_admin = bool(st.session_state.police_user) and st.session_state.police_user['role'] == 'admin'
+    if st.session_state.police_user:
+        tab_names.extend(["📋 QUẢN LÝ PHẢN ÁNH", "❓ CÂU HỎI CHỜ", "🗺️ BẢN ĐỒ"])
+    if is_admin:
+        tab_names.append("📊 THỐNG KÊ")
+    tabs = st.tabs(tab_names)
+    tab1, tab2, tab3 = tabs[:3]
     
     # ========= TAB 1: PHẢN ÁNH AN NINH =========
     with tab1:
@@ -618,7 +627,7 @@ def main():
         now_vn = get_vietnam_time()
         st.info(f"**Thời gian hiện tại:** {format_vietnam_time(now_vn, '%H:%M %d/%m/%Y')}")
         
-        if not SENDGRID_AVAILABLE:
+        if not EMAIL_AVAILABLE:
             st.warning("⚠️ Tính năng email chưa sẵn sàng")
         
         # Xử lý form submitted
@@ -626,7 +635,8 @@ def main():
             st.markdown(f"""
             <div class="success-box">
                 <h4>✅ ĐÃ TIẾP NHẬN PHẢN ÁNH</h4>
-                <p>Phản ánh đã được gửi đến Công an. Cảm ơn bạn đã đóng góp!</p>
+                <p>Phản ánh đã được lưu. Cảm ơn bạn đã đóng góp!</p>
+                <p>{st.session_state.get('report_notice', '')}</p>
                 <p><strong>Thời gian tiếp nhận:</strong> {format_vietnam_time(now_vn)}</p>
             </div>
             """, unsafe_allow_html=True)
@@ -635,6 +645,7 @@ def main():
                 st.session_state.form_submitted = False
                 st.session_state.form_data = {'description': ''}
                 st.session_state.speech_texts = {}
+                memory.release()
                 st.rerun()
             return
         
@@ -661,6 +672,7 @@ def main():
             desc_value = st.session_state.form_data['description']
             if 'speech_texts' in st.session_state and 'description' in st.session_state.speech_texts:
                 desc_value = st.session_state.speech_texts['description']
+                memory.touch_text('description')
             
             description = st.text_area(
                 "MÔ TẢ SỰ VIỆC *",
@@ -672,6 +684,29 @@ def main():
             
             st.session_state.form_data['description'] = description
             
+            # Vị trí (không bắt buộc) - tọa độ dùng cho bản đồ điểm nóng
+            col_loc, col_coord = st.columns(2)
+            with col_loc:
+                location = st.text_input(
+                    "Địa điểm (không bắt buộc)",
+                    placeholder="Ví dụ: Trước nhà số 5 đường ABC, phường X",
+                    key="report_location_input"
+                )
+            with col_coord:
+                coordinates_text = st.text_input(
+                    "Tọa độ (không bắt buộc)",
+                    placeholder="Vĩ độ, kinh độ - ví dụ 10.7769, 106.7009",
+                    help="Mở Google Maps, nhấn giữ tại vị trí sự việc và sao chép tọa độ",
+                    key="report_coordinates_input"
+                )
+            
+            urgent = st.checkbox(
+                "🚨 Khẩn cấp - sự việc đang diễn ra",
+                help="Phản ánh khẩn được gửi email ngay cho công an, không chờ gom tổng hợp. "
+                     "Trường hợp nguy hiểm tính mạng vui lòng gọi 113.",
+                key="report_urgent_input"
+            )
+            
             # Nút submit và clear
             col1, col2 = st.columns([3, 1])
             with col1:
@@ -682,11 +717,22 @@ def main():
             if clear_form:
                 st.session_state.form_data = {'description': ''}
                 st.session_state.speech_texts = {}
+                memory.release('description')
                 st.rerun()
             
+            coordinates = None
+            coordinates_error = None
+            if submitted:
+                try:
+                    coordinates = parse_coordinates(coordinates_text)
+                except ValueError as e:
+                    coordinates_error = str(e)
+            
             if submitted:
                 if not description:
                     st.error("⚠️ Vui lòng mô tả sự việc!")
+                elif coordinates_error:
+                    st.error(f"⚠️ {coordinates_error}")
                 else:
                     with st.spinner("Đang xử lý phản ánh..."):
                         submit_time = get_vietnam_time()
@@ -694,16 +740,19 @@ def main():
                         # Tạo tiêu đề tự động từ mô tả
                         title = f"Phản ánh: {description[:50]}..." if len(description) > 50 else f"Phản ánh: {description}"
                         
-                        report_id, email_success, email_message = handle_security_report(
-                            title, description, "", ""
+                        report_id, email_status, email_message = handle_security_report(
+                            title, description, location.strip(), "", coordinates, urgent,
+                            form_idempotency_key("report")
                         )
                         
                         if report_id:
                             # Đánh dấu đã submit
                             st.session_state.form_submitted = True
+                            st.session_state.report_notice = f"{email_message} (Mã: PA-{report_id:06d})"
+                            reset_form_idempotency_key("report")
                             st.rerun()
                         else:
-                            st.error("❌ Lỗi lưu phản ánh. Vui lòng thử lại!")
+                            st.error(f"❌ {email_message}")
     
     # ========= TAB 2: DIỄN ĐÀN =========
     with tab2:
@@ -736,6 +785,7 @@ def main():
                     q_content_value = st.session_state.forum_form_data.get('content', '')
                     if 'speech_texts' in st.session_state and 'forum_content' in st.session_state.speech_texts:
                         q_content_value = st.session_state.speech_texts['forum_content']
+                        memory.touch_text('forum_content')
                     
                     q_content = st.text_area(
                         "NỘI DUNG CÂU HỎI *",
@@ -759,20 +809,25 @@ def main():
                         st.session_state.forum_form_data = {'content': ''}
                         if 'speech_texts' in st.session_state and 'forum_content' in st.session_state.speech_texts:
                             del st.session_state.speech_texts['forum_content']
+                        memory.release('forum_content')
                         st.rerun()
                     
                     if submit_q:
                         if not q_content:
                             st.error("Vui lòng nhập nội dung câu hỏi!")
                         else:
-                            post_id, anon_id, error = save_forum_post(q_content, q_category)
+                            post_id, anon_id, error = save_forum_post(
+                                q_content, q_category, form_idempotency_key("forum_post")
+                            )
                             if post_id:
+                                reset_form_idempotency_key("forum_post")
                                 current_time = get_vietnam_time()
                                 st.success(f"✅ Câu hỏi đã đăng lúc {format_vietnam_time(current_time)}! (ID: {anon_id})")
                                 st.session_state.show_new_question = False
                                 st.session_state.forum_form_data = {'content': ''}
                                 if 'speech_texts' in st.session_state and 'forum_content' in st.session_state.speech_texts:
                                     del st.session_state.speech_texts['forum_content']
+                                memory.release('forum_content')
                                 st.rerun()
                             else:
                                 st.error(f"❌ {error}")
@@ -793,107 +848,34 @@ def main():
             search_term = st.text_input("Tìm kiếm...", key="search_term")
         
         # Hiển thị danh sách câu hỏi
-        df_posts = get_forum_posts(filter_category if filter_category != "Tất cả" else "Tất cả")
+        posts = get_forum_posts(filter_category if filter_category != "Tất cả" else "Tất cả")
         
-        if not df_posts.empty:
+        if posts:
             if search_term:
-                df_posts = df_posts[
-                    df_posts['content'].str.contains(search_term, case=False)
-                ]
+                term = search_term.lower()
+                posts = [post for post in posts if term in post.content.lower()]
             
-            for idx, post in df_posts.iterrows():
-                status_badge = "✅ Đã trả lời" if post['is_answered'] else "⏳ Chờ trả lời"
-                badge_color = "#28a745" if post['is_answered'] else "#ffc107"
+            # Mỗi bài chỉ một dòng tóm tắt; bình luận, ghi âm và form trả lời
+            # chỉ được dựng cho bài đang mở (không còn 50 iframe/form mỗi lần rerun)
+            selected_post = st.session_state.get('forum_selected_post')
+            for post in posts:
+                status_badge = "✅ Đã trả lời" if post.is_answered else "⏳ Chờ trả lời"
+                is_open = post.id == selected_post
+                preview = post.content if len(post.content) <= 120 else post.content[:117] + "..."
                 
-                # Hiển thị không có tiêu đề, chỉ chủ đề và thời gian
-                with st.expander(f"**{post['category']}** - {post['formatted_date']} • {status_badge}", expanded=False):
-                    st.markdown(f"""
-                    <div style="margin-bottom: 1rem;">
-                        <strong>👤 {post['anonymous_id']}</strong> • 
-                        <span style="background-color: {badge_color}; color: white; padding: 2px 8px; border-radius: 10px; font-size: 0.8em;">
-                            {status_badge}
-                        </span>
-                    </div>
-                    <div style="background: #f8f9fa; padding: 1rem; border-radius: 5px; margin-bottom: 1rem;">
-                        {post['content']}
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    df_replies = get_forum_replies(post['id'])
-                    st.markdown(f"**💬 Bình luận ({len(df_replies)})**")
-                    
-                    if not df_replies.empty:
-                        for _, reply in df_replies.iterrows():
-                            reply_class = "official-reply" if reply['is_official'] else "user-reply"
-                            author_icon = "👮" if reply['is_official'] else "👤"
-                            
-                            st.markdown(f"""
-                            <div class="{reply_class}" style="padding: 1rem; margin: 0.5rem 0; border-radius: 5px;">
-                                <strong>{author_icon} {reply['display_name']}</strong> 
-                                <small style="color: #666;">({reply['formatted_date']})</small>
-                                <p style="margin-top: 0.5rem;">{reply['content']}</p>
-                            </div>
-                            """, unsafe_allow_html=True)
-                    else:
-                        st.info("Chưa có bình luận nào.")
-                    
-                    # Form bình luận cho công an VỚI GHI ÂM
-                    if st.session_state.police_user:
-                        if MIC_RECORDER_AVAILABLE:
-                            st.markdown("### 🎤 Ghi âm bình luận")
-                            reply_audio_text = create_mic_recorder_component(f"reply_audio_{post['id']}", "Bình luận bằng giọng nói")
-                            if reply_audio_text:
-                                st.session_state.speech_texts[f'reply_{post["id"]}'] = reply_audio_text
-                        
-                        with st.form(f"reply_form_{post['id']}"):
-                            # Nội dung bình luận
-                            reply_content_value = ""
-                            if 'speech_texts' in st.session_state and f'reply_{post["id"]}' in st.session_state.speech_texts:
-                                reply_content_value = st.session_state.speech_texts[f'reply_{post["id"]}']
-                            
-                            reply_content = st.text_area(
-                                "Bình luận của bạn:",
-                                height=80,
-                                placeholder="Viết câu trả lời hoặc ý kiến...",
-                                value=reply_content_value,
-                                key=f"reply_input_{post['id']}"
-                            )
-                            
-                            col1, col2 = st.columns([3, 1])
-                            with col1:
-                                submitted_reply = st.form_submit_button(
-                                    f"👮 Trả lời ({st.session_state.police_user['display_name']})",
-                                    use_container_width=True,
-                                    type="primary"
-                                )
-                            with col2:
-                                clear_reply = st.form_submit_button("🗑️ Xóa", use_container_width=True)
-                            
-                            if clear_reply:
-                                if f'reply_{post["id"]}' in st.session_state.speech_texts:
-                                    del st.session_state.speech_texts[f'reply_{post["id"]}']
-                                st.rerun()
-                            
-                            if submitted_reply:
-                                if not reply_content.strip():
-                                    st.error("Vui lòng nhập nội dung bình luận!")
-                                else:
-                                    result = save_forum_reply(
-                                        post['id'], 
-                                        reply_content, 
-                                        is_police=True,
-                                        police_info=st.session_state.police_user
-                                    )
-                                    
-                                    if result[0]:
-                                        st.success(f"✅ Đã gửi trả lời lúc {format_vietnam_time(get_vietnam_time())}!")
-                                        if f'reply_{post["id"]}' in st.session_state.speech_texts:
-                                            del st.session_state.speech_texts[f'reply_{post["id"]}']
-                                        st.rerun()
-                                    else:
-                                        st.error(f"❌ {result[1]}")
-                    else:
-                        st.warning("🔒 **Chỉ công an mới được bình luận và trả lời câu hỏi.**")
+                col_summary, col_toggle = st.columns([5, 1])
+                with col_summary:
+                    st.markdown(f"**{post.category}** - {post.formatted_date} • {status_badge} • 💬 {post.reply_count}")
+                    st.caption(preview)
+                with col_toggle:
+                    if st.button("🔼 Đóng" if is_open else "🔽 Xem", key=f"forum_toggle_{post.id}",
+                                 use_container_width=True):
+                        st.session_state.forum_selected_post = None if is_open else post.id
+                        st.rerun()
+                
+                if is_open:
+                    render_forum_post_detail(post)
+                st.markdown("---")
         else:
             st.info("📝 Chưa có câu hỏi nào. Hãy là người đầu tiên đặt câu hỏi!")
     
@@ -901,7 +883,7 @@ def main():
     with tab3:
         st.subheader("📖 Thông tin hệ thống")
         
-        server_time = datetime.now()
+        server_time = datetime.now(timezone.utc)
         vietnam_time = get_vietnam_time()
         
         col_time1, col_time2 = st.columns(2)
@@ -938,6 +920,28 @@ def main():
         4. **Có thể ghi âm** để trả lời
         """)
 
+    # ========= TAB 4: QUẢN LÝ PHẢN ÁNH (CÔNG AN) =========
+    if st.session_state.police_user:
+        with tabs[3]:
+            render_report_browser(st.session_state.police_user)
+    
+    # ========= TAB 5: CÂU HỎI CHỜ TRẢ LỜI (CÔNG AN) =========
+    if st.session_state.police_user:
+        with tabs[4]:
+            render_question_queue(st.session_state.police_user, save_forum_reply)
+    
+    # ========= TAB 6: BẢN ĐỒ ĐIỂM NÓNG (CÔNG AN) =========
+    if st.session_state.police_user:
+        with tabs[5]:
+            render_heatmap()
+    
+    # ========= TAB 7: THỐNG KÊ (ADMIN) =========
+    if is_admin:
+        with tabs[-1]:
+            render_dashboard()
+            if EMAIL_AVAILABLE:
+                render_replay_panel(send_email_report)
+
 # ================ CHẠY ỨNG DỤNG ================
 if __name__ == "__main__":
     main()
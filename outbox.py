@@ -0,0 +1,227 @@
+# outbox.py - Luồng nền gửi email thông báo từ bảng email_outbox (thử lại, backoff, dead-letter)
+import json
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import get_storage
+from timeutils import format_vietnam_time, now_epoch
+
+# Số email gửi song song tối đa (giới hạn tải lên email API)
+MAX_CONCURRENT_SENDS = 4
+# Thời gian giữ một email đang gửi; quá hạn (tiến trình chết) thì email được gửi lại
+SEND_LEASE_SECONDS = 120
+# Chu kỳ quét outbox khi không có ai đánh thức
+POLL_INTERVAL_SECONDS = 15
+# Backoff lũy thừa: 30s, 1 phút, 2 phút... tối đa 1 giờ; sau MAX_ATTEMPTS lần -> dead
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+MAX_ATTEMPTS = 8
+# Chế độ tổng hợp (digest): gom phản ánh không khẩn trong DIGEST_WINDOW_SECONDS
+# hoặc khi đủ DIGEST_MAX_REPORTS thành một email; phản ánh khẩn luôn gửi ngay
+DIGEST_WINDOW_SECONDS = 600
+DIGEST_MAX_REPORTS = 20
+
+# Trạng thái email thông báo trả cho người gửi phản ánh: email mới vào outbox (luồng nền gửi sau),
+# chưa phải đã gửi tới hộp thư công an
+EMAIL_QUEUED = 'queued'
+EMAIL_NOT_CONFIGURED = 'not_configured'
+
+
+class DigestConfig:
+    """Cấu hình chế độ tổng hợp email thông báo"""
+    __slots__ = ('enabled', 'window_seconds', 'max_reports')
+
+    def __init__(self, enabled=False, window_seconds=DIGEST_WINDOW_SECONDS, max_reports=DIGEST_MAX_REPORTS):
+        self.enabled = enabled
+        self.window_seconds = int(window_seconds)
+        self.max_reports = max(int(max_reports), 2)
+
+
+def load_digest_config():
+    """[notifications] trong secrets (digest, digest_window_minutes, digest_max_reports) hoặc biến môi trường"""
+    try:
+        import streamlit as st
+
+        section = st.secrets["notifications"]
+        return DigestConfig(
+            enabled=bool(section.get("digest", False)),
+            window_seconds=float(section.get("digest_window_minutes", DIGEST_WINDOW_SECONDS / 60)) * 60,
+            max_reports=section.get("digest_max_reports", DIGEST_MAX_REPORTS),
+        )
+    except Exception:
+        return DigestConfig(
+            enabled=os.environ.get('EMAIL_DIGEST', '0') == '1',
+            window_seconds=os.environ.get('EMAIL_DIGEST_WINDOW_SECONDS', DIGEST_WINDOW_SECONDS),
+            max_reports=os.environ.get('EMAIL_DIGEST_MAX_REPORTS', DIGEST_MAX_REPORTS),
+        )
+
+
+def retry_delay(attempts):
+    """Số giây chờ trước lần thử kế tiếp sau `attempts` lần thất bại (có jitter ±20%)"""
+    delay = RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)) * random.uniform(0.8, 1.2)
+    return int(min(delay, RETRY_MAX_SECONDS))
+
+
+def build_report_data(payload, created_ts):
+    """report_data cho send_email_report từ payload đã lưu trong outbox"""
+    report_data = json.loads(payload)
+    report_data['created_at'] = format_vietnam_time(created_ts)
+    return report_data
+
+
+class OutboxDispatcher:
+    """
+    Luồng nền đọc email tới hạn trong outbox và gửi qua `sender(report_data)`.
+
+    Người dân chỉ chờ transaction ghi phản ánh + outbox; email API chậm hay
+    ngừng hoạt động thì email nằm lại outbox và được thử lại theo backoff,
+    quá MAX_ATTEMPTS lần thì chuyển sang trạng thái dead để công an kiểm tra.
+
+    Có digest_sender và digest.enabled: phản ánh khẩn vẫn gửi từng email ngay,
+    phản ánh thường được gom thành một email tổng hợp.
+    """
+
+    def __init__(self, storage, sender, max_concurrent=MAX_CONCURRENT_SENDS,
+                 poll_interval=POLL_INTERVAL_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 digest_sender=None, digest=None):
+        self.storage = storage
+        self.sender = sender
+        self.digest_sender = digest_sender
+        self.digest = digest or DigestConfig()
+        self.max_concurrent = max_concurrent
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.dead = 0
+        self.digests = 0
+        self.api_calls = 0
+
+    @property
+    def digest_enabled(self):
+        return self.digest.enabled and self.digest_sender is not None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Báo có email mới - gọi sau khi transaction phản ánh đã commit"""
+        self._ensure_started()
+        self._wakeup.set()
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.max_concurrent,
+                                thread_name_prefix='email-send') as pool:
+            while True:
+                self._wakeup.clear()
+                try:
+                    sent = self.dispatch_once(pool)
+                except Exception:
+                    # Database tạm lỗi: chờ chu kỳ sau, không để luồng nền chết
+                    sent = 0
+                # Còn việc (lô đầy) thì quét tiếp ngay, không thì chờ đánh thức
+                if sent < self.max_concurrent:
+                    self._wakeup.wait(self.poll_interval)
+
+    def dispatch_once(self, pool=None):
+        """Nhận một lô email tới hạn và gửi; trả về số email đã nhận"""
+        if not self.digest_enabled:
+            rows = self.storage.claim_outbox(self.max_concurrent, SEND_LEASE_SECONDS)
+            self._deliver_each(rows, pool)
+            return len(rows)
+
+        # Khẩn: từng email, ngay lập tức
+        rows = self.storage.claim_outbox(self.max_concurrent, SEND_LEASE_SECONDS, urgent=True)
+        self._deliver_each(rows, pool)
+        claimed = len(rows)
+
+        # Thường: đủ số lượng hoặc phản ánh cũ nhất đã chờ hết cửa sổ thì gửi tổng hợp
+        waiting, oldest_ts = self.storage.digest_backlog()
+        if waiting and (waiting >= self.digest.max_reports
+                        or now_epoch() - oldest_ts >= self.digest.window_seconds):
+            batch = self.storage.claim_outbox(self.digest.max_reports, SEND_LEASE_SECONDS, urgent=False)
+            self._deliver_digest(batch)
+            claimed += len(batch)
+        return claimed
+
+    def _deliver_each(self, rows, pool):
+        if pool is None:
+            for row in rows:
+                self._deliver(*row)
+        else:
+            list(pool.map(lambda row: self._deliver(*row), rows))
+
+    def _call(self, sender, data):
+        self.api_calls += 1
+        try:
+            return sender(data)
+        except Exception as e:
+            return False, str(e)
+
+    def _deliver(self, outbox_id, report_id, payload, attempts, created_ts):
+        success, message = self._call(self.sender, build_report_data(payload, created_ts))
+        if success:
+            self.storage.complete_outbox(outbox_id)
+            self.sent += 1
+        else:
+            self._record_failure(outbox_id, attempts, message)
+
+    def _deliver_digest(self, rows):
+        if len(rows) <= 1:
+            for row in rows:
+                self._deliver(*row)
+            return
+
+        rows = sorted(rows, key=lambda row: (row[4], row[0]))
+        reports = [build_report_data(payload, created_ts) for _, _, payload, _, created_ts in rows]
+        success, message = self._call(self.digest_sender, reports)
+        if success:
+            for row in rows:
+                self.storage.complete_outbox(row[0])
+            self.sent += len(rows)
+            self.digests += 1
+        else:
+            for outbox_id, _, _, attempts, _ in rows:
+                self._record_failure(outbox_id, attempts, message)
+
+    def _record_failure(self, outbox_id, attempts, message):
+        attempts += 1
+        if attempts >= self.max_attempts:
+            self.storage.fail_outbox(outbox_id, str(message)[:500], None)
+            self.dead += 1
+        else:
+            self.storage.fail_outbox(outbox_id, str(message)[:500], now_epoch() + retry_delay(attempts))
+            self.failed += 1
+
+    def stats(self):
+        """Số email (phản ánh) đã gửi / thất bại sẽ thử lại / dead, số email tổng hợp và số lần gọi API"""
+        return {'sent': self.sent, 'failed': self.failed, 'dead': self.dead,
+                'digests': self.digests, 'api_calls': self.api_calls}
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher(sender, digest_sender=None):
+    """
+    Dispatcher dùng chung cho cả tiến trình.
+    sender gửi một report_data; digest_sender (tùy chọn) gửi một danh sách report_data.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = OutboxDispatcher(get_storage(), sender, digest_sender=digest_sender,
+                                               digest=load_digest_config())
+    return _dispatcher
@@ -0,0 +1,83 @@
+# question_queue.py - Hàng đợi câu hỏi diễn đàn chờ công an trả lời, cũ nhất trước
+#
+# Danh sách diễn đàn chỉ giữ 50 bài mới nhất nên câu hỏi cũ chưa trả lời bị trôi mất.
+# Hàng đợi này đọc trên idx_forum_posts_unanswered (chỉ chứa is_answered = 0): chi phí
+# theo số câu hỏi còn chờ, không theo độ lớn của diễn đàn.
+from analytics import format_duration
+from report_browser import paged, render_pager, split_page
+from storage import get_storage
+from timeutils import now_epoch
+
+QUESTION_PAGE_SIZE = 20
+
+# Thời hạn trả lời: quá nửa thời hạn là "sắp quá hạn"
+QUESTION_SLA_HOURS = 48
+
+
+def sla_status(created_ts, now=None, sla_hours=QUESTION_SLA_HOURS):
+    """(biểu tượng, nhãn) theo thời gian câu hỏi đã chờ so với thời hạn trả lời"""
+    age = (now if now is not None else now_epoch()) - (created_ts or 0)
+    limit = sla_hours * 3600
+    if age >= limit:
+        return "🔴", "Quá hạn"
+    if age >= limit / 2:
+        return "🟡", "Sắp quá hạn"
+    return "🟢", "Trong hạn"
+
+
+def unanswered_page(after=None, page_size=QUESTION_PAGE_SIZE, storage=None):
+    """(list[ForumPost], khóa trang sau) của câu hỏi chưa có phản hồi chính thức"""
+    storage = storage or get_storage()
+    return split_page(storage.list_unanswered_posts(after, page_size + 1), page_size)
+
+
+def pending_count(storage=None):
+    """Số câu hỏi chờ trả lời (toàn thời gian) từ bảng tổng hợp - không đếm trên forum_posts"""
+    totals = (storage or get_storage()).analytics_totals()
+    return max(totals.get('questions', (0, 0))[0] - totals.get('answered', (0, 0))[0], 0)
+
+
+# ================ GIAO DIỆN CÔNG AN ================
+def render_question_queue(police_user, reply):
+    """
+    Tab câu hỏi chờ trả lời (gọi bên trong `with tab:` của Streamlit).
+    reply(post_id, nội dung, is_police, police_info) -> (reply_id, thông báo), ví dụ save_forum_reply.
+    """
+    import streamlit as st
+
+    st.subheader("❓ Câu hỏi chờ trả lời")
+    try:
+        st.caption(f"{pending_count()} câu hỏi chưa có phản hồi chính thức • "
+                   f"thời hạn trả lời {QUESTION_SLA_HOURS} giờ")
+        rows, next_cursor, cursors = paged(st, 'questions_queue', (), unanswered_page)
+    except Exception as e:
+        st.error(f"Không tải được hàng đợi câu hỏi: {e}")
+        return
+
+    if not rows:
+        st.success("✅ Không còn câu hỏi nào chờ trả lời.")
+    now = now_epoch()
+    for post in rows:
+        icon, label = sla_status(post.created_ts, now)
+        waited = format_duration(now - post.created_ts) if post.created_ts else "N/A"
+        with st.expander(f"{icon} {post.category} • chờ {waited} • {post.formatted_date}"):
+            st.caption(f"👤 {post.anonymous_id} • {label}")
+            st.text(post.content)
+            # Chỉ dựng ô trả lời cho câu hỏi cán bộ chọn, không kèm bình luận hay phần còn lại của diễn đàn
+            if st.checkbox("✍️ Trả lời", key=f"queue_reply_open_{post.id}"):
+                _render_reply_form(st, post, police_user, reply)
+    render_pager(st, 'questions_queue', cursors, rows, next_cursor, unit="câu hỏi")
+
+
+def _render_reply_form(st, post, police_user, reply):
+    with st.form(f"queue_reply_form_{post.id}"):
+        content = st.text_area("Câu trả lời chính thức", height=100, key=f"queue_reply_{post.id}")
+        if st.form_submit_button(f"👮 Trả lời ({police_user['display_name']})", type="primary"):
+            if not content.strip():
+                st.error("Vui lòng nhập nội dung trả lời!")
+                return
+            reply_id, message = reply(post.id, content.strip(), True, police_user)
+            if reply_id:
+                # Câu hỏi đã có phản hồi chính thức nên rời hàng đợi ở lần hiển thị sau
+                st.rerun()
+            st.error(f"❌ {message}")
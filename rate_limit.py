@@ -0,0 +1,245 @@
+# rate_limit.py - Giới hạn tốc độ: token bucket cho email API, cửa sổ trượt cho đăng nhập / gửi bài
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Mặc định an toàn cho gói SendGrid/Gmail thông thường; chỉnh trong secrets nếu nhà cung cấp cho phép hơn
+DEFAULT_RATE_PER_SECOND = 5.0
+DEFAULT_BURST = 10
+# Chờ lâu hơn mức này thì trả lỗi để outbox thử lại sau, không giữ luồng gửi mãi
+DEFAULT_MAX_WAIT_SECONDS = 30.0
+
+
+def reserve(tokens, updated, now, rate, burst, cost=1.0, max_wait=None):
+    """
+    Nạp lại bucket tới thời điểm now rồi đặt trước `cost` token.
+
+    Số token được phép âm: người gọi sau xếp hàng phía sau người gọi trước
+    thay vì cùng tranh nhau khi bucket vừa đầy lại.
+    Trả về (số token mới, số giây phải chờ) hoặc (tokens, None) nếu phải chờ quá max_wait.
+    """
+    tokens = min(float(burst), tokens + max(now - updated, 0.0) * rate)
+    remaining = tokens - cost
+    wait = -remaining / rate if remaining < 0 else 0.0
+    if max_wait is not None and wait > max_wait:
+        return tokens, None
+    return remaining, wait
+
+
+class TokenBucket:
+    """
+    Token bucket dùng chung cho mọi luồng trong tiến trình.
+
+    acquire() chờ tới lượt thay vì báo lỗi; số người đang chờ và tổng thời
+    gian bị giữ lại được đếm trong stats().
+    """
+
+    def __init__(self, rate_per_second=DEFAULT_RATE_PER_SECOND, burst=DEFAULT_BURST,
+                 max_wait=DEFAULT_MAX_WAIT_SECONDS):
+        self.rate = float(rate_per_second)
+        self.burst = max(int(burst), 1)
+        self.max_wait = max_wait
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._metrics = _Metrics()
+
+    def _reserve(self, cost):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens, wait = reserve(self._tokens, self._updated, now,
+                                         self.rate, self.burst, cost, self.max_wait)
+            self._updated = now
+            return wait
+
+    def acquire(self, cost=1.0):
+        """Lấy token (chờ nếu cần); False nếu phải chờ quá max_wait"""
+        return self._metrics.wait_for(self._reserve(cost))
+
+    def stats(self):
+        return self._metrics.snapshot(shared=False)
+
+
+class SharedTokenBucket:
+    """
+    Token bucket lưu trong bảng rate_buckets: mọi tiến trình/replica dùng chung
+    một hạn mức với nhà cung cấp email.
+    """
+
+    def __init__(self, storage, name, rate_per_second=DEFAULT_RATE_PER_SECOND, burst=DEFAULT_BURST,
+                 max_wait=DEFAULT_MAX_WAIT_SECONDS):
+        self.storage = storage
+        self.name = name
+        self.rate = float(rate_per_second)
+        self.burst = max(int(burst), 1)
+        self.max_wait = max_wait
+        self._metrics = _Metrics()
+
+    def acquire(self, cost=1.0):
+        """Lấy token (chờ nếu cần); False nếu phải chờ quá max_wait"""
+        wait = self.storage.reserve_rate_tokens(self.name, self.rate, self.burst, cost, self.max_wait)
+        return self._metrics.wait_for(wait)
+
+    def stats(self):
+        return self._metrics.snapshot(shared=True)
+
+
+class _Metrics:
+    """Đếm lượt lấy token, số lượt phải chờ, độ sâu hàng chờ và thời gian bị giữ lại"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.throttle_seconds = 0.0
+        self.waiting = 0
+        self.max_waiting = 0
+
+    def wait_for(self, wait):
+        if wait is None:
+            with self._lock:
+                self.rejected += 1
+            return False
+        if wait > 0:
+            with self._lock:
+                self.throttled += 1
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+                    self.throttle_seconds += wait
+        with self._lock:
+            self.acquired += 1
+        return True
+
+    def snapshot(self, shared):
+        with self._lock:
+            return {
+                'shared': shared,
+                'acquired': self.acquired,
+                'throttled': self.throttled,
+                'rejected': self.rejected,
+                'throttle_seconds': round(self.throttle_seconds, 3),
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+            }
+
+
+class SlidingWindowLimiter:
+    """
+    Cửa sổ trượt theo khóa: tối đa `limit` lượt trong `window_seconds` gần nhất.
+
+    hit() kiểm tra và ghi lượt trong cùng một lần khóa, nên nhiều luồng gửi
+    cùng lúc không vượt được giới hạn. Chỉ giữ tối đa max_keys khóa gần nhất
+    (LRU) để kẻ tấn công đổi khóa liên tục không làm phình bộ nhớ.
+    """
+
+    def __init__(self, limit, window_seconds, max_keys=10000):
+        self.limit = limit
+        self.window = window_seconds
+        self.max_keys = max_keys
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def hit(self, key, now=None):
+        """
+        Ghi một lượt: trả về (0, token) nếu được phép, ngược lại (số giây phải chờ, None) và không ghi.
+        token là thời điểm của lượt vừa ghi - đưa lại cho forgive() để bỏ đúng lượt đó.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            events = self._events.get(key)
+            if events is None:
+                events = self._events[key] = deque()
+                if len(self._events) > self.max_keys:
+                    self._events.popitem(last=False)
+            else:
+                self._events.move_to_end(key)
+            while events and events[0] <= now - self.window:
+                events.popleft()
+            if len(events) >= self.limit:
+                self.rejected += 1
+                return events[0] + self.window - now, None
+            events.append(now)
+            self.allowed += 1
+            return 0, now
+
+    def forgive(self, key, token):
+        """
+        Bỏ lượt `token` (do hit() trả về) của khóa, ví dụ đăng nhập thành công không tính là đoán sai.
+        Lượt của request khác ghi sau đó vẫn được giữ nguyên.
+        """
+        with self._lock:
+            events = self._events.get(key)
+            if events and token is not None:
+                try:
+                    events.remove(token)
+                except ValueError:
+                    # Lượt đã hết hạn và bị dọn khỏi cửa sổ
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._events), 'allowed': self.allowed, 'rejected': self.rejected}
+
+
+class SharedSlidingWindow:
+    """
+    Cửa sổ trượt lưu trong bảng rate_events: giới hạn chung cho mọi tiến trình/replica.
+    Tốn một transaction ghi mỗi lượt, nên đặt sau SlidingWindowLimiter trong bộ nhớ (TieredLimiter).
+    """
+
+    def __init__(self, storage, name, limit, window_seconds):
+        self.storage = storage
+        self.name = name
+        self.limit = limit
+        self.window = window_seconds
+        self.allowed = 0
+        self.rejected = 0
+
+    def hit(self, key):
+        wait = self.storage.hit_rate_window(self.name, key, self.limit, self.window)
+        if wait:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self):
+        return {'allowed': self.allowed, 'rejected': self.rejected}
+
+
+class TieredLimiter:
+    """
+    Cửa sổ trong bộ nhớ trước (gần như miễn phí, chặn phần lớn spam), rồi tới
+    cửa sổ dùng chung qua database nếu có. Lượt bị tầng sau từ chối không tính ở tầng trước.
+    """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def hit(self, key):
+        wait, token = self.local.hit(key)
+        if wait or self.shared is None:
+            return wait
+        try:
+            wait = self.shared.hit(key)
+        except Exception:
+            # Database lỗi: vẫn còn giới hạn trong bộ nhớ, không chặn người dân
+            return 0
+        if wait:
+            self.local.forgive(key, token)
+        return wait
+
+    def stats(self):
+        stats = {'local': self.local.stats()}
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+        return stats
@@ -0,0 +1,113 @@
+# read_cache.py - Bộ nhớ đệm đọc dùng chung giữa các phiên, vô hiệu hóa khi có ghi
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Backend dùng chung giữa nhiều replica (PostgreSQL): ghi ở replica khác không gọi
+# bump_generation() của tiến trình này, nên kết quả chỉ được dùng lại trong tối đa chừng này giây
+SHARED_BACKEND_TTL_SECONDS = 5
+
+
+class ReadCache:
+    """
+    Cache LRU cho các truy vấn đọc (diễn đàn, thống kê).
+
+    Khóa gồm tên truy vấn + tham số + "thế hệ dữ liệu". Mỗi lần ghi gọi
+    bump_generation() nên mọi kết quả cũ tự động không còn được dùng tới
+    và bị đẩy ra dần theo LRU.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def bump_generation(self):
+        """Đánh dấu dữ liệu đã thay đổi - gọi sau mỗi lần ghi thành công"""
+        with self._lock:
+            self._generation += 1
+            # Kết quả của thế hệ cũ không bao giờ được đọc lại nữa
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def get_or_load(self, name, params, loader):
+        """Trả kết quả đã cache, hoặc gọi loader() rồi lưu lại (lỗi thì không cache)"""
+        key = (name, params)
+        now = time.monotonic()
+
+        with self._lock:
+            generation = self._generation
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_generation, loaded_at, value = entry
+                fresh = self.ttl_seconds is None or now - loaded_at < self.ttl_seconds
+                if entry_generation == generation and fresh:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+
+        value = loader()
+
+        with self._lock:
+            # Có ghi xảy ra trong lúc đang đọc: không lưu kết quả có thể đã cũ
+            if generation == self._generation:
+                self._entries[key] = (generation, now, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def stats(self):
+        """Số liệu hiệu quả cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'generation': self._generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+def load_cache_ttl(shared):
+    """
+    Thời gian sống của kết quả cache (None = chỉ vô hiệu hóa khi ghi):
+    CÁCH 1: st.secrets["database"]["cache_ttl_seconds"]
+    CÁCH 2: biến môi trường READ_CACHE_TTL_SECONDS
+    Mặc định: SHARED_BACKEND_TTL_SECONDS với backend dùng chung, None với SQLite một tiến trình.
+    """
+    default = SHARED_BACKEND_TTL_SECONDS if shared else None
+    try:
+        import streamlit as st
+        ttl = st.secrets["database"].get("cache_ttl_seconds", default)
+    except Exception:
+        ttl = os.environ.get('READ_CACHE_TTL_SECONDS', default)
+    return None if ttl is None or ttl == '' else float(ttl)
+
+
+def configure_read_cache(storage, cache=None):
+    """Đặt TTL của cache theo backend đang dùng - gọi một lần khi khởi tạo tiến trình"""
+    cache = cache if cache is not None else read_cache
+    cache.ttl_seconds = load_cache_ttl(storage.shared)
+    return cache.ttl_seconds
+
+
+# Một cache cho cả tiến trình - mọi phiên Streamlit dùng chung
+read_cache = ReadCache()
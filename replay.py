@@ -0,0 +1,166 @@
+# replay.py - Gửi lại email thông báo cho phản ánh công an chưa nhận được (email_sent = 0)
+#
+# Sau sự cố email API, phản ánh không gửi được vẫn nằm trong database với
+# email_sent = 0. Công cụ này đọc chúng theo idx_reports_unsent, gửi lại song song
+# theo lô (qua transport đã giới hạn tốc độ) và đánh dấu đã gửi cho cả lô một lần.
+#
+# Dòng lệnh:  python replay.py --from 2024-05-01 --to 2024-05-03 --dry-run
+import argparse
+
+from outbox import MAX_CONCURRENT_SENDS
+from storage import get_storage
+from timeutils import format_vietnam_time, now_epoch, vietnam_day_bounds
+
+REPLAY_BATCH_SIZE = 200
+
+
+def replay_bounds(start_day=None, end_day=None):
+    """Khoảng epoch [start, end) theo ngày giờ Việt Nam; bỏ trống = không giới hạn"""
+    start_ts = vietnam_day_bounds(start_day)[0] if start_day else 0
+    end_ts = vietnam_day_bounds(end_day)[1] if end_day else now_epoch() + 1
+    return start_ts, end_ts
+
+
+def build_replay_data(row):
+    """report_data cho send_email_report từ một dòng list_unsent_reports"""
+    report_id, title, description, location, incident_time, is_urgent, created_ts = row
+    return {
+        'report_id': report_id,
+        'title': title,
+        'description': description,
+        'location': location,
+        'incident_time': incident_time,
+        'urgent': bool(is_urgent),
+        'created_at': format_vietnam_time(created_ts),
+    }
+
+
+def replay_unsent(sender, start_day=None, end_day=None, dry_run=False, batch_size=REPLAY_BATCH_SIZE,
+                  max_workers=MAX_CONCURRENT_SENDS, limit=None, storage=None, progress=None):
+    """
+    Gửi lại email cho phản ánh email_sent = 0 trong khoảng ngày.
+
+    sender(report_data) -> (thành công, chi tiết). Phản ánh gửi lỗi giữ nguyên
+    email_sent = 0 để lần chạy sau thử lại. progress(result) được gọi sau mỗi lô.
+    Trả về {'found', 'sent', 'failed', 'errors': [(report_id, chi tiết), ...]}.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    storage = storage or get_storage()
+    start_ts, end_ts = replay_bounds(start_day, end_day)
+    result = {'found': 0, 'sent': 0, 'failed': 0, 'errors': []}
+    after = (0, 0)
+
+    def send(report_data):
+        try:
+            return sender(report_data)
+        except Exception as e:
+            return False, str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='email-replay') as pool:
+        while limit is None or result['found'] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - result['found'])
+            rows = storage.list_unsent_reports(start_ts, end_ts, after, size)
+            if not rows:
+                break
+            # Khóa phân trang: lỗi gửi không làm lô sau đọc lại đúng các dòng đó
+            after = (rows[-1][6], rows[-1][0])
+            result['found'] += len(rows)
+            if dry_run:
+                continue
+
+            reports = [build_replay_data(row) for row in rows]
+            sent_ids = []
+            for report, (success, detail) in zip(reports, pool.map(send, reports)):
+                if success:
+                    sent_ids.append(report['report_id'])
+                else:
+                    result['errors'].append((report['report_id'], str(detail)[:200]))
+            if sent_ids:
+                storage.mark_reports_email_sent(sent_ids)
+            result['sent'] += len(sent_ids)
+            result['failed'] += len(rows) - len(sent_ids)
+            if progress:
+                progress(result)
+    return result
+
+
+# ================ GIAO DIỆN ADMIN ================
+def render_replay_panel(sender):
+    """Khối 'gửi lại email bị lỡ' cho tài khoản admin (gọi bên trong `with tab:` của Streamlit)"""
+    import streamlit as st
+
+    from analytics import last_days
+
+    with st.expander("📨 Gửi lại email thông báo bị lỡ"):
+        st.caption("Tìm phản ánh công an chưa nhận được email (email_sent = 0) và gửi lại.")
+        default_start, default_end = last_days(7)
+        col1, col2 = st.columns(2)
+        with col1:
+            start = st.date_input("Từ ngày", value=_to_date(default_start), key="replay_start")
+        with col2:
+            end = st.date_input("Đến ngày", value=_to_date(default_end), key="replay_end")
+
+        col_check, col_send = st.columns(2)
+        with col_check:
+            check = st.button("🔍 Kiểm tra (không gửi)", use_container_width=True, key="replay_dry_run")
+        with col_send:
+            send = st.button("📨 Gửi lại", type="primary", use_container_width=True, key="replay_send")
+
+        if check:
+            result = replay_unsent(sender, start, end, dry_run=True)
+            st.info(f"Có {result['found']} phản ánh chưa gửi được email trong khoảng này.")
+        elif send:
+            status = st.empty()
+            result = replay_unsent(
+                sender, start, end,
+                progress=lambda r: status.caption(f"Đã gửi {r['sent']} • lỗi {r['failed']}..."),
+            )
+            status.empty()
+            if result['failed']:
+                st.warning(f"Đã gửi lại {result['sent']}/{result['found']} email; "
+                           f"{result['failed']} email lỗi sẽ được thử lại ở lần chạy sau.")
+                st.caption(f"Lỗi đầu tiên (PA-{result['errors'][0][0]:06d}): {result['errors'][0][1]}")
+            else:
+                st.success(f"✅ Đã gửi lại {result['sent']} email thông báo.")
+
+
+def _to_date(day):
+    from datetime import datetime
+
+    from timeutils import DAY_FORMAT
+
+    return datetime.strptime(day, DAY_FORMAT).date()
+
+
+# ================ CHẠY TỪ DÒNG LỆNH ================
+def main():
+    from email_service import email_configured, send_email_report
+
+    parser = argparse.ArgumentParser(description="Gửi lại email thông báo cho phản ánh chưa gửi được")
+    parser.add_argument('--from', dest='start_day', help="Từ ngày YYYY-MM-DD (giờ Việt Nam)")
+    parser.add_argument('--to', dest='end_day', help="Đến ngày YYYY-MM-DD (giờ Việt Nam)")
+    parser.add_argument('--dry-run', action='store_true', help="Chỉ đếm, không gửi")
+    parser.add_argument('--batch-size', type=int, default=REPLAY_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=MAX_CONCURRENT_SENDS)
+    parser.add_argument('--limit', type=int, help="Gửi tối đa N phản ánh")
+    args = parser.parse_args()
+
+    if not args.dry_run and not email_configured():
+        parser.error("Chưa cấu hình gửi email (SendGrid API Key hoặc máy chủ SMTP)")
+
+    result = replay_unsent(
+        send_email_report, args.start_day, args.end_day, dry_run=args.dry_run,
+        batch_size=args.batch_size, max_workers=args.workers, limit=args.limit,
+        progress=lambda r: print(f"... đã gửi {r['sent']}, lỗi {r['failed']}"),
+    )
+    if args.dry_run:
+        print(f"🔍 {result['found']} phản ánh chưa gửi được email")
+        return
+    print(f"✅ Đã gửi lại {result['sent']}/{result['found']} email, lỗi {result['failed']}")
+    for report_id, detail in result['errors'][:10]:
+        print(f"   PA-{report_id:06d}: {detail}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+# report_browser.py - Danh sách phản ánh cho công an: lọc, phân trang và hàng đợi xử lý ngay trong database
+#
+# Mỗi lần hiển thị chỉ đọc REPORT_PAGE_SIZE dòng ngắn (không kèm nội dung) theo
+# index created_ts; nội dung đầy đủ của một phản ánh chỉ được đọc khi mở chi tiết.
+# Hàng đợi "chưa phân công" / "việc của tôi" đọc trên index từng phần chỉ chứa
+# phản ánh đang mở (idx_reports_unassigned / idx_reports_assignee_open).
+# "Tra cứu lưu trữ" tìm cả trong các file tháng do archive.py tạo (chỉ backend SQLite).
+import archive
+from database import REPORT_RECEIVED, REPORT_ASSIGNED, REPORT_RESOLVED
+from storage import get_storage
+from timeutils import DAY_FORMAT, format_epochs, format_vietnam_time, vietnam_range_bounds
+
+REPORT_PAGE_SIZE = 25
+
+# Lựa chọn lọc trạng thái email -> tham số email_sent của Storage.list_reports
+EMAIL_FILTERS = {
+    "Tất cả": None,
+    "Đã gửi email": True,
+    "Chưa gửi email": False,
+}
+
+STATUS_LABELS = {
+    REPORT_RECEIVED: "📥 Mới tiếp nhận",
+    REPORT_ASSIGNED: "👤 Đang xử lý",
+    REPORT_RESOLVED: "✅ Đã xử lý",
+}
+
+VIEW_UNASSIGNED = "📥 Chưa phân công"
+VIEW_MINE = "👤 Việc của tôi"
+VIEW_ALL = "🗂️ Tất cả phản ánh"
+VIEW_ARCHIVE = "🗄️ Tra cứu lưu trữ"
+
+ARCHIVE_SEARCH_LIMIT = 50
+ARCHIVE_KINDS = {
+    "Phản ánh": archive.search_reports,
+    "Câu hỏi diễn đàn": archive.search_forum_posts,
+}
+
+
+def split_page(rows, page_size):
+    """(page_size dòng đầu, khóa (created_ts, id) trang sau) từ kết quả đã đọc thừa một dòng"""
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, (rows[-1].created_ts, rows[-1].id)
+
+
+def report_page(start_day, end_day, email_sent=None, keyword=None, before=None,
+                page_size=REPORT_PAGE_SIZE, storage=None):
+    """
+    (list[ReportSummary], khóa trang sau) trong khoảng ngày giờ Việt Nam [start_day, end_day].
+    Khóa trang sau là None ở trang cuối.
+    """
+    storage = storage or get_storage()
+    start_ts, end_ts = vietnam_range_bounds(start_day, end_day)
+    return split_page(storage.list_reports(start_ts, end_ts, email_sent, keyword, before, page_size + 1),
+                      page_size)
+
+
+def queue_page(assigned_to=None, after=None, page_size=REPORT_PAGE_SIZE, storage=None):
+    """(list[ReportSummary], khóa trang sau) của hàng đợi chưa phân công / của một cán bộ, cũ nhất trước"""
+    storage = storage or get_storage()
+    return split_page(storage.list_report_queue(assigned_to, after, page_size + 1), page_size)
+
+
+def search_archive(kind, start_day, end_day, keyword='', limit=ARCHIVE_SEARCH_LIMIT,
+                   storage=None, archive_dir=archive.ARCHIVE_DIR):
+    """
+    Tìm trong database chính và các file lưu trữ tháng (khoảng ngày giờ Việt Nam):
+    (dòng khớp mới nhất trước kèm nguồn, giờ hiển thị của từng dòng, tổng số phản ánh trong khoảng).
+    """
+    storage = storage or get_storage()
+    start_ts, end_ts = vietnam_range_bounds(start_day, end_day)
+    rows = ARCHIVE_KINDS[kind](keyword, start_ts, end_ts, limit, db_path=storage.db_path, archive_dir=archive_dir)
+    total = archive.count_reports_between(start_ts, end_ts, db_path=storage.db_path, archive_dir=archive_dir)
+    return rows, format_epochs([row[5] for row in rows]), total
+
+
+# ================ GIAO DIỆN CÔNG AN ================
+def render_report_browser(police_user):
+    """Tab quản lý phản ánh cho tài khoản công an (gọi bên trong `with tab:` của Streamlit)"""
+    import streamlit as st
+
+    st.subheader("📋 Quản lý phản ánh")
+    view = st.radio("Hiển thị", [VIEW_UNASSIGNED, VIEW_MINE, VIEW_ALL, VIEW_ARCHIVE], horizontal=True,
+                    key="reports_view", label_visibility="collapsed")
+
+    if view == VIEW_ALL:
+        _render_all_reports(st, police_user)
+        return
+    if view == VIEW_ARCHIVE:
+        _render_archive_search(st)
+        return
+
+    assigned_to = police_user['badge_number'] if view == VIEW_MINE else None
+    try:
+        rows, next_cursor, cursors = paged(st, 'reports_queue', (view, assigned_to),
+                                           lambda after: queue_page(assigned_to, after))
+    except Exception as e:
+        st.error(f"Không tải được hàng đợi: {e}")
+        return
+
+    if not rows:
+        st.info("Không còn phản ánh nào chờ nhận." if assigned_to is None
+                else "Bạn không có phản ánh nào đang xử lý.")
+    for report in rows:
+        _render_report_row(st, report, police_user)
+    render_pager(st, 'reports_queue', cursors, rows, next_cursor)
+
+
+def _render_all_reports(st, police_user):
+    from datetime import datetime
+
+    from analytics import last_days
+
+    default_start, default_end = (datetime.strptime(day, DAY_FORMAT).date() for day in last_days(30))
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        start = st.date_input("Từ ngày", value=default_start, key="reports_start")
+    with col2:
+        end = st.date_input("Đến ngày", value=default_end, key="reports_end")
+    with col3:
+        email_filter = st.selectbox("Trạng thái email", list(EMAIL_FILTERS), key="reports_email")
+    keyword = st.text_input("🔍 Từ khóa (tiêu đề, địa điểm, nội dung)", key="reports_keyword").strip()
+
+    if start > end:
+        st.warning("Ngày bắt đầu phải trước ngày kết thúc.")
+        return
+
+    try:
+        rows, next_cursor, cursors = paged(
+            st, 'reports_all', (start, end, email_filter, keyword),
+            lambda before: report_page(start, end, EMAIL_FILTERS[email_filter], keyword, before),
+        )
+    except Exception as e:
+        st.error(f"Không tải được danh sách phản ánh: {e}")
+        return
+
+    if not rows:
+        st.info("Không có phản ánh nào khớp bộ lọc.")
+    for report in rows:
+        _render_report_row(st, report, police_user)
+    render_pager(st, 'reports_all', cursors, rows, next_cursor)
+
+
+def _render_archive_search(st):
+    from datetime import date, timedelta
+
+    if get_storage().name != 'sqlite':
+        st.info("Lưu trữ theo file tháng chỉ áp dụng cho backend SQLite.")
+        return
+
+    col_kind, col_start, col_end = st.columns(3)
+    with col_kind:
+        kind = st.selectbox("Tìm trong", list(ARCHIVE_KINDS), key="archive_kind")
+    with col_start:
+        start = st.date_input("Từ ngày", value=date.today() - timedelta(days=365), key="archive_start")
+    with col_end:
+        end = st.date_input("Đến ngày", value=date.today(), key="archive_end")
+    keyword = st.text_input("🔍 Từ khóa", key="archive_keyword").strip()
+
+    if start > end:
+        st.warning("Ngày bắt đầu phải trước ngày kết thúc.")
+        return
+
+    try:
+        rows, dates, total = search_archive(kind, start, end, keyword)
+    except Exception as e:
+        st.error(f"Không tra cứu được dữ liệu lưu trữ: {e}")
+        return
+
+    st.caption(f"📊 {total} phản ánh trong khoảng này (kể cả đã lưu trữ) • "
+               f"hiển thị {len(rows)} kết quả mới nhất (tối đa {ARCHIVE_SEARCH_LIMIT})")
+    if not rows:
+        st.info("Không có kết quả khớp.")
+    for row, formatted_date in zip(rows, dates):
+        source = "database chính" if row[-1] == 'hot' else f"lưu trữ {row[-1].replace('_', '/')}"
+        if kind == "Phản ánh":
+            report_id, title, description, location = row[:4]
+            with st.expander(f"PA-{report_id:06d} • {title} • {formatted_date}"):
+                st.caption(f"📍 {location or 'Không rõ địa điểm'} • 🗄️ {source}")
+                st.text(description)
+        else:
+            title, content, category = row[1:4]
+            answered = "✅ Đã trả lời" if row[7] else "⏳ Chờ trả lời"
+            with st.expander(f"❓ {title} • {formatted_date}"):
+                st.caption(f"📂 {category} • 💬 {row[6]} bình luận • {answered} • 🗄️ {source}")
+                st.text(content)
+
+
+def paged(st, name, filters, load):
+    """
+    Trang hiện tại của danh sách `name`: load(khóa trang) -> (rows, khóa trang sau).
+    cursors[i] = khóa bắt đầu của trang i; đổi bộ lọc thì quay lại trang đầu.
+    """
+    state = st.session_state.get(name)
+    if state is None or state[0] != filters:
+        state = st.session_state[name] = (filters, [None])
+    cursors = state[1]
+    rows, next_cursor = load(cursors[-1])
+    return rows, next_cursor, cursors
+
+
+def render_pager(st, name, cursors, rows, next_cursor, unit="phản ánh"):
+    """Nút trang trước / trang sau cho danh sách dùng paged()"""
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("⬅️ Trang trước", disabled=len(cursors) == 1, use_container_width=True,
+                     key=f"{name}_prev"):
+            cursors.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f"Trang {len(cursors)} • {len(rows)} {unit}")
+    with col_next:
+        if st.button("Trang sau ➡️", disabled=next_cursor is None, use_container_width=True,
+                     key=f"{name}_next"):
+            cursors.append(next_cursor)
+            st.rerun()
+
+
+def _render_report_row(st, report, police_user):
+    badge = police_user['badge_number']
+    badges = ("🚨 " if report.is_urgent else "") + ("📧" if report.email_sent else "⏳")
+    label = f"{badges} PA-{report.id:06d} • {report.title} • {report.formatted_date}"
+    with st.expander(label):
+        status = STATUS_LABELS.get(report.status, report.status)
+        if report.assigned_to:
+            status += f" ({report.assigned_to})"
+        st.caption(f"📍 {report.location or 'Không rõ địa điểm'} • {status} • "
+                   f"Email: {'đã gửi' if report.email_sent else 'chưa gửi'}")
+        # Nội dung chỉ đọc khi cán bộ bấm xem, không tải cho cả trang
+        if st.checkbox("Xem nội dung", key=f"report_detail_{report.id}"):
+            _render_report_detail(st, report.id)
+
+        if report.status == REPORT_RESOLVED:
+            return
+        col_take, col_done = st.columns(2)
+        with col_take:
+            if report.assigned_to != badge and st.button("🙋 Nhận xử lý", key=f"report_take_{report.id}",
+                                                         use_container_width=True):
+                _apply(st, get_storage().assign_report(report.id, badge))
+        with col_done:
+            if st.button("✅ Đã xử lý xong", key=f"report_done_{report.id}", use_container_width=True):
+                _apply(st, get_storage().resolve_report(report.id, badge))
+
+
+def _apply(st, changed):
+    if changed:
+        st.rerun()
+    st.warning("Phản ánh đã được xử lý xong trước đó.")
+
+
+def _render_report_detail(st, report_id):
+    report = get_storage().get_report(report_id)
+    if report is None:
+        st.warning("Phản ánh không còn tồn tại (có thể đã được lưu trữ).")
+        return
+    if report.incident_time:
+        st.markdown(f"**🕐 Thời gian sự việc:** {report.incident_time}")
+    if report.latitude is not None and report.longitude is not None:
+        st.markdown(f"**🗺️ Tọa độ:** {report.latitude:.5f}, {report.longitude:.5f}")
+    if report.assigned_ts:
+        st.markdown(f"**👤 Nhận xử lý:** {format_vietnam_time(report.assigned_ts)}")
+    if report.resolved_ts:
+        st.markdown(f"**✅ Xử lý xong:** {format_vietnam_time(report.resolved_ts)}")
+    st.text(report.description)
@@ -0,0 +1,220 @@
+# session_memory.py - Ngân sách bộ nhớ cho mỗi phiên: đo session_state, giải phóng audio / bản chuyển giọng nói cũ nhất trước
+#
+# Mỗi lần ghi âm để lại vài MB bytes WAV trong session_state (long_audio_*, giá trị của
+# component mic_recorder), cộng thêm bộ đếm giờ và văn bản đã chuyển trong speech_texts.
+# Phiên công an mở nhiều bài đăng cứ thế lớn dần tới khi đóng trình duyệt. SessionMemory
+# đo kích thước từng mục, và khi vượt ngân sách thì XÓA hẳn (không gán None) các mục
+# audio / văn bản lâu không dùng nhất. Mục vừa dùng ở lần chạy trước không bị xóa.
+import os
+import secrets
+import sys
+import threading
+import time
+
+# Khóa session_state giữ audio và trạng thái ghi âm - được phép giải phóng
+AUDIO_PREFIXES = ('long_audio_', 'recording_timer_', 'long_recorder_', 'recorder_')
+SPEECH_TEXTS = 'speech_texts'
+
+DEFAULT_BUDGET_MB = 32
+# Phiên không chạy lại script quá lâu coi như đã đóng (Streamlit không báo khi phiên kết thúc)
+SESSION_IDLE_SECONDS = 3600
+
+# Khóa nội bộ trong session_state
+_RUN = '_memory_run'
+_TOUCHED = '_memory_touched'
+_SESSION_ID = '_memory_session_id'
+
+
+def sizeof(value):
+    """Ước lượng số byte của một giá trị trong session_state (bytes / chuỗi tính theo độ dài nội dung)"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8', 'surrogatepass'))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def audio_suffix(key):
+    """'long_audio_description' / 'recorder_reply_audio_5_output' -> tên component ghi âm"""
+    for prefix in AUDIO_PREFIXES:
+        if key.startswith(prefix):
+            rest = key[len(prefix):]
+            return rest[:-len('_output')] if rest.endswith('_output') else rest
+    return None
+
+
+def format_bytes(size):
+    """Hiển thị dung lượng dạng KB / MB"""
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.0f} KB"
+
+
+def load_session_budget():
+    """
+    Ngân sách bộ nhớ mỗi phiên (byte):
+    CÁCH 1: st.secrets["session"]["memory_budget_mb"]
+    CÁCH 2: biến môi trường SESSION_MEMORY_BUDGET_MB
+    """
+    try:
+        import streamlit as st
+        budget_mb = st.secrets["session"].get("memory_budget_mb", DEFAULT_BUDGET_MB)
+    except Exception:
+        budget_mb = os.environ.get('SESSION_MEMORY_BUDGET_MB', DEFAULT_BUDGET_MB)
+    return int(float(budget_mb) * 1024 * 1024)
+
+
+# ================ TỔNG BỘ NHỚ PHIÊN CỦA TIẾN TRÌNH ================
+class SessionRegistry:
+    """Dung lượng session_state của từng phiên trong tiến trình (cập nhật mỗi lần chạy script)"""
+
+    def __init__(self, idle_seconds=SESSION_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def report(self, session_id, size, evicted=0, evicted_bytes=0):
+        with self._lock:
+            self._sessions[session_id] = (size, time.monotonic())
+            self.evictions += evicted
+            self.evicted_bytes += evicted_bytes
+
+    def totals(self):
+        """Số phiên còn hoạt động, tổng byte, phiên lớn nhất và số mục đã giải phóng"""
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            for session_id in [sid for sid, (_, seen) in self._sessions.items() if seen < cutoff]:
+                del self._sessions[session_id]
+            sizes = [size for size, _ in self._sessions.values()]
+            return {
+                'sessions': len(sizes),
+                'bytes': sum(sizes),
+                'largest': max(sizes, default=0),
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+            }
+
+
+# Một sổ cho cả tiến trình - mọi phiên Streamlit dùng chung
+session_registry = SessionRegistry()
+
+
+# ================ QUẢN LÝ BỘ NHỚ MỘT PHIÊN ================
+class SessionMemory:
+    """
+    Bọc session_state của một phiên. Gọi begin_run() đầu mỗi lần chạy script (trước khi
+    dựng widget), touch() cho khóa audio / văn bản mà lần chạy này đang dùng.
+    Mục văn bản trong speech_texts được đặt tên 'speech_texts:<tên>'.
+    """
+
+    def __init__(self, state, budget_bytes=None, registry=None):
+        self.state = state
+        self.budget_bytes = budget_bytes if budget_bytes is not None else get_session_budget()
+        self.registry = registry if registry is not None else session_registry
+        if _SESSION_ID not in state:
+            state[_SESSION_ID] = secrets.token_hex(8)
+            state[_RUN] = 0
+            state[_TOUCHED] = {}
+
+    @property
+    def run(self):
+        return self.state[_RUN]
+
+    def begin_run(self):
+        """Sang lần chạy mới và giải phóng mục cũ nếu vượt ngân sách; trả về số byte đã giải phóng"""
+        self.state[_RUN] += 1
+        return self.enforce()
+
+    def touch(self, *keys):
+        """Đánh dấu khóa audio vừa được dùng (component ghi âm đang hiển thị)"""
+        touched = self.state[_TOUCHED]
+        for key in keys:
+            touched[key] = self.run
+
+    def touch_text(self, *names):
+        """Đánh dấu văn bản speech_texts[name] vừa được dùng"""
+        self.touch(*(f"{SPEECH_TEXTS}:{name}" for name in names))
+
+    def entries(self):
+        """[(khóa, số byte, có được giải phóng)] của mọi mục trong session_state"""
+        result = []
+        for key in list(self.state.keys()):
+            if key == SPEECH_TEXTS:
+                texts = self.state[key] or {}
+                result.append((key, sys.getsizeof(texts), False))
+                result.extend((f"{SPEECH_TEXTS}:{name}", sizeof(name) + sizeof(text), True)
+                              for name, text in texts.items())
+            else:
+                result.append((key, sizeof(self.state[key]), key.startswith(AUDIO_PREFIXES)))
+        return result
+
+    def usage(self):
+        """Tổng byte của phiên và phần thuộc audio / văn bản giải phóng được"""
+        entries = self.entries()
+        return {
+            'bytes': sum(size for _, size, _ in entries),
+            'evictable_bytes': sum(size for _, size, evictable in entries if evictable),
+            'budget_bytes': self.budget_bytes,
+        }
+
+    def enforce(self):
+        """Xóa mục audio / văn bản ít dùng gần đây nhất tới khi phiên nằm trong ngân sách"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        touched = self.state[_TOUCHED]
+        present = {key for key, _, _ in entries}
+        for key in [key for key in touched if key not in present]:
+            del touched[key]
+        # Mục chưa từng touch coi như cũ nhất; mục dùng ở lần chạy trước / lần này được giữ
+        protected_from = self.run - 1
+        candidates = sorted(
+            ((touched.get(key, -1), key, size) for key, size, evictable in entries
+             if evictable and touched.get(key, -1) < protected_from),
+        )
+        freed = evicted = 0
+        for _, key, size in candidates:
+            if total - freed <= self.budget_bytes:
+                break
+            self._delete(key)
+            freed += size
+            evicted += 1
+        # Đo lại sau khi xóa: sổ _TOUCHED của các mục đã xóa cũng không còn
+        remaining = sum(size for _, size, _ in self.entries()) if evicted else total
+        self.registry.report(self.state[_SESSION_ID], remaining, evicted, freed)
+        return freed
+
+    def release(self, suffix=None):
+        """
+        Xóa hẳn audio / bộ đếm của một component ghi âm (suffix), hoặc của mọi component
+        nếu suffix=None - dùng khi làm mới biểu mẫu thay cho việc gán None.
+        """
+        for key in list(self.state.keys()):
+            if key.startswith(AUDIO_PREFIXES) and (suffix is None or audio_suffix(key) == suffix):
+                self._delete(key)
+
+    def _delete(self, key):
+        self.state[_TOUCHED].pop(key, None)
+        if key.startswith(f"{SPEECH_TEXTS}:"):
+            (self.state.get(SPEECH_TEXTS) or {}).pop(key[len(SPEECH_TEXTS) + 1:], None)
+        else:
+            self.state.pop(key, None)
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_session_budget():
+    """Ngân sách đọc một lần cho cả tiến trình"""
+    global _budget
+    if _budget is None:
+        with _budget_lock:
+            if _budget is None:
+                _budget = load_session_budget()
+    return _budget
@@ -0,0 +1,96 @@
+# spam_guard.py - Giới hạn số phản ánh / câu hỏi mỗi máy khách gửi, chặn spam trước khi ghi database
+import os
+import threading
+
+from rate_limit import SharedSlidingWindow, SlidingWindowLimiter, TieredLimiter
+
+REPORT = 'report'
+FORUM_POST = 'forum_post'
+
+# (số lượt, cửa sổ giây) mặc định cho mỗi loại bài gửi
+DEFAULT_LIMITS = {
+    REPORT: (5, 600),
+    FORUM_POST: (5, 600),
+}
+
+LIMIT_MESSAGES = {
+    REPORT: "Bạn đã gửi quá nhiều phản ánh trong thời gian ngắn",
+    FORUM_POST: "Bạn đã đăng quá nhiều câu hỏi trong thời gian ngắn",
+}
+
+
+class SpamGuardConfig:
+    """Giới hạn cho từng loại bài gửi và có dùng chung giới hạn giữa các tiến trình hay không"""
+    __slots__ = ('limits', 'shared')
+
+    def __init__(self, limits=None, shared=False):
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.shared = shared
+
+
+def load_spam_guard_config():
+    """[security] report_limit / report_window_minutes / forum_limit / forum_window_minutes / shared_rate_limit"""
+    try:
+        import streamlit as st
+
+        section = st.secrets["security"]
+        get = section.get
+        shared = bool(get("shared_rate_limit", False))
+    except Exception:
+        def get(name, default):
+            return os.environ.get(f'SPAM_{name.upper()}', default)
+        shared = os.environ.get('SPAM_SHARED_RATE_LIMIT', '0') == '1'
+
+    limits = {}
+    for kind, prefix in ((REPORT, 'report'), (FORUM_POST, 'forum')):
+        limit, window = DEFAULT_LIMITS[kind]
+        limits[kind] = (int(get(f'{prefix}_limit', limit)),
+                        float(get(f'{prefix}_window_minutes', window / 60)) * 60)
+    return SpamGuardConfig(limits, shared)
+
+
+class SpamGuard:
+    """
+    Mỗi loại bài gửi có một cửa sổ trượt theo khóa máy khách (fingerprint.client_fingerprint).
+    Tầng trong bộ nhớ chặn lũ spam gần như không tốn gì; tầng database (tùy chọn)
+    giữ giới hạn đúng khi chạy nhiều tiến trình / replica.
+    """
+
+    def __init__(self, config=None, storage=None):
+        config = config or SpamGuardConfig()
+        self.limiters = {}
+        for kind, (limit, window) in config.limits.items():
+            shared = None
+            if config.shared and storage is not None:
+                shared = SharedSlidingWindow(storage, f'submit:{kind}', limit, window)
+            self.limiters[kind] = TieredLimiter(SlidingWindowLimiter(limit, window), shared)
+
+    def check(self, kind, client_key):
+        """Ghi một lượt gửi; trả về None nếu được phép, ngược lại thông báo cho người dùng"""
+        wait = self.limiters[kind].hit(client_key)
+        if not wait:
+            return None
+        return f"{LIMIT_MESSAGES[kind]}. Vui lòng thử lại sau {int(wait // 60) + 1} phút."
+
+    def stats(self):
+        return {kind: limiter.stats() for kind, limiter in self.limiters.items()}
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def get_spam_guard():
+    """SpamGuard dùng chung cho mọi phiên trong tiến trình"""
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                config = load_spam_guard_config()
+                storage = None
+                if config.shared:
+                    from storage import get_storage
+
+                    storage = get_storage()
+                _guard = SpamGuard(config, storage)
+    return _guard
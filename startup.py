@@ -0,0 +1,160 @@
+# startup.py - Khởi động nhanh: thư viện nặng chỉ import khi dùng, tài nguyên dùng chung khởi tạo một lần
+#
+# Ứng dụng chỉ cần biết speech_recognition / pydub có cài hay không để hiển thị trạng thái,
+# nên dùng importlib.util.find_spec (không chạy module). Khởi tạo database, tài khoản
+# mặc định và outbox chạy một lần cho cả tiến trình thay vì ở mỗi lần chạy script.
+#
+# Chạy từ dòng lệnh để kiểm tra ngân sách khởi động (mã thoát 1 nếu vượt):
+#   python startup.py --import-budget 0.5 --first-paint-budget 1.5
+#
+# Khởi động = import các module của ứng dụng + import file chạy (main.py / main1.py, kéo theo
+# streamlit và phần vẽ trang đầu ở mức module) + khởi tạo database lần đầu.
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Không được import khi nạp các module của ứng dụng - chỉ nạp lúc thật sự dùng
+HEAVY_MODULES = ('pandas', 'speech_recognition', 'pydub', 'werkzeug', 'psycopg2')
+
+# Các module main.py / main1.py import ngay khi khởi động
+APP_MODULES = (
+    'timeutils', 'email_service', 'storage', 'write_queue', 'read_cache', 'forum_html', 'outbox',
+    'analytics', 'replay', 'report_browser', 'question_queue', 'geo', 'fingerprint',
+    'login_guard', 'spam_guard', 'session_memory',
+)
+
+# File chạy bằng `streamlit run` - import ở đây tức là chạy phần mức module của trang đầu
+ENTRY_POINTS = ('main', 'main1')
+
+IMPORT_BUDGET_SECONDS = 0.5
+# Import + khởi tạo database lần đầu (trước khi trang đầu tiên hiện ra)
+FIRST_PAINT_BUDGET_SECONDS = 1.5
+
+
+def module_available(name):
+    """Thư viện có cài hay không - không import (không tốn thời gian nạp module)"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+# ================ KHỞI TẠO MỘT LẦN CHO TIẾN TRÌNH ================
+_warm_lock = threading.Lock()
+_warmed = False
+timings = {}
+
+
+def warm_up(init):
+    """
+    Chạy init() một lần cho cả tiến trình (mọi phiên Streamlit dùng chung).
+    Trả về None nếu đã sẵn sàng, hoặc thông báo lỗi - lỗi thì lần chạy sau thử lại.
+    """
+    global _warmed
+    if _warmed:
+        return None
+    with _warm_lock:
+        if _warmed:
+            return None
+        started = time.perf_counter()
+        try:
+            init()
+        except Exception as e:
+            return str(e)
+        timings['warm_up_seconds'] = time.perf_counter() - started
+        _warmed = True
+    return None
+
+
+# ================ ĐO THỜI GIAN KHỞI ĐỘNG ================
+# Chạy trong tiến trình Python mới để sys.modules sạch, giống lúc container vừa khởi động.
+# Thư viện nặng mà chính streamlit đã import không tính cho ứng dụng (heavy_loaded).
+_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+imported = time.perf_counter()
+heavy_loaded = [m for m in {heavy!r} if m in sys.modules]
+if {entry_point!r}:
+    import streamlit
+    framework = [m for m in {heavy!r} if m in sys.modules]
+    __import__({entry_point!r})
+    heavy_loaded += [m for m in {heavy!r} if m in sys.modules and m not in framework + heavy_loaded]
+from storage import get_storage
+get_storage().init_schema()
+print(json.dumps({{
+    'entry_point': {entry_point!r},
+    'import_seconds': imported - started,
+    'first_paint_seconds': time.perf_counter() - started,
+    'heavy_loaded': heavy_loaded,
+}}))
+'''
+
+
+def measure_startup(modules=APP_MODULES, heavy=HEAVY_MODULES, entry_point=ENTRY_POINTS[0], db_path=None):
+    """
+    Đo thời gian import và khởi động tới trang đầu trong tiến trình mới (dùng database tạm).
+    entry_point=None chỉ đo module của ứng dụng (khi chưa cài streamlit không import được main.py).
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DB_BACKEND='sqlite', DB_PATH=db_path or os.path.join(tmp, 'startup.db'))
+        env.pop('DATABASE_URL', None)
+        probe = _PROBE.format(modules=tuple(modules), heavy=tuple(heavy), entry_point=entry_point)
+        result = subprocess.run(
+            [sys.executable, '-c', probe],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            capture_output=True, text=True, check=True,
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check_budget(measured, import_budget=IMPORT_BUDGET_SECONDS, first_paint_budget=FIRST_PAINT_BUDGET_SECONDS):
+    """Danh sách vi phạm ngân sách khởi động (rỗng = đạt)"""
+    problems = []
+    if measured['heavy_loaded']:
+        problems.append(f"Thư viện nặng bị import khi khởi động: {', '.join(measured['heavy_loaded'])}")
+    if measured['import_seconds'] > import_budget:
+        problems.append(f"Import {measured['import_seconds']:.3f}s > ngân sách {import_budget:.3f}s")
+    if measured['first_paint_seconds'] > first_paint_budget:
+        problems.append(f"Khởi động {measured['first_paint_seconds']:.3f}s > ngân sách {first_paint_budget:.3f}s")
+    return problems
+
+
+# ================ CHẠY TỪ DÒNG LỆNH ================
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra ngân sách thời gian khởi động của ứng dụng")
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_SECONDS)
+    parser.add_argument('--first-paint-budget', type=float, default=FIRST_PAINT_BUDGET_SECONDS)
+    parser.add_argument('--runs', type=int, default=3, help="Số lần đo, lấy lần nhanh nhất")
+    args = parser.parse_args()
+
+    entry_points = ENTRY_POINTS
+    if not module_available('streamlit'):
+        print("⚠️ Chưa cài streamlit - chỉ đo module của ứng dụng, không import main.py / main1.py")
+        entry_points = (None,)
+
+    problems = []
+    for entry_point in entry_points:
+        runs = [measure_startup(entry_point=entry_point) for _ in range(max(args.runs, 1))]
+        measured = min(runs, key=lambda run: run['first_paint_seconds'])
+        print(f"⏱️ {entry_point or 'module ứng dụng'}: import {measured['import_seconds'] * 1000:.0f} ms • "
+              f"khởi động: {measured['first_paint_seconds'] * 1000:.0f} ms")
+        problems += [f"{entry_point or 'module ứng dụng'}: {problem}"
+                     for problem in check_budget(measured, args.import_budget, args.first_paint_budget)]
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        sys.exit(1)
+    print("✅ Đạt ngân sách khởi động")
+
+
+if __name__ == '__main__':
+    main()
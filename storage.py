@@ -0,0 +1,1339 @@
+# storage.py - Lớp lưu trữ (repository) với backend SQLite hoặc PostgreSQL
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import archive
+import database
+from data_access import (
+    POST_COLUMNS, REPLY_COLUMNS, REPORT_DETAIL_COLUMNS, build_forum_posts, build_forum_replies,
+    build_report_detail, build_report_summaries, fetch_forum_posts, fetch_forum_replies,
+    fetch_report_detail, fetch_report_page, fetch_report_queue, fetch_unanswered_posts, report_page_query,
+    report_queue_query,
+)
+from geo import CELL_PRECISION, encode_geohash
+from rate_limit import reserve
+from timeutils import now_epoch
+
+# Xác suất một lượt ghi rate_events dọn luôn lượt hết hạn của mọi khóa (khóa bỏ đi không nằm lại mãi)
+RATE_EVENTS_PURGE_PROBABILITY = 0.01
+
+
+# ================ GIAO DIỆN CHUNG ================
+class Storage:
+    """
+    Hợp đồng lưu trữ cho phản ánh, diễn đàn và tài khoản công an.
+
+    Mọi backend trả về cùng kiểu dữ liệu: id dạng int, bài đăng/bình luận
+    dạng ForumPost/ForumReply, tài khoản dạng tuple
+    (badge_number, display_name, password_hash, role).
+    """
+
+    name = 'base'
+    # True nếu tiến trình khác (replica khác) có thể ghi vào cùng dữ liệu
+    shared = False
+
+    # Các thao tác ghi được phép gom lô qua run_batch()
+    BATCH_OPERATIONS = ('insert_report', 'submit_report', 'insert_forum_post', 'insert_forum_reply')
+
+    def init_schema(self):
+        raise NotImplementedError
+
+    def connection(self):
+        """Context manager trả về một kết nối trong một transaction"""
+        raise NotImplementedError
+
+    def run_batch(self, operations):
+        """
+        Chạy nhiều thao tác ghi [(tên, args), ...] trong MỘT transaction.
+        Trả về list kết quả cùng thứ tự; lỗi ở một thao tác làm hỏng cả lô.
+        """
+        with self.connection() as conn:
+            results = []
+            for name, args in operations:
+                if name not in self.BATCH_OPERATIONS:
+                    raise ValueError(f"Thao tác không hỗ trợ gom lô: {name}")
+                results.append(getattr(self, f'_{name}')(conn, *args))
+            return results
+
+    # ---- Phản ánh an ninh ----
+    def insert_report(self, title, description, location, incident_time, ip_hash,
+                      latitude=None, longitude=None, urgent=False, idempotency_key=None):
+        """
+        Thêm phản ánh; nếu có tọa độ thì lưu kèm geohash cho bản đồ nhiệt.
+        Trả về id mới, hoặc None nếu idempotency_key đã được dùng (không ghi gì thêm).
+        """
+        raise NotImplementedError
+
+    def _find_by_idempotency_key(self, conn, table, idempotency_key):
+        """id của dòng đã ghi với khóa idempotency này (security_reports / forum_posts)"""
+        raise NotImplementedError
+
+    def find_report_by_idempotency_key(self, idempotency_key):
+        """id phản ánh đã gửi với khóa idempotency này, None nếu là phản ánh mới"""
+        with self.connection() as conn:
+            return self._find_by_idempotency_key(conn, 'security_reports', idempotency_key)
+
+    def find_forum_post_by_idempotency_key(self, idempotency_key):
+        """id câu hỏi đã đăng với khóa idempotency này, None nếu là câu hỏi mới"""
+        with self.connection() as conn:
+            return self._find_by_idempotency_key(conn, 'forum_posts', idempotency_key)
+
+    def mark_report_email_sent(self, report_id):
+        raise NotImplementedError
+
+    def list_unsent_reports(self, start_ts, end_ts, after=(0, 0), limit=200):
+        """
+        Phản ánh email_sent = 0 với start_ts <= created_ts < end_ts, sau khóa `after` = (created_ts, id):
+        [(id, title, description, location, incident_time, is_urgent, created_ts)].
+        Bỏ qua phản ánh còn email đang chờ trong outbox (luồng nền sẽ gửi).
+        """
+        raise NotImplementedError
+
+    def mark_reports_email_sent(self, report_ids):
+        """Đánh dấu đã gửi cho cả lô phản ánh (và đóng email dead tương ứng trong outbox)"""
+        raise NotImplementedError
+
+    def list_reports(self, start_ts, end_ts, email_sent=None, keyword=None, before=None, limit=25):
+        """
+        Một trang phản ánh mới nhất trước với start_ts <= created_ts < end_ts: list[ReportSummary].
+        email_sent=True/False lọc theo trạng thái email; before = (created_ts, id) của dòng cuối trang trước.
+        """
+        raise NotImplementedError
+
+    def get_report(self, report_id):
+        """ReportDetail của một phản ánh (None nếu không có)"""
+        raise NotImplementedError
+
+    def list_report_queue(self, assigned_to=None, after=None, limit=25):
+        """
+        Phản ánh đang mở, cũ nhất trước: list[ReportSummary]. assigned_to=None = chưa ai nhận,
+        ngược lại = phản ánh cán bộ đó đang xử lý. after = (created_ts, id) của dòng cuối trang trước.
+        """
+        raise NotImplementedError
+
+    def assign_report(self, report_id, badge_number):
+        """Giao phản ánh chưa xử lý xong cho cán bộ (nhận việc / chuyển người); False nếu không còn mở"""
+        raise NotImplementedError
+
+    def resolve_report(self, report_id, badge_number):
+        """Đánh dấu đã xử lý (ghi resolved_ts, người xử lý nếu chưa có); False nếu đã xử lý trước đó"""
+        raise NotImplementedError
+
+    def submit_report(self, title, description, location, incident_time, ip_hash,
+                      latitude=None, longitude=None, urgent=False, idempotency_key=None):
+        """
+        Thêm phản ánh và email thông báo vào outbox trong CÙNG một transaction.
+        Gửi lại với cùng idempotency_key trả về id phản ánh cũ, không ghi và không gửi email lần nữa.
+        """
+        with self.connection() as conn:
+            return self._submit_report(conn, title, description, location, incident_time, ip_hash,
+                                       latitude, longitude, urgent, idempotency_key)
+
+    def _submit_report(self, conn, title, description, location, incident_time, ip_hash,
+                       latitude=None, longitude=None, urgent=False, idempotency_key=None):
+        report_id = self._insert_report(conn, title, description, location, incident_time, ip_hash,
+                                        latitude, longitude, urgent, idempotency_key)
+        if report_id is None:
+            return self._find_by_idempotency_key(conn, 'security_reports', idempotency_key)
+        payload = {
+            'report_id': report_id,
+            'title': title,
+            'description': description,
+            'location': location,
+            'incident_time': incident_time,
+            'urgent': bool(urgent),
+        }
+        self._enqueue_email(conn, report_id, json.dumps(payload, ensure_ascii=False), now_epoch(), urgent)
+        return report_id
+
+    # ---- Hàng đợi email (outbox.py) ----
+    def _enqueue_email(self, conn, report_id, payload, created_ts, urgent=False):
+        raise NotImplementedError
+
+    def claim_outbox(self, limit, lease_seconds, urgent=None):
+        """
+        Nhận tối đa `limit` email tới hạn gửi: [(id, report_id, payload, attempts, created_ts)].
+        urgent=True/False chỉ nhận email khẩn / không khẩn (None = tất cả).
+        Email được giữ trong `lease_seconds`; tiến trình chết giữa chừng thì hết hạn giữ sẽ gửi lại.
+        """
+        raise NotImplementedError
+
+    def digest_backlog(self):
+        """(số email không khẩn tới hạn, created_ts cũ nhất) - để quyết định gửi email tổng hợp"""
+        raise NotImplementedError
+
+    def complete_outbox(self, outbox_id):
+        """Đánh dấu đã gửi (và email_sent của phản ánh) trong một transaction"""
+        raise NotImplementedError
+
+    def fail_outbox(self, outbox_id, error, retry_at):
+        """Ghi lỗi; retry_at = epoch lần thử tiếp, None = chuyển sang trạng thái dead"""
+        raise NotImplementedError
+
+    def outbox_counts(self):
+        """{status: số email}"""
+        raise NotImplementedError
+
+    def reserve_rate_tokens(self, name, rate, burst, cost, max_wait):
+        """
+        Đặt trước `cost` token của bucket `name` dùng chung giữa các tiến trình.
+        Trả về số giây phải chờ, None nếu phải chờ quá max_wait (không trừ token).
+        """
+        raise NotImplementedError
+
+    def hit_rate_window(self, name, key, limit, window_seconds):
+        """
+        Ghi một lượt của `key` vào cửa sổ trượt `name` dùng chung giữa các tiến trình.
+        Trả về 0 nếu được phép, ngược lại số giây phải chờ (không ghi lượt).
+        """
+        raise NotImplementedError
+
+    # ---- Diễn đàn ----
+    def insert_forum_post(self, title, content, category, anonymous_id, idempotency_key=None):
+        """Thêm câu hỏi; cùng idempotency_key thì trả về id câu hỏi đã đăng"""
+        raise NotImplementedError
+
+    def insert_forum_reply(self, post_id, content, author_type, author_id, display_name, is_official):
+        """Thêm bình luận; bình luận chính thức đánh dấu câu hỏi là đã trả lời"""
+        raise NotImplementedError
+
+    def list_forum_posts(self, category=None, limit=50):
+        raise NotImplementedError
+
+    def list_unanswered_posts(self, after=None, limit=25):
+        """
+        Câu hỏi chưa có phản hồi chính thức, cũ nhất trước: list[ForumPost].
+        after = (created_ts, id) của dòng cuối trang trước.
+        """
+        raise NotImplementedError
+
+    def list_forum_replies(self, post_id):
+        raise NotImplementedError
+
+    def quick_stats(self, today):
+        """{'total_reports', 'total_posts', 'today_reports'} từ bảng bộ đếm"""
+        raise NotImplementedError
+
+    # ---- Thống kê tổng hợp (analytics.py) ----
+    def analytics_daily(self, start_day, end_day):
+        """[(metric, day, count, total_seconds)] với start_day <= day <= end_day"""
+        raise NotImplementedError
+
+    def analytics_hourly(self, start_ts, end_ts):
+        """[(metric, hour_ts, count, total_seconds)] với start_ts <= hour_ts < end_ts"""
+        raise NotImplementedError
+
+    def analytics_totals(self):
+        """{metric: (count, total_seconds)} cộng dồn từ trước tới nay"""
+        raise NotImplementedError
+
+    def report_cell_counts(self, start_day, end_day):
+        """[(cell, count)] số phản ánh mỗi ô lưới geohash trong khoảng ngày"""
+        raise NotImplementedError
+
+    def rebuild_rollups(self):
+        """
+        Tính lại bộ đếm, reply_count, bảng tổng hợp và report_cells từ dữ liệu gốc, kể cả dòng
+        đã lưu trữ (khôi phục sau khi sửa dữ liệu tay; init_schema tự chạy khi bảng tổng hợp vừa được tạo)
+        """
+        raise NotImplementedError
+
+    # ---- Tài khoản công an ----
+    def get_police_user(self, badge_number):
+        raise NotImplementedError
+
+    def create_police_user(self, badge_number, display_name, password_hash, role='officer'):
+        raise NotImplementedError
+
+
+def _geohash(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return encode_geohash(latitude, longitude)
+
+
+# ================ BACKEND SQLITE ================
+class SQLiteStorage(Storage):
+    """Một file SQLite - phù hợp chạy một container"""
+
+    name = 'sqlite'
+
+    def __init__(self, db_path=None, archive_dir=None):
+        self.db_path = db_path or database.DB_PATH
+        self.archive_dir = archive_dir or archive.ARCHIVE_DIR
+
+    @contextmanager
+    def connection(self):
+        """Kết nối ngắn hạn: commit khi thành công, rollback khi lỗi"""
+        conn = database.get_connection(self.db_path)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def init_schema(self):
+        with self.connection() as conn:
+            database.init_schema(conn)
+
+    def rebuild_rollups(self):
+        # Dòng đã chuyển sang file tháng vẫn là lịch sử: cộng cả phần tính từ các file lưu trữ
+        archived = archive.archived_rollup_rows(self.db_path, self.archive_dir)
+        with self.connection() as conn:
+            database.rebuild_counters(conn, archived['counters'])
+            database.rebuild_analytics(conn, (archived['hourly'], archived['daily']))
+            database.rebuild_report_cells(conn, archived['cells'])
+
+    def insert_report(self, title, description, location, incident_time, ip_hash,
+                      latitude=None, longitude=None, urgent=False, idempotency_key=None):
+        with self.connection() as conn:
+            return self._insert_report(conn, title, description, location, incident_time, ip_hash,
+                                       latitude, longitude, urgent, idempotency_key)
+
+    def _insert_report(self, conn, title, description, location, incident_time, ip_hash,
+                       latitude=None, longitude=None, urgent=False, idempotency_key=None):
+        cur = conn.execute('''
+            INSERT INTO security_reports (title, description, location, incident_time, ip_hash, created_ts,
+                                          latitude, longitude, geohash, is_urgent, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+        ''', (title, description, location, incident_time, ip_hash, now_epoch(),
+              latitude, longitude, _geohash(latitude, longitude), int(urgent), idempotency_key))
+        return cur.lastrowid if cur.rowcount else None
+
+    def _find_by_idempotency_key(self, conn, table, idempotency_key):
+        row = conn.execute(f'SELECT id FROM {table} WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+        return row[0] if row else None
+
+    def mark_report_email_sent(self, report_id):
+        with self.connection() as conn:
+            conn.execute('UPDATE security_reports SET email_sent = 1 WHERE id = ?', (report_id,))
+
+    def list_unsent_reports(self, start_ts, end_ts, after=(0, 0), limit=200):
+        with self.connection() as conn:
+            # Đọc theo idx_reports_unsent (chỉ chứa dòng email_sent = 0), phân trang theo khóa
+            return conn.execute('''
+                SELECT id, title, description, location, incident_time, is_urgent, created_ts
+                FROM security_reports
+                WHERE email_sent = 0 AND created_ts >= ? AND created_ts < ? AND (created_ts, id) > (?, ?)
+                  AND id NOT IN (SELECT report_id FROM email_outbox
+                                 WHERE status IN (?, ?) AND report_id IS NOT NULL)
+                ORDER BY created_ts, id
+                LIMIT ?
+            ''', (start_ts, end_ts, after[0], after[1],
+                  database.OUTBOX_PENDING, database.OUTBOX_SENDING, limit)).fetchall()
+
+    def list_reports(self, start_ts, end_ts, email_sent=None, keyword=None, before=None, limit=25):
+        with self.connection() as conn:
+            return fetch_report_page(conn, start_ts, end_ts, email_sent, keyword, before, limit)
+
+    def get_report(self, report_id):
+        with self.connection() as conn:
+            return fetch_report_detail(conn, report_id)
+
+    def list_report_queue(self, assigned_to=None, after=None, limit=25):
+        with self.connection() as conn:
+            return fetch_report_queue(conn, assigned_to, after, limit)
+
+    def assign_report(self, report_id, badge_number):
+        with self.connection() as conn:
+            cur = conn.execute('''
+                UPDATE security_reports SET status = ?, assigned_to = ?, assigned_ts = ?
+                WHERE id = ? AND status <> ?
+            ''', (database.REPORT_ASSIGNED, badge_number, now_epoch(), report_id, database.REPORT_RESOLVED))
+            return cur.rowcount > 0
+
+    def resolve_report(self, report_id, badge_number):
+        with self.connection() as conn:
+            # trg_analytics_resolved cộng thời gian xử lý vào bảng tổng hợp
+            cur = conn.execute('''
+                UPDATE security_reports
+                SET status = ?, resolved_ts = ?, assigned_to = COALESCE(assigned_to, ?)
+                WHERE id = ? AND status <> ?
+            ''', (database.REPORT_RESOLVED, now_epoch(), badge_number, report_id, database.REPORT_RESOLVED))
+            return cur.rowcount > 0
+
+    def mark_reports_email_sent(self, report_ids):
+        rows = [(report_id,) for report_id in report_ids]
+        with self.connection() as conn:
+            conn.executemany('UPDATE security_reports SET email_sent = 1 WHERE id = ?', rows)
+            conn.executemany(
+                'UPDATE email_outbox SET status = ?, sent_ts = ?, last_error = NULL WHERE report_id = ? AND status = ?',
+                [(database.OUTBOX_SENT, now_epoch(), report_id, database.OUTBOX_DEAD) for report_id in report_ids]
+            )
+
+    def _enqueue_email(self, conn, report_id, payload, created_ts, urgent=False):
+        conn.execute('''
+            INSERT INTO email_outbox (report_id, payload, urgent, status, next_attempt_ts, created_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (report_id, payload, int(urgent), database.OUTBOX_PENDING, created_ts, created_ts))
+
+    def claim_outbox(self, limit, lease_seconds, urgent=None):
+        now = now_epoch()
+        urgent_filter = '' if urgent is None else f'AND urgent = {int(urgent)}'
+        with self.connection() as conn:
+            # Giữ khóa ghi ngay từ đầu để hai luồng không nhận trùng một email
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(f'''
+                SELECT id, report_id, payload, attempts, created_ts FROM email_outbox
+                WHERE status IN (?, ?) AND next_attempt_ts <= ? {urgent_filter}
+                ORDER BY next_attempt_ts
+                LIMIT ?
+            ''', (database.OUTBOX_PENDING, database.OUTBOX_SENDING, now, limit)).fetchall()
+            conn.executemany(
+                'UPDATE email_outbox SET status = ?, next_attempt_ts = ? WHERE id = ?',
+                [(database.OUTBOX_SENDING, now + lease_seconds, row[0]) for row in rows]
+            )
+            return rows
+
+    def complete_outbox(self, outbox_id):
+        with self.connection() as conn:
+            conn.execute('''
+                UPDATE email_outbox SET status = ?, sent_ts = ?, last_error = NULL WHERE id = ?
+            ''', (database.OUTBOX_SENT, now_epoch(), outbox_id))
+            conn.execute('''
+                UPDATE security_reports SET email_sent = 1
+                WHERE id = (SELECT report_id FROM email_outbox WHERE id = ?)
+            ''', (outbox_id,))
+
+    def fail_outbox(self, outbox_id, error, retry_at):
+        status = database.OUTBOX_DEAD if retry_at is None else database.OUTBOX_PENDING
+        with self.connection() as conn:
+            conn.execute('''
+                UPDATE email_outbox
+                SET status = ?, attempts = attempts + 1, next_attempt_ts = COALESCE(?, next_attempt_ts),
+                    last_error = ?
+                WHERE id = ?
+            ''', (status, retry_at, error, outbox_id))
+
+    def digest_backlog(self):
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT COUNT(*), MIN(created_ts) FROM email_outbox
+                WHERE status IN (?, ?) AND next_attempt_ts <= ? AND urgent = 0
+            ''', (database.OUTBOX_PENDING, database.OUTBOX_SENDING, now_epoch())).fetchone()
+
+    def outbox_counts(self):
+        with self.connection() as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM email_outbox GROUP BY status').fetchall())
+
+    def reserve_rate_tokens(self, name, rate, burst, cost, max_wait):
+        now = time.time()
+        with self.connection() as conn:
+            # Khóa ghi ngay từ đầu: đọc - tính - ghi của các tiến trình không xen nhau
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE name = ?', (name,)).fetchone()
+            tokens, updated = row if row else (float(burst), now)
+            tokens, wait = reserve(tokens, updated, now, rate, burst, cost, max_wait)
+            conn.execute('''
+                INSERT INTO rate_buckets (name, tokens, updated) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated
+            ''', (name, tokens, now))
+            return wait
+
+    def hit_rate_window(self, name, key, limit, window_seconds):
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Thỉnh thoảng dọn lượt cũ của mọi khóa; lượt cũ của khóa này thì dọn mỗi lần
+            if random.random() < RATE_EVENTS_PURGE_PROBABILITY:
+                conn.execute('DELETE FROM rate_events WHERE name = ? AND ts <= ?', (name, now - window_seconds))
+            else:
+                conn.execute('DELETE FROM rate_events WHERE name = ? AND key = ? AND ts <= ?',
+                             (name, key, now - window_seconds))
+            count, oldest = conn.execute(
+                'SELECT COUNT(*), MIN(ts) FROM rate_events WHERE name = ? AND key = ?', (name, key)
+            ).fetchone()
+            if count >= limit:
+                return oldest + window_seconds - now
+            conn.execute('INSERT INTO rate_events (name, key, ts) VALUES (?, ?, ?)', (name, key, now))
+            return 0
+
+    def insert_forum_post(self, title, content, category, anonymous_id, idempotency_key=None):
+        with self.connection() as conn:
+            return self._insert_forum_post(conn, title, content, category, anonymous_id, idempotency_key)
+
+    def _insert_forum_post(self, conn, title, content, category, anonymous_id, idempotency_key=None):
+        cur = conn.execute('''
+            INSERT INTO forum_posts (title, content, category, anonymous_id, created_ts, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+        ''', (title, content, category, anonymous_id, now_epoch(), idempotency_key))
+        if cur.rowcount:
+            return cur.lastrowid
+        return self._find_by_idempotency_key(conn, 'forum_posts', idempotency_key)
+
+    def insert_forum_reply(self, post_id, content, author_type, author_id, display_name, is_official):
+        with self.connection() as conn:
+            return self._insert_forum_reply(conn, post_id, content, author_type, author_id,
+                                            display_name, is_official)
+
+    def _insert_forum_reply(self, conn, post_id, content, author_type, author_id, display_name, is_official):
+        cur = conn.execute('''
+            INSERT INTO forum_replies (post_id, content, author_type, author_id, display_name, is_official, created_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (post_id, content, author_type, author_id, display_name, int(is_official), now_epoch()))
+        reply_id = cur.lastrowid
+        # reply_count do trigger trg_post_reply_count_ins cập nhật
+        if is_official:
+            conn.execute('UPDATE forum_posts SET is_answered = 1 WHERE id = ?', (post_id,))
+        return reply_id
+
+    def list_forum_posts(self, category=None, limit=50):
+        with self.connection() as conn:
+            return fetch_forum_posts(conn, category, limit)
+
+    def list_unanswered_posts(self, after=None, limit=25):
+        with self.connection() as conn:
+            return fetch_unanswered_posts(conn, after, limit)
+
+    def list_forum_replies(self, post_id):
+        with self.connection() as conn:
+            return fetch_forum_replies(conn, post_id)
+
+    def quick_stats(self, today):
+        with self.connection() as conn:
+            return database.get_quick_stats(conn, today)
+
+    def analytics_daily(self, start_day, end_day):
+        with self.connection() as conn:
+            return database.get_analytics_daily(conn, start_day, end_day)
+
+    def analytics_hourly(self, start_ts, end_ts):
+        with self.connection() as conn:
+            return database.get_analytics_hourly(conn, start_ts, end_ts)
+
+    def analytics_totals(self):
+        with self.connection() as conn:
+            return database.get_analytics_totals(conn)
+
+    def report_cell_counts(self, start_day, end_day):
+        with self.connection() as conn:
+            return database.get_report_cell_counts(conn, start_day, end_day)
+
+    def get_police_user(self, badge_number):
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT badge_number, display_name, password_hash, role
+                FROM police_users
+                WHERE badge_number = ?
+            ''', (badge_number,)).fetchone()
+
+    def create_police_user(self, badge_number, display_name, password_hash, role='officer'):
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO police_users (badge_number, display_name, password_hash, role)
+                VALUES (?, ?, ?, ?)
+            ''', (badge_number, display_name, password_hash, role))
+
+
+# ================ BACKEND POSTGRESQL ================
+PG_EPOCH_NOW = "(EXTRACT(EPOCH FROM now())::BIGINT)"
+
+PG_SCHEMA = [
+    f'''
+    CREATE TABLE IF NOT EXISTS security_reports (
+        id BIGSERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        location TEXT,
+        incident_time TEXT,
+        created_at TIMESTAMPTZ DEFAULT now(),
+        created_ts BIGINT NOT NULL DEFAULT {PG_EPOCH_NOW},
+        ip_hash TEXT,
+        email_sent BOOLEAN NOT NULL DEFAULT FALSE,
+        latitude DOUBLE PRECISION,
+        longitude DOUBLE PRECISION,
+        geohash TEXT,
+        is_urgent BOOLEAN NOT NULL DEFAULT FALSE,
+        idempotency_key TEXT,
+        status TEXT NOT NULL DEFAULT 'received',
+        assigned_to TEXT,
+        assigned_ts BIGINT,
+        resolved_ts BIGINT
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS forum_posts (
+        id BIGSERIAL PRIMARY KEY,
+        title TEXT DEFAULT 'Câu hỏi từ người dân',
+        content TEXT NOT NULL,
+        category TEXT DEFAULT 'Hỏi đáp pháp luật',
+        anonymous_id TEXT NOT NULL,
+        created_at TIMESTAMPTZ DEFAULT now(),
+        created_ts BIGINT NOT NULL DEFAULT {PG_EPOCH_NOW},
+        reply_count INTEGER NOT NULL DEFAULT 0,
+        is_answered BOOLEAN NOT NULL DEFAULT FALSE,
+        first_answer_ts BIGINT,
+        idempotency_key TEXT
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS forum_replies (
+        id BIGSERIAL PRIMARY KEY,
+        post_id BIGINT REFERENCES forum_posts(id),
+        content TEXT NOT NULL,
+        author_type TEXT DEFAULT 'anonymous',
+        author_id TEXT,
+        display_name TEXT,
+        created_at TIMESTAMPTZ DEFAULT now(),
+        created_ts BIGINT NOT NULL DEFAULT {PG_EPOCH_NOW},
+        is_official BOOLEAN NOT NULL DEFAULT FALSE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS police_users (
+        id BIGSERIAL PRIMARY KEY,
+        badge_number TEXT UNIQUE NOT NULL,
+        display_name TEXT NOT NULL,
+        password_hash TEXT NOT NULL,
+        role TEXT DEFAULT 'officer'
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_counters (
+        name TEXT NOT NULL,
+        bucket TEXT NOT NULL DEFAULT '',
+        value BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (name, bucket)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS analytics_hourly (
+        metric TEXT NOT NULL,
+        hour_ts BIGINT NOT NULL,
+        count BIGINT NOT NULL DEFAULT 0,
+        total_seconds BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour_ts, metric)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS analytics_daily (
+        metric TEXT NOT NULL,
+        day TEXT NOT NULL,
+        count BIGINT NOT NULL DEFAULT 0,
+        total_seconds BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, metric)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS report_cells (
+        day TEXT NOT NULL,
+        cell TEXT NOT NULL,
+        count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, cell)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        report_id BIGINT,
+        payload TEXT NOT NULL,
+        urgent BOOLEAN NOT NULL DEFAULT FALSE,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_ts BIGINT NOT NULL,
+        last_error TEXT,
+        created_ts BIGINT NOT NULL,
+        sent_ts BIGINT
+    )
+    ''',
+    '''CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(next_attempt_ts)
+       WHERE status IN ('pending', 'sending')''',
+    'CREATE INDEX IF NOT EXISTS idx_reports_unsent ON security_reports(created_ts, id) WHERE NOT email_sent',
+    "CREATE INDEX IF NOT EXISTS idx_email_outbox_dead ON email_outbox(report_id) WHERE status = 'dead'",
+    '''
+    CREATE TABLE IF NOT EXISTS rate_buckets (
+        name TEXT PRIMARY KEY,
+        tokens DOUBLE PRECISION NOT NULL,
+        updated DOUBLE PRECISION NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS rate_events (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        ts DOUBLE PRECISION NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_rate_events_key ON rate_events(name, key, ts)',
+    'ALTER TABLE forum_posts ADD COLUMN IF NOT EXISTS first_answer_ts BIGINT',
+    'ALTER TABLE security_reports ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION',
+    'ALTER TABLE security_reports ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION',
+    'ALTER TABLE security_reports ADD COLUMN IF NOT EXISTS geohash TEXT',
+    'ALTER TABLE security_reports ADD COLUMN IF NOT EXISTS is_urgent BOOLEAN NOT NULL DEFAULT FALSE',
+    'ALTER TABLE email_outbox ADD COLUMN IF NOT EXISTS urgent BOOLEAN NOT NULL DEFAULT FALSE',
+    'ALTER TABLE security_reports ADD COLUMN IF NOT EXISTS idempotency_key TEXT',
+    'ALTER TABLE forum_posts ADD COLUMN IF NOT EXISTS idempotency_key TEXT',
+    '''CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_idempotency ON security_reports(idempotency_key)
+       WHERE idempotency_key IS NOT NULL''',
+    '''CREATE UNIQUE INDEX IF NOT EXISTS idx_forum_posts_idempotency ON forum_posts(idempotency_key)
+       WHERE idempotency_key IS NOT NULL''',
+    "ALTER TABLE security_reports ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'received'",
+    'ALTER TABLE security_reports ADD COLUMN IF NOT EXISTS assigned_to TEXT',
+    'ALTER TABLE security_reports ADD COLUMN IF NOT EXISTS assigned_ts BIGINT',
+    'ALTER TABLE security_reports ADD COLUMN IF NOT EXISTS resolved_ts BIGINT',
+    f"CREATE INDEX IF NOT EXISTS idx_reports_unassigned ON security_reports(created_ts, id) "
+    f"WHERE status = '{database.REPORT_RECEIVED}'",
+    f"CREATE INDEX IF NOT EXISTS idx_reports_assignee_open ON security_reports(assigned_to, created_ts, id) "
+    f"WHERE status = '{database.REPORT_ASSIGNED}'",
+    'CREATE INDEX IF NOT EXISTS idx_forum_posts_unanswered ON forum_posts(created_ts, id) WHERE NOT is_answered',
+    'CREATE INDEX IF NOT EXISTS idx_reports_geohash ON security_reports(geohash) WHERE geohash IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS idx_forum_replies_post_ts ON forum_replies(post_id, created_ts)',
+    'CREATE INDEX IF NOT EXISTS idx_reports_created_ts ON security_reports(created_ts)',
+    'CREATE INDEX IF NOT EXISTS idx_forum_posts_created_ts ON forum_posts(created_ts)',
+    'CREATE INDEX IF NOT EXISTS idx_forum_posts_category_ts ON forum_posts(category, created_ts)',
+    # Bộ đếm tổng + theo ngày giờ Việt Nam, giống trigger bên SQLite
+    '''
+    CREATE OR REPLACE FUNCTION bump_stats_counter() RETURNS trigger AS $$
+    DECLARE
+        delta INTEGER;
+        ts BIGINT;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            delta := 1;
+            ts := NEW.created_ts;
+        ELSE
+            delta := -1;
+            ts := OLD.created_ts;
+        END IF;
+        INSERT INTO stats_counters (name, bucket, value)
+        VALUES (TG_ARGV[0], '', delta),
+               (TG_ARGV[0], to_char(to_timestamp(ts) AT TIME ZONE 'Asia/Ho_Chi_Minh', 'YYYY-MM-DD'), delta)
+        ON CONFLICT (name, bucket) DO UPDATE SET value = stats_counters.value + EXCLUDED.value;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    '''
+    CREATE OR REPLACE FUNCTION bump_post_reply_count() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE forum_posts SET reply_count = reply_count + 1 WHERE id = NEW.post_id;
+        ELSE
+            UPDATE forum_posts SET reply_count = GREATEST(reply_count - 1, 0) WHERE id = OLD.post_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    # Bảng tổng hợp theo giờ / ngày giờ Việt Nam, giống trigger trg_analytics_* bên SQLite
+    '''
+    CREATE OR REPLACE FUNCTION bump_analytics(p_metric TEXT, ts BIGINT, seconds BIGINT) RETURNS void AS $$
+    BEGIN
+        INSERT INTO analytics_hourly (metric, hour_ts, count, total_seconds)
+        VALUES (p_metric, (ts / 3600) * 3600, 1, seconds)
+        ON CONFLICT (metric, hour_ts) DO UPDATE SET
+            count = analytics_hourly.count + 1,
+            total_seconds = analytics_hourly.total_seconds + EXCLUDED.total_seconds;
+        INSERT INTO analytics_daily (metric, day, count, total_seconds)
+        VALUES (p_metric, to_char(to_timestamp(ts) AT TIME ZONE 'Asia/Ho_Chi_Minh', 'YYYY-MM-DD'), 1, seconds)
+        ON CONFLICT (metric, day) DO UPDATE SET
+            count = analytics_daily.count + 1,
+            total_seconds = analytics_daily.total_seconds + EXCLUDED.total_seconds;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    f'''
+    CREATE OR REPLACE FUNCTION rollup_created_row() RETURNS trigger AS $$
+    BEGIN
+        PERFORM bump_analytics(TG_ARGV[0], COALESCE(NEW.created_ts, {PG_EPOCH_NOW}), 0);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    f'''
+    CREATE OR REPLACE FUNCTION rollup_first_answer() RETURNS trigger AS $$
+    DECLARE
+        ts BIGINT;
+        asked_ts BIGINT;
+    BEGIN
+        IF NOT NEW.is_official THEN
+            RETURN NULL;
+        END IF;
+        ts := COALESCE(NEW.created_ts, {PG_EPOCH_NOW});
+        -- Chỉ phản hồi chính thức đầu tiên của câu hỏi được tính
+        UPDATE forum_posts SET first_answer_ts = ts
+        WHERE id = NEW.post_id AND first_answer_ts IS NULL
+        RETURNING created_ts INTO asked_ts;
+        IF FOUND THEN
+            PERFORM bump_analytics('answered', ts, GREATEST(ts - COALESCE(asked_ts, ts), 0));
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    f'''
+    CREATE OR REPLACE FUNCTION rollup_resolved_report() RETURNS trigger AS $$
+    DECLARE
+        ts BIGINT;
+    BEGIN
+        IF NEW.status <> '{database.REPORT_RESOLVED}' OR OLD.status = '{database.REPORT_RESOLVED}' THEN
+            RETURN NULL;
+        END IF;
+        ts := COALESCE(NEW.resolved_ts, {PG_EPOCH_NOW});
+        PERFORM bump_analytics('resolved', ts, GREATEST(ts - COALESCE(NEW.created_ts, ts), 0));
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    f'''
+    CREATE OR REPLACE FUNCTION rollup_report_cell() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.geohash IS NULL THEN
+            RETURN NULL;
+        END IF;
+        INSERT INTO report_cells (day, cell, count)
+        VALUES (
+            to_char(to_timestamp(COALESCE(NEW.created_ts, {PG_EPOCH_NOW})) AT TIME ZONE 'Asia/Ho_Chi_Minh', 'YYYY-MM-DD'),
+            left(NEW.geohash, {CELL_PRECISION}),
+            1
+        )
+        ON CONFLICT (day, cell) DO UPDATE SET count = report_cells.count + 1;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+]
+
+# (tên trigger, bảng, hàm, tham số, sự kiện)
+PG_TRIGGERS = [
+    ('trg_reports_count', 'security_reports', 'bump_stats_counter', "'reports'", 'INSERT OR DELETE'),
+    ('trg_posts_count', 'forum_posts', 'bump_stats_counter', "'posts'", 'INSERT OR DELETE'),
+    ('trg_replies_count', 'forum_replies', 'bump_stats_counter', "'replies'", 'INSERT OR DELETE'),
+    ('trg_post_reply_count', 'forum_replies', 'bump_post_reply_count', '', 'INSERT OR DELETE'),
+    ('trg_analytics_reports', 'security_reports', 'rollup_created_row', "'reports'", 'INSERT'),
+    ('trg_analytics_questions', 'forum_posts', 'rollup_created_row', "'questions'", 'INSERT'),
+    ('trg_analytics_first_answer', 'forum_replies', 'rollup_first_answer', '', 'INSERT'),
+    ('trg_analytics_resolved', 'security_reports', 'rollup_resolved_report', '', 'UPDATE OF status'),
+    ('trg_report_cells', 'security_reports', 'rollup_report_cell', '', 'INSERT'),
+]
+
+# Khóa advisory để nhiều replica khởi động cùng lúc không tạo lược đồ chồng chéo
+PG_SCHEMA_LOCK_ID = 720_260_001
+
+# ---- Tính lại bảng tổng hợp từ dữ liệu gốc, giống database.rebuild_* bên SQLite ----
+PG_DAY_EXPR = "to_char(to_timestamp({ts}) AT TIME ZONE 'Asia/Ho_Chi_Minh', 'YYYY-MM-DD')"
+
+# Bảng tổng hợp -> bước tính lại khi init_schema vừa tạo bảng đó (database cũ trước khi có rollup)
+PG_ROLLUP_TABLES = (
+    ('stats_counters', '_rebuild_counters'),
+    ('analytics_daily', '_rebuild_analytics'),
+    ('report_cells', '_rebuild_report_cells'),
+)
+
+PG_ANALYTICS_SOURCES = [
+    ('reports', 'SELECT created_ts AS ts, 0 AS seconds FROM security_reports WHERE created_ts IS NOT NULL'),
+    ('questions', 'SELECT created_ts AS ts, 0 AS seconds FROM forum_posts WHERE created_ts IS NOT NULL'),
+    ('answered', '''SELECT first_answer_ts AS ts, GREATEST(first_answer_ts - created_ts, 0) AS seconds
+                    FROM forum_posts WHERE first_answer_ts IS NOT NULL'''),
+    ('resolved', f'''SELECT resolved_ts AS ts, GREATEST(resolved_ts - created_ts, 0) AS seconds
+                     FROM security_reports
+                     WHERE status = '{database.REPORT_RESOLVED}' AND resolved_ts IS NOT NULL
+                       AND assigned_to IS NOT NULL'''),
+]
+
+
+class PostgresStorage(Storage):
+    """PostgreSQL với pool kết nối - cho phép chạy nhiều replica sau load balancer"""
+
+    name = 'postgres'
+    shared = True
+
+    def __init__(self, dsn, min_connections=1, max_connections=10):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self.dsn = dsn
+        self.pool = ThreadedConnectionPool(min_connections, max_connections, dsn)
+
+    @contextmanager
+    def connection(self):
+        """Mượn kết nối từ pool: commit khi thành công, rollback khi lỗi"""
+        conn = self.pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def close(self):
+        self.pool.closeall()
+
+    def _fetchone(self, sql, params=()):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchone()
+
+    def _fetchall(self, sql, params=()):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+    def init_schema(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (PG_SCHEMA_LOCK_ID,))
+            missing = []
+            for table, step in PG_ROLLUP_TABLES:
+                cur.execute('SELECT to_regclass(%s) IS NULL', (table,))
+                if cur.fetchone()[0]:
+                    missing.append(step)
+            cur.execute('''
+                SELECT to_regclass('security_reports') IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = current_schema() AND table_name = 'security_reports'
+                      AND column_name = 'status')
+            ''')
+            legacy_reports = cur.fetchone()[0]
+            for ddl in PG_SCHEMA:
+                cur.execute(ddl)
+            # Cột status vừa được thêm: phản ánh cũ coi như đã xử lý (như COLUMN_MIGRATIONS bên SQLite)
+            if legacy_reports:
+                cur.execute(database.LEGACY_REPORTS_RESOLVED)
+            for name, table, function, args, events in PG_TRIGGERS:
+                cur.execute(f'DROP TRIGGER IF EXISTS {name} ON {table}')
+                cur.execute(f'''
+                    CREATE TRIGGER {name} AFTER {events} ON {table}
+                    FOR EACH ROW EXECUTE FUNCTION {function}({args})
+                ''')
+            # Database có trước bảng tổng hợp: đếm lại một lần từ dữ liệu gốc
+            if missing:
+                self._lock_sources(cur)
+                for step in missing:
+                    getattr(self, step)(cur)
+
+    def rebuild_rollups(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            self._lock_sources(cur)
+            self._rebuild_counters(cur)
+            self._rebuild_analytics(cur)
+            self._rebuild_report_cells(cur)
+
+    def _lock_sources(self, cur):
+        # Chặn ghi (trigger cộng dồn) tới hết transaction, để số đếm lại không lệch với lượt ghi chen giữa
+        cur.execute('LOCK TABLE security_reports, forum_posts, forum_replies IN SHARE MODE')
+
+    def _rebuild_counters(self, cur):
+        cur.execute('DELETE FROM stats_counters')
+        for counter, table in (('reports', 'security_reports'),
+                               ('posts', 'forum_posts'),
+                               ('replies', 'forum_replies')):
+            cur.execute(f"INSERT INTO stats_counters (name, bucket, value) SELECT %s, '', COUNT(*) FROM {table}",
+                        (counter,))
+            cur.execute(f'''
+                INSERT INTO stats_counters (name, bucket, value)
+                SELECT %s, {PG_DAY_EXPR.format(ts='created_ts')}, COUNT(*)
+                FROM {table}
+                WHERE created_ts IS NOT NULL
+                GROUP BY 2
+            ''', (counter,))
+        cur.execute('''
+            UPDATE forum_posts SET reply_count = (
+                SELECT COUNT(*) FROM forum_replies WHERE forum_replies.post_id = forum_posts.id
+            )
+        ''')
+
+    def _rebuild_analytics(self, cur):
+        # Cột first_answer_ts thêm sau: điền cho câu hỏi đã được trả lời trước đó
+        cur.execute('''
+            UPDATE forum_posts SET first_answer_ts = answered.ts
+            FROM (SELECT post_id, MIN(created_ts) AS ts FROM forum_replies
+                  WHERE is_official GROUP BY post_id) AS answered
+            WHERE forum_posts.id = answered.post_id AND forum_posts.first_answer_ts IS NULL
+        ''')
+        cur.execute('DELETE FROM analytics_hourly')
+        cur.execute('DELETE FROM analytics_daily')
+        for metric, source in PG_ANALYTICS_SOURCES:
+            cur.execute(f'''
+                INSERT INTO analytics_hourly (metric, hour_ts, count, total_seconds)
+                SELECT %s, (ts / 3600) * 3600, COUNT(*), SUM(seconds)
+                FROM ({source}) AS src
+                GROUP BY 2
+            ''', (metric,))
+            cur.execute(f'''
+                INSERT INTO analytics_daily (metric, day, count, total_seconds)
+                SELECT %s, {PG_DAY_EXPR.format(ts='ts')}, COUNT(*), SUM(seconds)
+                FROM ({source}) AS src
+                GROUP BY 2
+            ''', (metric,))
+
+    def _rebuild_report_cells(self, cur):
+        cur.execute('DELETE FROM report_cells')
+        cur.execute(f'''
+            INSERT INTO report_cells (day, cell, count)
+            SELECT {PG_DAY_EXPR.format(ts='created_ts')}, left(geohash, {CELL_PRECISION}), COUNT(*)
+            FROM security_reports
+            WHERE geohash IS NOT NULL AND created_ts IS NOT NULL
+            GROUP BY 1, 2
+        ''')
+
+    def insert_report(self, title, description, location, incident_time, ip_hash,
+                      latitude=None, longitude=None, urgent=False, idempotency_key=None):
+        with self.connection() as conn:
+            return self._insert_report(conn, title, description, location, incident_time, ip_hash,
+                                       latitude, longitude, urgent, idempotency_key)
+
+    def _insert_report(self, conn, title, description, location, incident_time, ip_hash,
+                       latitude=None, longitude=None, urgent=False, idempotency_key=None):
+        with conn.cursor() as cur:
+            cur.execute('''
+                INSERT INTO security_reports (title, description, location, incident_time, ip_hash, created_ts,
+                                              latitude, longitude, geohash, is_urgent, idempotency_key)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+                RETURNING id
+            ''', (title, description, location, incident_time, ip_hash, now_epoch(),
+                  latitude, longitude, _geohash(latitude, longitude), bool(urgent), idempotency_key))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def _find_by_idempotency_key(self, conn, table, idempotency_key):
+        with conn.cursor() as cur:
+            cur.execute(f'SELECT id FROM {table} WHERE idempotency_key = %s', (idempotency_key,))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def mark_report_email_sent(self, report_id):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('UPDATE security_reports SET email_sent = TRUE WHERE id = %s', (report_id,))
+
+    def list_unsent_reports(self, start_ts, end_ts, after=(0, 0), limit=200):
+        return self._fetchall('''
+            SELECT id, title, description, location, incident_time, is_urgent, created_ts
+            FROM security_reports
+            WHERE NOT email_sent AND created_ts >= %s AND created_ts < %s AND (created_ts, id) > (%s, %s)
+              AND id NOT IN (SELECT report_id FROM email_outbox
+                             WHERE status IN (%s, %s) AND report_id IS NOT NULL)
+            ORDER BY created_ts, id
+            LIMIT %s
+        ''', (start_ts, end_ts, after[0], after[1],
+              database.OUTBOX_PENDING, database.OUTBOX_SENDING, limit))
+
+    def list_reports(self, start_ts, end_ts, email_sent=None, keyword=None, before=None, limit=25):
+        sql, params = report_page_query(self.name, start_ts, end_ts, email_sent, keyword, before, limit)
+        return build_report_summaries(self._fetchall(sql, params))
+
+    def get_report(self, report_id):
+        return build_report_detail(self._fetchone(
+            f'SELECT {REPORT_DETAIL_COLUMNS} FROM security_reports WHERE id = %s', (report_id,)
+        ))
+
+    def list_report_queue(self, assigned_to=None, after=None, limit=25):
+        sql, params = report_queue_query(self.name, assigned_to, after, limit)
+        return build_report_summaries(self._fetchall(sql, params))
+
+    def assign_report(self, report_id, badge_number):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('''
+                UPDATE security_reports SET status = %s, assigned_to = %s, assigned_ts = %s
+                WHERE id = %s AND status <> %s
+            ''', (database.REPORT_ASSIGNED, badge_number, now_epoch(), report_id, database.REPORT_RESOLVED))
+            return cur.rowcount > 0
+
+    def resolve_report(self, report_id, badge_number):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('''
+                UPDATE security_reports
+                SET status = %s, resolved_ts = %s, assigned_to = COALESCE(assigned_to, %s)
+                WHERE id = %s AND status <> %s
+            ''', (database.REPORT_RESOLVED, now_epoch(), badge_number, report_id, database.REPORT_RESOLVED))
+            return cur.rowcount > 0
+
+    def mark_reports_email_sent(self, report_ids):
+        report_ids = list(report_ids)
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('UPDATE security_reports SET email_sent = TRUE WHERE id = ANY(%s)', (report_ids,))
+            cur.execute('''
+                UPDATE email_outbox SET status = %s, sent_ts = %s, last_error = NULL
+                WHERE report_id = ANY(%s) AND status = %s
+            ''', (database.OUTBOX_SENT, now_epoch(), report_ids, database.OUTBOX_DEAD))
+
+    def _enqueue_email(self, conn, report_id, payload, created_ts, urgent=False):
+        with conn.cursor() as cur:
+            cur.execute('''
+                INSERT INTO email_outbox (report_id, payload, urgent, status, next_attempt_ts, created_ts)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            ''', (report_id, payload, bool(urgent), database.OUTBOX_PENDING, created_ts, created_ts))
+
+    def claim_outbox(self, limit, lease_seconds, urgent=None):
+        now = now_epoch()
+        urgent_filter = '' if urgent is None else f'AND urgent = {str(bool(urgent)).upper()}'
+        # SKIP LOCKED: nhiều replica cùng chạy dispatcher mà không nhận trùng email
+        return self._fetchall(f'''
+            UPDATE email_outbox SET status = %s, next_attempt_ts = %s
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE status IN (%s, %s) AND next_attempt_ts <= %s {urgent_filter}
+                ORDER BY next_attempt_ts
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, report_id, payload, attempts, created_ts
+        ''', (database.OUTBOX_SENDING, now + lease_seconds,
+              database.OUTBOX_PENDING, database.OUTBOX_SENDING, now, limit))
+
+    def complete_outbox(self, outbox_id):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('''
+                UPDATE email_outbox SET status = %s, sent_ts = %s, last_error = NULL
+                WHERE id = %s
+                RETURNING report_id
+            ''', (database.OUTBOX_SENT, now_epoch(), outbox_id))
+            row = cur.fetchone()
+            if row and row[0] is not None:
+                cur.execute('UPDATE security_reports SET email_sent = TRUE WHERE id = %s', (row[0],))
+
+    def fail_outbox(self, outbox_id, error, retry_at):
+        status = database.OUTBOX_DEAD if retry_at is None else database.OUTBOX_PENDING
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('''
+                UPDATE email_outbox
+                SET status = %s, attempts = attempts + 1, next_attempt_ts = COALESCE(%s, next_attempt_ts),
+                    last_error = %s
+                WHERE id = %s
+            ''', (status, retry_at, error, outbox_id))
+
+    def digest_backlog(self):
+        return self._fetchone('''
+            SELECT COUNT(*), MIN(created_ts) FROM email_outbox
+            WHERE status IN (%s, %s) AND next_attempt_ts <= %s AND NOT urgent
+        ''', (database.OUTBOX_PENDING, database.OUTBOX_SENDING, now_epoch()))
+
+    def outbox_counts(self):
+        return dict(self._fetchall('SELECT status, COUNT(*) FROM email_outbox GROUP BY status'))
+
+    def reserve_rate_tokens(self, name, rate, burst, cost, max_wait):
+        now = time.time()
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('''
+                INSERT INTO rate_buckets (name, tokens, updated) VALUES (%s, %s, %s)
+                ON CONFLICT (name) DO NOTHING
+            ''', (name, float(burst), now))
+            # FOR UPDATE: các replica lần lượt đặt trước token trên cùng một dòng
+            cur.execute('SELECT tokens, updated FROM rate_buckets WHERE name = %s FOR UPDATE', (name,))
+            tokens, updated = cur.fetchone()
+            tokens, wait = reserve(tokens, updated, now, rate, burst, cost, max_wait)
+            cur.execute('UPDATE rate_buckets SET tokens = %s, updated = %s WHERE name = %s',
+                        (tokens, now, name))
+            return wait
+
+    def hit_rate_window(self, name, key, limit, window_seconds):
+        now = time.time()
+        with self.connection() as conn, conn.cursor() as cur:
+            # Khóa theo (name, key) tới hết transaction: các replica lần lượt đếm - ghi
+            cur.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', (f'{name}:{key}',))
+            if random.random() < RATE_EVENTS_PURGE_PROBABILITY:
+                cur.execute('DELETE FROM rate_events WHERE name = %s AND ts <= %s', (name, now - window_seconds))
+            else:
+                cur.execute('DELETE FROM rate_events WHERE name = %s AND key = %s AND ts <= %s',
+                            (name, key, now - window_seconds))
+            cur.execute('SELECT COUNT(*), MIN(ts) FROM rate_events WHERE name = %s AND key = %s', (name, key))
+            count, oldest = cur.fetchone()
+            if count >= limit:
+                return oldest + window_seconds - now
+            cur.execute('INSERT INTO rate_events (name, key, ts) VALUES (%s, %s, %s)', (name, key, now))
+            return 0
+
+    def insert_forum_post(self, title, content, category, anonymous_id, idempotency_key=None):
+        with self.connection() as conn:
+            return self._insert_forum_post(conn, title, content, category, anonymous_id, idempotency_key)
+
+    def _insert_forum_post(self, conn, title, content, category, anonymous_id, idempotency_key=None):
+        with conn.cursor() as cur:
+            cur.execute('''
+                INSERT INTO forum_posts (title, content, category, anonymous_id, created_ts, idempotency_key)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+                RETURNING id
+            ''', (title, content, category, anonymous_id, now_epoch(), idempotency_key))
+            row = cur.fetchone()
+        if row:
+            return row[0]
+        return self._find_by_idempotency_key(conn, 'forum_posts', idempotency_key)
+
+    def insert_forum_reply(self, post_id, content, author_type, author_id, display_name, is_official):
+        with self.connection() as conn:
+            return self._insert_forum_reply(conn, post_id, content, author_type, author_id,
+                                            display_name, is_official)
+
+    def _insert_forum_reply(self, conn, post_id, content, author_type, author_id, display_name, is_official):
+        with conn.cursor() as cur:
+            cur.execute('''
+                INSERT INTO forum_replies (post_id, content, author_type, author_id, display_name, is_official, created_ts)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (post_id, content, author_type, author_id, display_name, bool(is_official), now_epoch()))
+            reply_id = cur.fetchone()[0]
+            if is_official:
+                cur.execute('UPDATE forum_posts SET is_answered = TRUE WHERE id = %s', (post_id,))
+            return reply_id
+
+    def list_forum_posts(self, category=None, limit=50):
+        query = f'SELECT {POST_COLUMNS} FROM forum_posts'
+        params = []
+        if category:
+            query += ' WHERE category = %s'
+            params.append(category)
+        query += ' ORDER BY created_ts DESC LIMIT %s'
+        params.append(limit)
+        return build_forum_posts(self._fetchall(query, params))
+
+    def list_unanswered_posts(self, after=None, limit=25):
+        query = f'SELECT {POST_COLUMNS} FROM forum_posts WHERE NOT is_answered'
+        params = []
+        if after is not None:
+            query += ' AND (created_ts, id) > (%s, %s)'
+            params.extend(after)
+        query += ' ORDER BY created_ts, id LIMIT %s'
+        params.append(limit)
+        return build_forum_posts(self._fetchall(query, params))
+
+    def list_forum_replies(self, post_id):
+        return build_forum_replies(self._fetchall(f'''
+            SELECT {REPLY_COLUMNS}
+            FROM forum_replies
+            WHERE post_id = %s
+            ORDER BY created_ts ASC, id ASC
+        ''', (post_id,)))
+
+    def quick_stats(self, today):
+        rows = self._fetchall('''
+            SELECT name, bucket, value FROM stats_counters
+            WHERE name IN ('reports', 'posts') AND bucket IN (%s, %s)
+        ''', (database.TOTAL_BUCKET, today))
+        counters = {(name, bucket): value for name, bucket, value in rows}
+        return {
+            'total_reports': counters.get(('reports', database.TOTAL_BUCKET), 0),
+            'total_posts': counters.get(('posts', database.TOTAL_BUCKET), 0),
+            'today_reports': counters.get(('reports', today), 0),
+        }
+
+    def analytics_daily(self, start_day, end_day):
+        return self._fetchall('''
+            SELECT metric, day, count, total_seconds FROM analytics_daily
+            WHERE day BETWEEN %s AND %s
+            ORDER BY day
+        ''', (start_day, end_day))
+
+    def analytics_hourly(self, start_ts, end_ts):
+        return self._fetchall('''
+            SELECT metric, hour_ts, count, total_seconds FROM analytics_hourly
+            WHERE hour_ts >= %s AND hour_ts < %s
+            ORDER BY hour_ts
+        ''', (start_ts, end_ts))
+
+    def analytics_totals(self):
+        rows = self._fetchall('''
+            SELECT metric, SUM(count), SUM(total_seconds) FROM analytics_daily GROUP BY metric
+        ''')
+        return {metric: (int(count), int(seconds)) for metric, count, seconds in rows}
+
+    def report_cell_counts(self, start_day, end_day):
+        return [(cell, int(count)) for cell, count in self._fetchall('''
+            SELECT cell, SUM(count) FROM report_cells
+            WHERE day BETWEEN %s AND %s
+            GROUP BY cell
+        ''', (start_day, end_day))]
+
+    def get_police_user(self, badge_number):
+        return self._fetchone('''
+            SELECT badge_number, display_name, password_hash, role
+            FROM police_users
+            WHERE badge_number = %s
+        ''', (badge_number,))
+
+    def create_police_user(self, badge_number, display_name, password_hash, role='officer'):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('''
+                INSERT INTO police_users (badge_number, display_name, password_hash, role)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (badge_number) DO NOTHING
+            ''', (badge_number, display_name, password_hash, role))
+
+
+# ================ CHỌN BACKEND THEO CẤU HÌNH ================
+def load_storage_config():
+    """
+    Đọc cấu hình lưu trữ:
+    CÁCH 1: st.secrets["database"] (backend, path, url, pool_min, pool_max)
+    CÁCH 2: biến môi trường DB_BACKEND, DB_PATH, DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX
+    """
+    try:
+        import streamlit as st
+        section = st.secrets["database"]
+        return {
+            'backend': section.get("backend", "sqlite"),
+            'path': section.get("path", database.DB_PATH),
+            'url': section.get("url"),
+            'pool_min': int(section.get("pool_min", 1)),
+            'pool_max': int(section.get("pool_max", 10)),
+        }
+    except Exception:
+        url = os.environ.get('DATABASE_URL')
+        return {
+            'backend': os.environ.get('DB_BACKEND', 'postgres' if url else 'sqlite'),
+            'path': os.environ.get('DB_PATH', database.DB_PATH),
+            'url': url,
+            'pool_min': int(os.environ.get('DB_POOL_MIN', 1)),
+            'pool_max': int(os.environ.get('DB_POOL_MAX', 10)),
+        }
+
+
+def create_storage(config):
+    """Khởi tạo backend từ dict cấu hình"""
+    backend = (config.get('backend') or 'sqlite').lower()
+    if backend == 'sqlite':
+        return SQLiteStorage(config.get('path'))
+    if backend in ('postgres', 'postgresql'):
+        if not config.get('url'):
+            raise ValueError("Backend postgres cần cấu hình database.url / DATABASE_URL")
+        return PostgresStorage(config['url'], config.get('pool_min', 1), config.get('pool_max', 10))
+    raise ValueError(f"Backend lưu trữ không hỗ trợ: {backend}")
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Backend dùng chung cho cả tiến trình (tạo một lần, pool kết nối dùng lại)"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage(load_storage_config())
+    return _storage
+
+
+# ================ CHẠY TỪ DÒNG LỆNH ================
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bảo trì lớp lưu trữ theo cấu hình [database] / DB_*")
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help="Tính lại bộ đếm, reply_count, bảng thống kê và report_cells từ dữ liệu gốc")
+    parser.add_argument('--archive-dir', default=archive.ARCHIVE_DIR,
+                        help="Thư mục file lưu trữ theo tháng được cộng vào khi tính lại (chỉ sqlite)")
+    args = parser.parse_args()
+    if not args.rebuild_rollups:
+        parser.error("Chưa chọn thao tác (--rebuild-rollups)")
+
+    storage = get_storage()
+    if storage.name == 'sqlite':
+        storage.archive_dir = args.archive_dir
+    storage.init_schema()
+    storage.rebuild_rollups()
+    print(f"✅ Đã tính lại bảng tổng hợp ({storage.name})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Fixture dùng chung: backend lưu trữ SQLite (file tạm) và PostgreSQL
+#
+# PostgreSQL lấy từ TEST_DATABASE_URL (mỗi test một database riêng tạo trên máy chủ đó),
+# hoặc từ máy chủ cục bộ do gói pgserver khởi động; không có cả hai thì bỏ qua test postgres.
+import os
+import uuid
+
+import pytest
+
+import storage as storage_module
+from storage import PostgresStorage, SQLiteStorage
+
+BACKENDS = ('sqlite', 'postgres')
+
+
+@pytest.fixture(scope='session')
+def postgres_admin_url(tmp_path_factory):
+    url = os.environ.get('TEST_DATABASE_URL')
+    if url:
+        return url
+    try:
+        import pgserver
+    except ImportError:
+        pytest.skip("Cần TEST_DATABASE_URL hoặc gói pgserver để chạy test PostgreSQL")
+    server = pgserver.get_server(tmp_path_factory.mktemp('pg'), cleanup_mode='stop')
+    return server.get_uri()
+
+
+@pytest.fixture
+def postgres_url(postgres_admin_url):
+    psycopg2 = pytest.importorskip('psycopg2')
+    from psycopg2.extensions import make_dsn
+
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(postgres_admin_url)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'CREATE DATABASE {name}')
+        yield make_dsn(postgres_admin_url, dbname=name)
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS {name} WITH (FORCE)')
+    finally:
+        admin.close()
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    backend = SQLiteStorage(str(tmp_path / 'community_app.db'), str(tmp_path / 'archive'))
+    backend.init_schema()
+    return backend
+
+
+@pytest.fixture
+def postgres_storage(postgres_url):
+    backend = PostgresStorage(postgres_url, 1, 4)
+    backend.init_schema()
+    yield backend
+    backend.close()
+
+
+@pytest.fixture(params=BACKENDS)
+def storage(request, monkeypatch):
+    """Cùng một bộ test hợp đồng cho mọi backend; get_storage() trả về backend đang test"""
+    backend = request.getfixturevalue(f'{request.param}_storage')
+    monkeypatch.setattr(storage_module, '_storage', backend)
+    return backend
+
+
+@pytest.fixture(params=BACKENDS)
+def empty_storage(request, tmp_path):
+    """Backend chưa chạy init_schema: test nâng cấp tự dựng database cũ trước"""
+    if request.param == 'sqlite':
+        return SQLiteStorage(str(tmp_path / 'community_app.db'), str(tmp_path / 'archive'))
+    backend = PostgresStorage(request.getfixturevalue('postgres_url'), 1, 4)
+    request.addfinalizer(backend.close)
+    return backend
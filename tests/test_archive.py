@@ -0,0 +1,109 @@
+# Kiểm tra lưu trữ theo tháng (archive.py): chuyển dòng cũ sang file tháng rồi tìm lại được
+import pytest
+
+import archive
+import storage as storage_module
+
+# 10:00 ngày 14/11/2023 giờ Việt Nam; lưu trữ chạy một năm sau
+OLD_TS = 1_699_930_800
+NOW = OLD_TS + 365 * 86400
+
+
+@pytest.fixture
+def old_rows(monkeypatch):
+    """Các dòng ghi trong test mang created_ts = OLD_TS"""
+    monkeypatch.setattr(storage_module, 'now_epoch', lambda: OLD_TS)
+
+
+def _archive(sqlite_storage, archive_dir):
+    return archive.archive_old_rows(sqlite_storage.db_path, retention_days=180,
+                                    archive_dir=str(archive_dir), now=NOW)
+
+
+def test_archived_post_keeps_reply_count(sqlite_storage, tmp_path, old_rows):
+    post_id = sqlite_storage.insert_forum_post('Hỏi về tạm trú', 'Thủ tục đăng ký tạm trú?', 'Cư trú', 'Ẩn danh #1')
+    sqlite_storage.insert_forum_reply(post_id, 'Cùng câu hỏi', 'citizen', None, 'Người dân', False)
+    sqlite_storage.insert_forum_reply(post_id, 'Mang CCCD tới công an phường', 'police', 'CA001', 'Công an', True)
+
+    moved = _archive(sqlite_storage, tmp_path / 'archive')
+    assert moved == {'security_reports': 0, 'forum_posts': 1, 'forum_replies': 2}
+    assert sqlite_storage.list_forum_posts() == []
+
+    rows = archive.search_forum_posts('tạm trú', db_path=sqlite_storage.db_path,
+                                      archive_dir=str(tmp_path / 'archive'))
+    assert [(row[0], row[6], row[-1]) for row in rows] == [(post_id, 2, '2023_11')]
+    # Bộ đếm toàn thời gian không bị trừ khi lưu trữ
+    assert sqlite_storage.quick_stats('2023-11-14')['total_posts'] == 1
+
+
+def test_archive_search_escapes_like_wildcards(sqlite_storage, tmp_path, old_rows):
+    for title in ('Giảm 50% học phí', 'Mất xe_máy', 'Mất xe máy'):
+        sqlite_storage.insert_forum_post(title, title, 'Khác', 'Ẩn danh #1')
+    archive_dir = str(tmp_path / 'archive')
+
+    def titles(keyword):
+        return sorted(row[1] for row in archive.search_forum_posts(keyword, db_path=sqlite_storage.db_path,
+                                                                    archive_dir=archive_dir))
+
+    assert titles('%') == ['Giảm 50% học phí']
+    assert titles('xe_') == ['Mất xe_máy']
+    assert len(titles('')) == 3
+
+
+def test_report_browser_searches_hot_and_archived_rows(sqlite_storage, tmp_path, monkeypatch):
+    from report_browser import search_archive
+
+    archive_dir = str(tmp_path / 'archive')
+    monkeypatch.setattr(storage_module, 'now_epoch', lambda: OLD_TS)
+    old_id = sqlite_storage.insert_report('Trộm xe cũ', 'Mất xe', 'Phường 1', '', 'ip')
+    sqlite_storage.resolve_report(old_id, 'CA001')
+    monkeypatch.setattr(storage_module, 'now_epoch', lambda: NOW)
+    new_id = sqlite_storage.insert_report('Trộm xe mới', 'Mất xe', 'Phường 2', '', 'ip')
+    _archive(sqlite_storage, archive_dir)
+
+    rows, dates, total = search_archive('Phản ánh', '2023-11-01', '2024-12-31', 'trộm xe',
+                                        storage=sqlite_storage, archive_dir=archive_dir)
+    assert [(row[0], row[-1]) for row in rows] == [(new_id, 'hot'), (old_id, '2023_11')]
+    assert dates[-1] == '10:00 14/11/2023'
+    assert total == 2
+
+
+def test_archive_moves_only_resolved_reports(sqlite_storage, tmp_path, old_rows):
+    received_id = sqlite_storage.insert_report('Chưa ai nhận', 'Mô tả', 'Phường 1', '', 'ip')
+    assigned_id = sqlite_storage.insert_report('Đang xử lý', 'Mô tả', 'Phường 2', '', 'ip')
+    sqlite_storage.assign_report(assigned_id, 'CA001')
+    resolved_id = sqlite_storage.insert_report('Đã xử lý', 'Mô tả', 'Phường 3', '', 'ip')
+    sqlite_storage.resolve_report(resolved_id, 'CA001')
+
+    moved = _archive(sqlite_storage, tmp_path / 'archive')
+    assert moved['security_reports'] == 1
+    # Phản ánh cũ chưa xử lý xong vẫn ở hàng đợi
+    assert [row.id for row in sqlite_storage.list_report_queue()] == [received_id]
+    assert [row.id for row in sqlite_storage.list_report_queue(assigned_to='CA001')] == [assigned_id]
+    assert sqlite_storage.get_report(resolved_id) is None
+
+
+def _rollup_tables(sqlite_storage):
+    with sqlite_storage.connection() as conn:
+        return {table: sorted(conn.execute(f'SELECT * FROM {table}').fetchall())
+                for table in ('stats_counters', 'analytics_hourly', 'analytics_daily', 'report_cells')}
+
+
+def test_rebuild_rollups_counts_archived_rows(sqlite_storage, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage_module, 'now_epoch', lambda: OLD_TS)
+    report_id = sqlite_storage.insert_report('Trộm xe', 'Mất xe', 'Phường 1', '', 'ip',
+                                             latitude=10.77, longitude=106.70)
+    sqlite_storage.resolve_report(report_id, 'CA001')
+    post_id = sqlite_storage.insert_forum_post('Hỏi về tạm trú', 'Thủ tục?', 'Cư trú', 'Ẩn danh #1')
+    sqlite_storage.insert_forum_reply(post_id, 'Mang CCCD tới công an phường', 'police', 'CA001', 'Công an', True)
+    monkeypatch.setattr(storage_module, 'now_epoch', lambda: NOW)
+    sqlite_storage.insert_report('Đánh nhau', 'Mô tả', 'Chợ', '', 'ip', latitude=10.77, longitude=106.70)
+
+    expected = _rollup_tables(sqlite_storage)
+    moved = _archive(sqlite_storage, tmp_path / 'archive')
+    assert moved == {'security_reports': 1, 'forum_posts': 1, 'forum_replies': 1}
+    assert _rollup_tables(sqlite_storage) == expected
+
+    # Tính lại từ dữ liệu gốc không xóa các tháng đã lưu trữ khỏi lịch sử
+    sqlite_storage.rebuild_rollups()
+    assert _rollup_tables(sqlite_storage) == expected
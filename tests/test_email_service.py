@@ -0,0 +1,173 @@
+# Kiểm tra SendGridClient và SMTPTransport: giữ kết nối, mở lại khi bị ngắt, chỉ thử lại khi chắc chắn chưa gửi
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import email_service
+from email_service import SendGridClient
+
+
+@pytest.fixture
+def mock_sendgrid():
+    """Máy chủ giả lập đếm số POST nhận được; drop=True thì nhận xong đóng kết nối, không trả lời"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            server.posts += 1
+            if server.drop:
+                self.close_connection = True
+                return
+            self.send_response(202)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.posts = 0
+    server.drop = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.api_base = f'http://127.0.0.1:{server.server_address[1]}'
+    yield server
+    server.shutdown()
+
+
+def test_reuses_connection(mock_sendgrid):
+    client = SendGridClient('key', mock_sendgrid.api_base)
+    for _ in range(5):
+        assert client.send({'subject': 'x'})[0] == 202
+    assert client.stats() == {'requests': 5, 'connections_opened': 1}
+    client.close()
+
+
+def test_no_retry_after_request_reached_server(mock_sendgrid):
+    mock_sendgrid.drop = True
+    client = SendGridClient('key', mock_sendgrid.api_base)
+    with pytest.raises(Exception):
+        client.send({'subject': 'x'})
+    # Máy chủ đã nhận email: không được gửi lần thứ hai
+    assert mock_sendgrid.posts == 1
+
+
+def test_retries_when_request_could_not_be_sent(mock_sendgrid):
+    client = SendGridClient('key', mock_sendgrid.api_base)
+    stale = client._new_connection()
+    dead, _ = socket.socketpair()
+    dead.close()
+    stale.sock = dead
+    client._release(stale)
+
+    assert client.send({'subject': 'x'})[0] == 202
+    assert mock_sendgrid.posts == 1
+    assert client.stats()['connections_opened'] == 2
+
+
+def test_drops_connections_idle_too_long(mock_sendgrid, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(email_service.time, 'monotonic', lambda: now[0])
+    client = SendGridClient('key', mock_sendgrid.api_base, idle_seconds=30)
+    client.send({'subject': 'x'})
+    now[0] += 31
+    client.send({'subject': 'x'})
+    assert client.stats() == {'requests': 2, 'connections_opened': 2}
+
+
+def test_benchmark_runs_against_mock_server(capsys):
+    results = email_service.benchmark(count=5)
+    assert results['SendGrid_shared_connections'] == 1
+    assert results['SendGrid_new_connections'] == 5
+    assert 'render' in results
+
+
+# ================ SMTP (máy chủ aiosmtpd cục bộ) ================
+MESSAGE = {
+    'to': 'congan@example.com', 'from_email': 'app@example.com', 'sender_name': 'Ứng dụng',
+    'subject': 'Phản ánh', 'text': 'Nội dung', 'html': '<p>Nội dung</p>',
+}
+
+
+@pytest.fixture
+def mock_smtp():
+    """Máy chủ SMTP đếm số email nhận được; restart() cắt mọi kết nối đang mở"""
+    pytest.importorskip('aiosmtpd')
+    from aiosmtpd.controller import Controller
+
+    class Handler:
+        received = 0
+
+        async def handle_DATA(self, server, session, envelope):
+            Handler.received += 1
+            return '250 OK'
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    class Server:
+        def __init__(self):
+            self.handler = Handler
+            self.controller = Controller(Handler(), hostname='127.0.0.1', port=port)
+            self.controller.start()
+
+        def restart(self):
+            self.controller.stop()
+            self.controller = Controller(Handler(), hostname='127.0.0.1', port=port)
+            self.controller.start()
+
+    server = Server()
+    server.port = port
+    yield server
+    server.controller.stop()
+
+
+def test_smtp_reuses_connection(mock_smtp):
+    transport = email_service.SMTPTransport('127.0.0.1', mock_smtp.port, starttls=False)
+    for _ in range(3):
+        assert transport.send(MESSAGE)[0]
+    assert transport.stats() == {'messages': 3, 'connections_opened': 1}
+    assert mock_smtp.handler.received == 3
+    transport.close()
+
+
+def test_smtp_reconnects_after_server_drops_connection(mock_smtp):
+    transport = email_service.SMTPTransport('127.0.0.1', mock_smtp.port, starttls=False)
+    assert transport.send(MESSAGE)[0]
+    mock_smtp.restart()
+
+    assert transport.send(MESSAGE) == (True, "SMTP OK")
+    assert transport.stats() == {'messages': 2, 'connections_opened': 2}
+    assert mock_smtp.handler.received == 2
+    transport.close()
+
+
+def test_smtp_drops_connections_idle_too_long(mock_smtp, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(email_service.time, 'monotonic', lambda: now[0])
+    transport = email_service.SMTPTransport('127.0.0.1', mock_smtp.port, starttls=False, idle_seconds=30)
+    transport.send(MESSAGE)
+    now[0] += 10
+    transport.send(MESSAGE)
+    now[0] += 31
+    transport.send(MESSAGE)
+    assert transport.stats() == {'messages': 3, 'connections_opened': 2}
+    transport.close()
+
+
+def test_smtp_closes_socket_when_login_fails(mock_smtp, monkeypatch):
+    closed = []
+    original_close = email_service.smtplib.SMTP.close
+    monkeypatch.setattr(email_service.smtplib.SMTP, 'close',
+                        lambda self: closed.append(self) or original_close(self))
+    # Máy chủ giả lập không hỗ trợ AUTH: login() ném lỗi sau khi đã kết nối
+    transport = email_service.SMTPTransport('127.0.0.1', mock_smtp.port, username='u', password='p',
+                                            starttls=False)
+    ok, detail = transport.send(MESSAGE)
+    assert not ok and detail.startswith("❌ Lỗi kết nối SMTP")
+    assert len(closed) == 1 and closed[0].sock is None
+    assert transport.stats()['connections_opened'] == 0
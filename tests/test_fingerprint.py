@@ -0,0 +1,63 @@
+# Kiểm tra khóa máy khách: chỉ tin IP do proxy của mình ghi vào X-Forwarded-For
+import pytest
+
+import fingerprint
+from fingerprint import anonymous_tag, client_ip
+
+
+def test_rightmost_entry_behind_one_proxy():
+    # Máy khách tự gửi "1.1.1.1", proxy nối IP thật vào cuối
+    headers = {'x-forwarded-for': '1.1.1.1, 203.0.113.7'}
+    assert client_ip(headers, 1) == '203.0.113.7'
+
+
+def test_trusted_hops_counts_from_the_right():
+    headers = {'x-forwarded-for': '1.1.1.1, 203.0.113.7, 10.0.0.2'}
+    assert client_ip(headers, 2) == '203.0.113.7'
+    # Ít mục hơn số proxy: request không đi qua đủ proxy, không tin
+    assert client_ip({'x-forwarded-for': '203.0.113.7'}, 2) is None
+
+
+def test_real_ip_and_invalid_values():
+    assert client_ip({'x-real-ip': '198.51.100.4'}, 1) == '198.51.100.4'
+    assert client_ip({'x-forwarded-for': 'not-an-ip'}, 1) is None
+    assert client_ip({}, 1) is None
+
+
+def test_no_proxy_uses_connection_address():
+    assert client_ip({'x-forwarded-for': '1.1.1.1'}, 0, '192.0.2.9') == '192.0.2.9'
+    assert client_ip({'x-forwarded-for': '1.1.1.1'}, 0, '') is None
+
+
+@pytest.fixture
+def request_headers(monkeypatch):
+    headers = {}
+    monkeypatch.setattr(fingerprint, '_request_headers', lambda: headers)
+    monkeypatch.setattr(fingerprint, '_trusted_hops', 1)
+    monkeypatch.setattr(fingerprint, '_salt', b'test-salt')
+    return headers
+
+
+def test_spoofed_forwarded_for_does_not_change_key(request_headers):
+    request_headers['X-Forwarded-For'] = '1.1.1.1, 203.0.113.7'
+    first = fingerprint.client_fingerprint()
+    request_headers['X-Forwarded-For'] = '9.9.9.9, 203.0.113.7'
+    assert fingerprint.client_fingerprint() == first
+
+
+def test_clients_without_trusted_ip_share_one_key(request_headers):
+    request_headers['User-Agent'] = 'Browser A'
+    first = fingerprint.client_fingerprint()
+    request_headers['User-Agent'] = 'Browser B'
+    assert fingerprint.client_fingerprint() == first
+    request_headers['X-Forwarded-For'] = '203.0.113.7'
+    assert fingerprint.client_fingerprint() != first
+
+
+def test_anonymous_tag_hides_idempotency_key():
+    key = 'a1b2c3d4e5f60718293a4b5c6d7e8f90'
+    tag = anonymous_tag(key)
+    assert tag == anonymous_tag(key) and len(tag) == 8
+    assert tag not in key and key[:8] != tag
+    assert anonymous_tag('other-key') != tag
+    assert len(anonymous_tag()) == 8 and anonymous_tag() != anonymous_tag()
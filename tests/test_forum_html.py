@@ -0,0 +1,74 @@
+# Kiểm tra HTML diễn đàn: nội dung người dùng được escape, khóa cache đổi khi có bình luận mới hoặc được trả lời
+import pytest
+
+import forum_html
+from data_access import ForumPost, ForumReply
+from read_cache import ReadCache
+
+SCRIPT = '<script>alert("x")</script>'
+ESCAPED = '&lt;script&gt;alert(&quot;x&quot;)&lt;/script&gt;'
+
+
+@pytest.fixture(autouse=True)
+def render_cache(monkeypatch):
+    cache = ReadCache(max_entries=16)
+    monkeypatch.setattr(forum_html, 'render_cache', cache)
+    return cache
+
+
+def _post(reply_count=0, is_answered=False, content='Nội dung'):
+    return ForumPost(7, 'Hỏi', content, 'Cư trú', 'Ẩn danh #1', 0, reply_count, is_answered)
+
+
+class Replies:
+    """load_replies giả: đếm số lần đọc database"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.loads = 0
+
+    def __call__(self, post_id):
+        assert post_id == 7
+        self.loads += 1
+        return self.replies
+
+
+def test_post_and_reply_content_is_escaped():
+    post = ForumPost(7, 'Hỏi', f'{SCRIPT}\ndòng 2', 'Cư trú', '<b>Ẩn danh</b>', 0, 0, False)
+    html = forum_html.post_html(post)
+    assert SCRIPT not in html and '<b>Ẩn danh' not in html
+    assert f'{ESCAPED}<br>dòng 2' in html
+    assert '&lt;b&gt;Ẩn danh&lt;/b&gt;' in html
+
+    reply = ForumReply(1, SCRIPT, 'citizen', '<i>Tên</i>', False, 0, '<u>hôm nay</u>')
+    html = forum_html.thread_html(post, Replies(reply))
+    assert '<script>' not in html and '<i>' not in html and '<u>' not in html
+    assert ESCAPED in html
+    assert '&lt;i&gt;Tên&lt;/i&gt;' in html and '&lt;u&gt;hôm nay&lt;/u&gt;' in html
+
+
+def test_escape_text_handles_none_and_newlines():
+    assert forum_html.escape_text(None) == ''
+    assert forum_html.escape_text('a & b\nc') == 'a &amp; b<br>c'
+
+
+def test_thread_cached_until_reply_arrives():
+    replies = Replies(ForumReply(1, 'Câu đầu', 'citizen', 'Người dân', False, 0))
+    first = forum_html.thread_html(_post(reply_count=1), replies)
+    assert forum_html.thread_html(_post(reply_count=1), replies) == first
+    assert replies.loads == 1
+
+    replies.replies.append(ForumReply(2, 'Câu thứ hai', 'citizen', 'Người dân', False, 0))
+    second = forum_html.thread_html(_post(reply_count=2), replies)
+    assert replies.loads == 2
+    assert 'Câu thứ hai' in second and 'Câu thứ hai' not in first
+
+
+def test_post_html_rebuilt_when_answered():
+    waiting = forum_html.post_html(_post(reply_count=1))
+    assert '⏳ Chờ trả lời' in waiting
+    assert forum_html.post_version(_post(reply_count=1)) != forum_html.post_version(_post(1, is_answered=True))
+    answered = forum_html.post_html(_post(reply_count=1, is_answered=True))
+    assert '✅ Đã trả lời' in answered
+    # Cùng phiên bản thì đọc từ cache, kể cả khi đối tượng bài đăng là bản mới
+    assert forum_html.post_html(_post(reply_count=1, content='sửa')) is waiting
@@ -0,0 +1,189 @@
+# Kiểm tra OutboxDispatcher: backoff khi gửi lỗi, chuyển dead sau MAX_ATTEMPTS, nhận lại email hết hạn giữ,
+# gom phản ánh không khẩn thành email tổng hợp
+import pytest
+
+import database
+import outbox
+import storage as storage_module
+from email_service import EmailConfig, build_digest_message
+from outbox import MAX_ATTEMPTS, SEND_LEASE_SECONDS, DigestConfig, OutboxDispatcher, retry_delay
+
+BASE_TS = 1_699_930_800
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Cùng một đồng hồ cho storage (next_attempt_ts, lease) và outbox (lịch thử lại)"""
+    class Clock:
+        now = BASE_TS
+
+        def __call__(self):
+            return self.now
+
+    fake = Clock()
+    monkeypatch.setattr(storage_module, 'now_epoch', fake)
+    monkeypatch.setattr(outbox, 'now_epoch', fake)
+    return fake
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(outbox.random, 'uniform', lambda low, high: 1.0)
+
+
+class Sender:
+    """Transport giả: ok=False thì mọi lần gửi đều lỗi"""
+
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.sent = []
+
+    def __call__(self, report_data):
+        self.sent.append(report_data)
+        return (True, "OK") if self.ok else (False, "503 Service Unavailable")
+
+
+def _submit(storage, title='Trộm xe', urgent=False):
+    return storage.submit_report(title, 'Mô tả', 'Chợ', 'sáng nay', 'ip', urgent=urgent)
+
+
+def _outbox_row(storage):
+    with storage.connection() as conn:
+        return conn.execute('SELECT status, attempts, next_attempt_ts, last_error FROM email_outbox').fetchone()
+
+
+def test_retry_delay_doubles_up_to_cap(no_jitter):
+    assert [retry_delay(attempts) for attempts in range(1, 9)] == [30, 60, 120, 240, 480, 960, 1920, 3600]
+    assert retry_delay(20) == outbox.RETRY_MAX_SECONDS
+
+
+def test_retry_delay_jitter_stays_within_twenty_percent():
+    delays = {retry_delay(3) for _ in range(200)}
+    assert min(delays) >= 96 and max(delays) <= 144
+    assert len(delays) > 1
+
+
+def test_failed_send_waits_for_backoff(sqlite_storage, clock, no_jitter):
+    _submit(sqlite_storage)
+    sender = Sender(ok=False)
+    dispatcher = OutboxDispatcher(sqlite_storage, sender)
+
+    assert dispatcher.dispatch_once() == 1
+    assert _outbox_row(sqlite_storage) == (database.OUTBOX_PENDING, 1, BASE_TS + 30, "503 Service Unavailable")
+    # Chưa tới hạn thử lại: không gửi
+    clock.now += 29
+    assert dispatcher.dispatch_once() == 0
+    clock.now += 1
+    assert dispatcher.dispatch_once() == 1
+    assert _outbox_row(sqlite_storage)[1:3] == (2, BASE_TS + 30 + 60)
+    assert len(sender.sent) == 2
+
+
+def test_goes_dead_after_max_attempts(sqlite_storage, clock, no_jitter):
+    report_id = _submit(sqlite_storage)
+    dispatcher = OutboxDispatcher(sqlite_storage, Sender(ok=False))
+
+    for _ in range(MAX_ATTEMPTS):
+        assert dispatcher.dispatch_once() == 1
+        clock.now += outbox.RETRY_MAX_SECONDS
+    assert _outbox_row(sqlite_storage)[:2] == (database.OUTBOX_DEAD, MAX_ATTEMPTS)
+    assert dispatcher.stats()['failed'] == MAX_ATTEMPTS - 1
+    assert dispatcher.stats()['dead'] == 1
+
+    # Dead không còn được nhận; phản ánh vẫn chưa đánh dấu đã gửi (công cụ gửi lại sẽ xử lý)
+    clock.now += outbox.RETRY_MAX_SECONDS
+    assert dispatcher.dispatch_once() == 0
+    assert not sqlite_storage.get_report(report_id).email_sent
+
+
+def test_lease_reclaimed_after_crash(sqlite_storage, clock):
+    report_id = _submit(sqlite_storage)
+    # Tiến trình khác nhận email rồi chết trước khi gửi xong
+    assert len(sqlite_storage.claim_outbox(4, SEND_LEASE_SECONDS)) == 1
+
+    sender = Sender()
+    dispatcher = OutboxDispatcher(sqlite_storage, sender)
+    clock.now += SEND_LEASE_SECONDS - 1
+    assert dispatcher.dispatch_once() == 0
+    clock.now += 1
+    assert dispatcher.dispatch_once() == 1
+
+    assert [data['report_id'] for data in sender.sent] == [report_id]
+    status, attempts, _, _ = _outbox_row(sqlite_storage)
+    assert (status, attempts) == (database.OUTBOX_SENT, 0)
+    assert sqlite_storage.get_report(report_id).email_sent
+
+
+# ================ EMAIL TỔNG HỢP ================
+def _digest_dispatcher(storage, window_seconds=600, max_reports=3):
+    sender, digest_sender = Sender(), Sender()
+    dispatcher = OutboxDispatcher(storage, sender, digest_sender=digest_sender,
+                                  digest=DigestConfig(True, window_seconds, max_reports))
+    return dispatcher, sender, digest_sender
+
+
+def _email_sent(storage, report_ids):
+    return [storage.get_report(report_id).email_sent for report_id in report_ids]
+
+
+def test_digest_waits_for_threshold_but_urgent_goes_alone(sqlite_storage, clock):
+    dispatcher, sender, digest_sender = _digest_dispatcher(sqlite_storage)
+    first = _submit(sqlite_storage, 'Ồn ào')
+    clock.now += 10
+    urgent = _submit(sqlite_storage, 'Đánh nhau', urgent=True)
+    clock.now += 10
+    second = _submit(sqlite_storage, 'Rác thải')
+
+    assert dispatcher.dispatch_once() == 1
+    assert [data['report_id'] for data in sender.sent] == [urgent]
+    assert digest_sender.sent == []
+    assert _email_sent(sqlite_storage, [first, second]) == [False, False]
+
+    # Phản ánh thứ ba chạm ngưỡng max_reports: một email cho cả ba, theo thứ tự tiếp nhận
+    clock.now += 10
+    third = _submit(sqlite_storage, 'Trộm vặt')
+    assert dispatcher.dispatch_once() == 3
+    assert [[data['report_id'] for data in batch] for batch in digest_sender.sent] == [[first, second, third]]
+    assert _email_sent(sqlite_storage, [first, second, third]) == [True, True, True]
+    assert sqlite_storage.outbox_counts() == {database.OUTBOX_SENT: 4}
+    assert dispatcher.stats() == {'sent': 4, 'failed': 0, 'dead': 0, 'digests': 1, 'api_calls': 2}
+
+
+def test_digest_sent_when_oldest_report_waited_out_the_window(sqlite_storage, clock):
+    dispatcher, _, digest_sender = _digest_dispatcher(sqlite_storage, window_seconds=600, max_reports=10)
+    report_ids = [_submit(sqlite_storage, 'Ồn ào'), _submit(sqlite_storage, 'Rác thải')]
+
+    clock.now += 599
+    assert dispatcher.dispatch_once() == 0
+    clock.now += 1
+    assert dispatcher.dispatch_once() == 2
+    assert [len(batch) for batch in digest_sender.sent] == [2]
+    assert _email_sent(sqlite_storage, report_ids) == [True, True]
+
+
+def test_failed_digest_retries_every_report(sqlite_storage, clock, no_jitter):
+    dispatcher, _, digest_sender = _digest_dispatcher(sqlite_storage, max_reports=2)
+    digest_sender.ok = False
+    report_ids = [_submit(sqlite_storage, 'Ồn ào'), _submit(sqlite_storage, 'Rác thải')]
+
+    assert dispatcher.dispatch_once() == 2
+    with sqlite_storage.connection() as conn:
+        rows = conn.execute('SELECT status, attempts, next_attempt_ts FROM email_outbox').fetchall()
+    assert rows == [(database.OUTBOX_PENDING, 1, BASE_TS + 30)] * 2
+    assert _email_sent(sqlite_storage, report_ids) == [False, False]
+
+
+def test_digest_message_lists_every_report_in_order():
+    config = EmailConfig('key', 'app@example.com', 'congan@example.com', 'Ứng dụng')
+    reports = [
+        {'report_id': 7, 'title': 'Ồn ào <b>', 'description': 'Dòng 1\nDòng 2', 'location': 'Chợ',
+         'created_at': '08:00 14/11/2023'},
+        {'report_id': 9, 'title': 'Rác thải', 'description': '', 'location': '', 'created_at': '08:05 14/11/2023'},
+    ]
+    message = build_digest_message(reports, config)
+
+    assert message['subject'] == "📋 TỔNG HỢP 2 PHẢN ÁNH AN NINH (PA-000007 → PA-000009)"
+    assert message['text'].index('[PA-000007] Ồn ào <b>') < message['text'].index('[PA-000009] Rác thải')
+    assert 'Từ 08:00 14/11/2023 đến 08:05 14/11/2023' in message['html']
+    assert 'Ồn ào &lt;b&gt;' in message['html'] and 'Dòng 1<br>' in message['html']
+    assert 'Không có mô tả' in message['text']
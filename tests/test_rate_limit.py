@@ -0,0 +1,140 @@
+# Kiểm tra cửa sổ trượt: forgive() chỉ bỏ đúng lượt của request đã gọi hit();
+# token bucket: nạp lại tối đa burst, token âm xếp hàng, từ chối khi phải chờ quá max_wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import pytest
+
+import rate_limit
+from login_guard import LoginGuard
+from rate_limit import SlidingWindowLimiter, TieredLimiter, TokenBucket, reserve
+
+
+def test_reserve_refill_capped_at_burst():
+    assert reserve(0.0, 0.0, 1000.0, rate=2.0, burst=5) == (4.0, 0.0)
+    assert reserve(1.0, 0.0, 1.0, rate=2.0, burst=5) == (2.0, 0.0)
+
+
+def test_reserve_negative_tokens_queue_later_callers():
+    tokens, wait = reserve(1.0, 0.0, 0.0, rate=2.0, burst=5)
+    assert (tokens, wait) == (0.0, 0.0)
+    tokens, wait = reserve(tokens, 0.0, 0.0, rate=2.0, burst=5)
+    assert (tokens, wait) == (-1.0, 0.5)
+    tokens, wait = reserve(tokens, 0.0, 0.0, rate=2.0, burst=5)
+    assert (tokens, wait) == (-2.0, 1.0)
+
+
+def test_reserve_returns_none_past_max_wait_without_spending():
+    # Phải chờ 1.5 giây > max_wait: giữ nguyên số token (đã nạp lại tới now)
+    assert reserve(-2.0, 0.0, 0.0, rate=2.0, burst=5, max_wait=1.0) == (-2.0, None)
+    assert reserve(-2.0, 0.0, 0.5, rate=2.0, burst=5, max_wait=1.0) == (-2.0, 1.0)
+    assert reserve(-2.0, 0.0, 0.0, rate=2.0, burst=5, cost=3, max_wait=None) == (-5.0, 2.5)
+
+
+def test_token_bucket_sleeps_in_turn_and_rejects(monkeypatch):
+    now = [100.0]
+    sleeps = []
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(rate_limit.time, 'sleep', sleeps.append)
+    bucket = TokenBucket(rate_per_second=2.0, burst=2, max_wait=1.0)
+    assert all(bucket.acquire() for _ in range(4))
+    assert sleeps == [0.5, 1.0]
+    assert bucket.acquire() is False
+    now[0] += 10
+    assert bucket.acquire() and sleeps == [0.5, 1.0]
+    stats = bucket.stats()
+    assert (stats['acquired'], stats['throttled'], stats['rejected']) == (5, 2, 1)
+    assert stats['throttle_seconds'] == pytest.approx(1.5)
+    assert stats['waiting'] == 0
+
+
+def test_hit_blocks_after_limit_and_expires():
+    limiter = SlidingWindowLimiter(2, 60)
+    assert limiter.hit('k', now=0)[0] == 0
+    assert limiter.hit('k', now=10)[0] == 0
+    assert limiter.hit('k', now=20) == (40, None)
+    assert limiter.hit('k', now=60)[0] == 0
+
+
+def test_forgive_removes_own_event_not_latest():
+    limiter = SlidingWindowLimiter(2, 60)
+    _, mine = limiter.hit('k', now=0)
+    _, other = limiter.hit('k', now=5)
+    limiter.forgive('k', mine)
+    # Còn lượt của request kia (t=5): lượt mới ở t=10 được phép, lượt sau đó bị chặn tới khi t=5 hết hạn
+    assert limiter.hit('k', now=10)[0] == 0
+    assert limiter.hit('k', now=11) == (54, None)
+
+
+def test_forgive_ignores_expired_or_rejected_tokens():
+    limiter = SlidingWindowLimiter(1, 60)
+    _, token = limiter.hit('k', now=0)
+    assert limiter.hit('k', now=61)[0] == 0
+    limiter.forgive('k', token)
+    limiter.forgive('k', None)
+    assert limiter.hit('k', now=62)[0] > 0
+
+
+class _RejectingShared:
+    def hit(self, key):
+        return 30
+
+    def stats(self):
+        return {}
+
+
+def test_tiered_limiter_forgives_local_hit_rejected_by_shared():
+    local = SlidingWindowLimiter(1, 60)
+    limiter = TieredLimiter(local, _RejectingShared())
+    assert limiter.hit('k') == 30
+    assert local.hit('k')[0] == 0
+
+
+def test_successful_login_keeps_concurrent_failed_attempts():
+    guard = LoginGuard(badge_limiter=SlidingWindowLimiter(2, 300), client_limiter=SlidingWindowLimiter(20, 300))
+    guard._verify = lambda password_hash, password: password == 'right'
+    user = ('CA001', 'Admin', 'hash', 'admin')
+
+    # Lượt đúng đang kiểm tra mật khẩu thì một lượt sai khác chen vào
+    original_verify = guard._verify
+
+    def verify_with_intruder(password_hash, password):
+        if password == 'right':
+            assert guard.login('CA001', 'wrong', 'attacker', lambda badge: user).error
+        return original_verify(password_hash, password)
+
+    guard._verify = verify_with_intruder
+    assert guard.login('CA001', 'right', 'officer', lambda badge: user).user == user
+    guard._verify = original_verify
+
+    # Lượt sai của kẻ dò vẫn được tính: còn đúng một lượt nữa cho số hiệu này
+    assert guard.login('CA001', 'wrong', 'attacker', lambda badge: user).error == "Sai số hiệu hoặc mật khẩu!"
+    assert "quá nhiều lần" in guard.login('CA001', 'wrong', 'attacker', lambda badge: user).error
+
+
+def _guard_with_verify(outcome):
+    guard = LoginGuard(badge_limiter=SlidingWindowLimiter(2, 300), client_limiter=SlidingWindowLimiter(3, 300))
+    guard._verify = lambda password_hash, password: outcome()
+    return guard
+
+
+def test_timed_out_verification_counts_as_attempt():
+    def timeout():
+        raise FutureTimeout()
+
+    guard = _guard_with_verify(timeout)
+    user = ('CA001', 'Admin', 'hash', 'admin')
+    for _ in range(2):
+        assert "bận" in guard.login('CA001', 'guess', 'attacker', lambda badge: user).error
+    assert "quá nhiều lần" in guard.login('CA001', 'guess', 'attacker', lambda badge: user).error
+    # Lượt của máy khách cũng được tính: đổi số hiệu vẫn bị chặn ở lượt thứ tư
+    assert "bận" in guard.login('CA002', 'guess', 'attacker', lambda badge: user).error
+    assert "quá nhiều lần" in guard.login('CA003', 'guess', 'attacker', lambda badge: user).error
+
+
+def test_busy_rejection_is_forgiven():
+    guard = _guard_with_verify(lambda: None)
+    user = ('CA001', 'Admin', 'hash', 'admin')
+    for _ in range(5):
+        assert "bận" in guard.login('CA001', 'guess', 'officer', lambda badge: user).error
+    guard._verify = lambda password_hash, password: True
+    assert guard.login('CA001', 'right', 'officer', lambda badge: user).user == user
@@ -0,0 +1,57 @@
+# Kiểm tra cache đọc: vô hiệu hóa khi ghi, TTL khi backend dùng chung giữa nhiều replica
+import read_cache as read_cache_module
+from read_cache import SHARED_BACKEND_TTL_SECONDS, ReadCache, configure_read_cache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Backend:
+    def __init__(self, shared):
+        self.shared = shared
+
+
+def _loader(values):
+    return lambda: values.append(len(values)) or len(values)
+
+
+def test_bump_generation_invalidates():
+    cache = ReadCache()
+    loads = []
+    assert cache.get_or_load('q', (), _loader(loads)) == 1
+    assert cache.get_or_load('q', (), _loader(loads)) == 1
+    cache.bump_generation()
+    assert cache.get_or_load('q', (), _loader(loads)) == 2
+
+
+def test_ttl_expires_entries_written_elsewhere(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(read_cache_module.time, 'monotonic', clock)
+    cache = ReadCache(ttl_seconds=5)
+    loads = []
+    assert cache.get_or_load('q', (), _loader(loads)) == 1
+    clock.now += 4.9
+    assert cache.get_or_load('q', (), _loader(loads)) == 1
+    clock.now += 0.2
+    assert cache.get_or_load('q', (), _loader(loads)) == 2
+
+
+def test_configure_read_cache_by_backend(monkeypatch):
+    monkeypatch.delenv('READ_CACHE_TTL_SECONDS', raising=False)
+    cache = ReadCache()
+    assert configure_read_cache(_Backend(shared=True), cache) == SHARED_BACKEND_TTL_SECONDS
+    assert configure_read_cache(_Backend(shared=False), cache) is None
+    monkeypatch.setenv('READ_CACHE_TTL_SECONDS', '2')
+    assert configure_read_cache(_Backend(shared=True), cache) == 2.0
+    assert cache.ttl_seconds == 2.0
+
+
+def test_storage_backends_declare_sharing():
+    from storage import PostgresStorage, SQLiteStorage
+    assert PostgresStorage.shared is True
+    assert SQLiteStorage.shared is False
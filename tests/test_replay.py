@@ -0,0 +1,86 @@
+# Kiểm tra gửi lại email bị lỡ: chạy thử không gửi/không ghi gì, lọc đúng khoảng ngày giờ Việt Nam
+from datetime import date
+
+import pytest
+
+import replay
+import storage as storage_module
+
+# 10:00 ngày 14/11/2023 giờ Việt Nam
+BASE_TS = 1_699_930_800
+DAY = 86400
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    class Clock:
+        now = BASE_TS
+
+        def __call__(self):
+            return self.now
+
+    fake = Clock()
+    monkeypatch.setattr(storage_module, 'now_epoch', fake)
+    monkeypatch.setattr(replay, 'now_epoch', fake)
+    return fake
+
+
+class Sender:
+    """sender giả cho replay_unsent: ghi lại report_id đã gửi, lỗi với các id trong `failing`"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    def __call__(self, report_data):
+        if report_data['report_id'] in self.failing:
+            return False, 'SMTP down'
+        self.sent.append(report_data['report_id'])
+        return True, 'ok'
+
+
+def _reports_by_day(storage, clock):
+    """Một phản ánh vào mỗi ngày 13, 14, 15/11/2023 (10:00 giờ Việt Nam)"""
+    ids = {}
+    for day, offset in (('13', -DAY), ('14', 0), ('15', DAY)):
+        clock.now = BASE_TS + offset
+        ids[day] = storage.insert_report(f'Ngày {day}', 'x', 'y', 'z', 'ip')
+    clock.now = BASE_TS + 2 * DAY
+    return ids
+
+
+def _unsent(storage):
+    return [row[0] for row in storage.list_unsent_reports(0, BASE_TS + 3 * DAY)]
+
+
+def test_dry_run_counts_without_sending_or_writing(storage, clock):
+    ids = _reports_by_day(storage, clock)
+    sender = Sender()
+    result = replay.replay_unsent(sender, dry_run=True, batch_size=2, storage=storage)
+    assert result == {'found': 3, 'sent': 0, 'failed': 0, 'errors': []}
+    assert sender.sent == []
+    assert _unsent(storage) == list(ids.values())
+
+
+def test_date_filters_select_vietnam_days(storage, clock):
+    ids = _reports_by_day(storage, clock)
+    sender = Sender()
+    # Giao diện truyền date, dòng lệnh truyền chuỗi YYYY-MM-DD
+    result = replay.replay_unsent(sender, date(2023, 11, 14), date(2023, 11, 14), storage=storage)
+    assert (result['found'], sender.sent) == (1, [ids['14']])
+
+    result = replay.replay_unsent(sender, end_day='2023-11-13', storage=storage)
+    assert (result['found'], sender.sent[1:]) == (1, [ids['13']])
+
+    result = replay.replay_unsent(sender, start_day='2023-11-13', storage=storage)
+    assert (result['found'], sender.sent[2:]) == (1, [ids['15']])
+    assert _unsent(storage) == []
+
+
+def test_failed_sends_stay_unsent_for_next_run(storage, clock):
+    ids = _reports_by_day(storage, clock)
+    sender = Sender(failing=[ids['14']])
+    result = replay.replay_unsent(sender, batch_size=2, storage=storage)
+    assert (result['found'], result['sent'], result['failed']) == (3, 2, 1)
+    assert result['errors'] == [(ids['14'], 'SMTP down')]
+    assert _unsent(storage) == [ids['14']]
@@ -0,0 +1,75 @@
+# Kiểm tra ngân sách bộ nhớ phiên: đo đúng số byte, giải phóng audio / văn bản ít dùng gần đây nhất trước
+import sys
+
+from session_memory import SPEECH_TEXTS, SessionMemory, SessionRegistry, sizeof
+
+AUDIO = b'\x00' * 1000
+
+
+def test_sizeof_counts_content_bytes():
+    assert sizeof(AUDIO) == 1000
+    assert sizeof(bytearray(10)) == 10
+    # Chuỗi tính theo UTF-8: 'Đ' chiếm 2 byte
+    assert sizeof('Đi') == 3
+    assert sizeof({'a': b'xy'}) == sys.getsizeof({'a': b'xy'}) + 1 + 2
+    assert sizeof([b'x', 'yz']) == sys.getsizeof([b'x', 'yz']) + 1 + 2
+
+
+def test_usage_splits_evictable_bytes():
+    state = {'long_audio_description': AUDIO, 'title': 'Tiêu đề', SPEECH_TEXTS: {'desc': 'x' * 100}}
+    memory = SessionMemory(state, budget_bytes=10**9, registry=SessionRegistry())
+    entries = {key: (size, evictable) for key, size, evictable in memory.entries()}
+    assert entries['long_audio_description'] == (1000, True)
+    assert entries['title'] == (sizeof('Tiêu đề'), False)
+    assert entries[f'{SPEECH_TEXTS}:desc'] == (4 + 100, True)
+    assert entries[SPEECH_TEXTS][1] is False
+
+    usage = memory.usage()
+    assert usage['bytes'] == sum(size for size, _ in entries.values())
+    assert usage['evictable_bytes'] == 1000 + 104
+    assert usage['budget_bytes'] == 10**9
+
+
+def test_evicts_least_recently_used_first():
+    state = {}
+    registry = SessionRegistry()
+    memory = SessionMemory(state, budget_bytes=10**9, registry=registry)
+    for name in ('a', 'b', 'c'):
+        memory.begin_run()
+        state[f'long_audio_{name}'] = AUDIO
+        memory.touch(f'long_audio_{name}')
+    state[SPEECH_TEXTS] = {'desc': 'x' * 996}
+    memory.touch_text('desc')
+
+    # Vượt ngân sách 500 byte: chỉ xóa mục cũ nhất (a); b, c và văn bản vẫn còn
+    memory.budget_bytes = memory.usage()['bytes'] - 500
+    assert memory.begin_run() == 1000
+    assert 'long_audio_a' not in state and 'long_audio_b' in state
+    assert registry.totals()['evictions'] == 1 and registry.totals()['evicted_bytes'] == 1000
+
+    # Lần chạy sau không touch gì: b (run 2) trước, rồi tới c (run 3); văn bản cùng run 3 vẫn giữ
+    memory.budget_bytes = memory.usage()['bytes'] - 1500
+    assert memory.begin_run() == 2000
+    assert not any(key.startswith('long_audio_') for key in state)
+    assert state[SPEECH_TEXTS] == {'desc': 'x' * 996}
+
+    totals = registry.totals()
+    assert (totals['sessions'], totals['evictions'], totals['evicted_bytes']) == (1, 3, 3000)
+    assert totals['bytes'] == memory.usage()['bytes']
+
+
+def test_recently_used_entries_survive_over_budget():
+    state = {}
+    memory = SessionMemory(state, budget_bytes=10**9, registry=SessionRegistry())
+    memory.begin_run()
+    state['long_audio_old'] = AUDIO
+    state['long_audio_new'] = AUDIO
+    state[SPEECH_TEXTS] = {'reply_5': 'y' * 500}
+    memory.touch('long_audio_new')
+    memory.touch_text('reply_5')
+    # Mục chưa từng touch bị xóa ngay; mục dùng ở lần chạy trước được giữ dù vẫn vượt ngân sách
+    memory.budget_bytes = 0
+    assert memory.begin_run() == 1000
+    assert set(state) >= {'long_audio_new', SPEECH_TEXTS} and 'long_audio_old' not in state
+    assert memory.begin_run() == 1000 + 7 + 500
+    assert 'long_audio_new' not in state and state[SPEECH_TEXTS] == {}
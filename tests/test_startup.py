@@ -0,0 +1,34 @@
+# Ngân sách khởi động (startup.py): đo trong tiến trình mới, thư viện nặng chỉ import khi dùng
+import pytest
+
+import startup
+
+
+def test_heavy_modules_are_imported_lazily():
+    assert set(startup.HEAVY_MODULES) == {'pandas', 'speech_recognition', 'pydub', 'werkzeug', 'psycopg2'}
+    assert 'session_memory' in startup.APP_MODULES
+
+
+def test_app_modules_within_budget():
+    measured = startup.measure_startup(entry_point=None)
+    assert measured['heavy_loaded'] == []
+    assert measured['import_seconds'] <= startup.IMPORT_BUDGET_SECONDS
+    assert measured['first_paint_seconds'] <= startup.FIRST_PAINT_BUDGET_SECONDS
+    assert startup.check_budget(measured) == []
+
+
+@pytest.mark.parametrize('entry_point', startup.ENTRY_POINTS)
+def test_entry_point_first_paint_within_budget(entry_point):
+    pytest.importorskip('streamlit')
+    measured = startup.measure_startup(entry_point=entry_point)
+    assert measured['entry_point'] == entry_point
+    assert measured['heavy_loaded'] == []
+    assert measured['first_paint_seconds'] <= startup.FIRST_PAINT_BUDGET_SECONDS
+    assert startup.check_budget(measured) == []
+
+
+def test_check_budget_reports_violations():
+    measured = {'import_seconds': 0.9, 'first_paint_seconds': 2.0, 'heavy_loaded': ['pandas']}
+    problems = startup.check_budget(measured, import_budget=0.5, first_paint_budget=1.5)
+    assert len(problems) == 3
+    assert 'pandas' in problems[0]
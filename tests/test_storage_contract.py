@@ -0,0 +1,365 @@
+# Bộ test hợp đồng của lớp lưu trữ: mọi test chạy với cả SQLite và PostgreSQL
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import database
+import storage as storage_module
+from data_access import ForumPost, ForumReply, ReportDetail, ReportSummary
+from geo import CELL_PRECISION, encode_geohash
+from timeutils import vietnam_day_key
+
+# 10:00 ngày 14/11/2023 giờ Việt Nam
+BASE_TS = 1_699_930_800
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Điều khiển now_epoch() của storage (created_ts, resolved_ts, ...)"""
+    class Clock:
+        now = BASE_TS
+
+        def __call__(self):
+            return self.now
+
+    fake = Clock()
+    monkeypatch.setattr(storage_module, 'now_epoch', fake)
+    return fake
+
+
+def _report(storage, title='Trộm xe', key=None, latitude=None, longitude=None, urgent=False):
+    return storage.insert_report(title, f'Mô tả {title}', 'Phường 1', '2023-11-14 09:00', 'ip',
+                                 latitude, longitude, urgent, key)
+
+
+def _post(storage, title='Hỏi về tạm trú', category='Cư trú', key=None):
+    return storage.insert_forum_post(title, f'Nội dung {title}', category, 'Ẩn danh #1', key)
+
+
+def _reply(storage, post_id, official=False):
+    if official:
+        return storage.insert_forum_reply(post_id, 'Trả lời chính thức', 'police', 'CA001', 'Công an', True)
+    return storage.insert_forum_reply(post_id, 'Cảm ơn', 'citizen', None, 'Người dân', False)
+
+
+# ---- Phản ánh ----
+def test_insert_and_get_report(storage, clock):
+    report_id = _report(storage, latitude=10.77, longitude=106.70, urgent=True)
+    assert isinstance(report_id, int)
+    detail = storage.get_report(report_id)
+    assert isinstance(detail, ReportDetail)
+    assert (detail.title, detail.location, detail.is_urgent, detail.email_sent) == ('Trộm xe', 'Phường 1', True, False)
+    assert detail.status == database.REPORT_RECEIVED
+    assert detail.created_ts == BASE_TS
+    assert detail.formatted_date == '10:00 14/11/2023'
+    assert storage.get_report(report_id + 1000) is None
+
+
+def test_insert_report_idempotency_key(storage):
+    first = _report(storage, key='form-1')
+    assert _report(storage, key='form-1') is None
+    assert _report(storage, key='form-2') not in (None, first)
+    assert storage.quick_stats(vietnam_day_key())['total_reports'] == 2
+
+
+def test_submit_report_enqueues_one_email(storage):
+    report_id = storage.submit_report('Đánh nhau', 'Mô tả', 'Chợ', 'sáng nay', 'ip', idempotency_key='form-1')
+    assert storage.submit_report('Đánh nhau', 'Mô tả', 'Chợ', 'sáng nay', 'ip', idempotency_key='form-1') == report_id
+    assert storage.outbox_counts() == {database.OUTBOX_PENDING: 1}
+    claimed = storage.claim_outbox(10, 60)
+    assert [(row[1], json.loads(row[2])['title']) for row in claimed] == [(report_id, 'Đánh nhau')]
+
+
+def test_find_by_idempotency_key(storage):
+    assert storage.find_report_by_idempotency_key('form-1') is None
+    report_id = storage.submit_report('Đánh nhau', 'Mô tả', 'Chợ', 'sáng nay', 'ip', idempotency_key='form-1')
+    assert storage.find_report_by_idempotency_key('form-1') == report_id
+
+    assert storage.find_forum_post_by_idempotency_key('form-1') is None
+    post_id = storage.insert_forum_post('Câu hỏi', 'Nội dung', 'Chung', 'NgườiDân_form-1', 'form-1')
+    assert storage.find_forum_post_by_idempotency_key('form-1') == post_id
+    assert storage.find_forum_post_by_idempotency_key('form-2') is None
+
+
+# Bảng phản ánh trước khi có quy trình tiếp nhận / xử lý (lược đồ trước phiên bản 9)
+LEGACY_REPORTS_DDL = {
+    'sqlite': '''CREATE TABLE security_reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, description TEXT NOT NULL,
+        location TEXT, incident_time TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        ip_hash TEXT, email_sent BOOLEAN DEFAULT 0, created_ts INTEGER)''',
+    'postgres': '''CREATE TABLE security_reports (
+        id BIGSERIAL PRIMARY KEY, title TEXT NOT NULL, description TEXT NOT NULL,
+        location TEXT, incident_time TEXT, created_at TIMESTAMPTZ DEFAULT now(),
+        created_ts BIGINT NOT NULL, ip_hash TEXT, email_sent BOOLEAN NOT NULL DEFAULT FALSE)''',
+}
+
+
+def test_upgrade_resolves_reports_from_before_workflow(empty_storage, clock):
+    with empty_storage.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(LEGACY_REPORTS_DDL[empty_storage.name])
+        cur.execute(f"INSERT INTO security_reports (title, description, created_ts) "
+                    f"VALUES ('Trộm xe', 'Mất xe', {BASE_TS - 86400})")
+    empty_storage.init_schema()
+
+    # Phản ánh cũ không làm ngập hàng đợi chưa ai nhận
+    assert empty_storage.list_report_queue() == []
+    legacy = empty_storage.get_report(1)
+    assert (legacy.status, legacy.resolved_ts, legacy.assigned_to) == (
+        database.REPORT_RESOLVED, BASE_TS - 86400, None)
+    # ... và không được tính là một lượt xử lý xong (thời gian xử lý 0 giây)
+    assert [row for row in empty_storage.analytics_daily('2000-01-01', '2100-01-01') if row[0] == 'resolved'] == []
+
+    new_id = _report(empty_storage)
+    assert [row.id for row in empty_storage.list_report_queue()] == [new_id]
+    empty_storage.init_schema()
+    assert empty_storage.get_report(new_id).status == database.REPORT_RECEIVED
+
+
+def test_list_reports_pages_and_filters(storage, clock):
+    ids = []
+    for i in range(5):
+        clock.now = BASE_TS + i
+        ids.append(_report(storage, title=f'Vụ 100%_{i}' if i == 2 else f'Vụ {i}'))
+    storage.mark_report_email_sent(ids[0])
+
+    first_page = storage.list_reports(BASE_TS, BASE_TS + 10, limit=2)
+    assert all(isinstance(row, ReportSummary) for row in first_page)
+    assert [row.id for row in first_page] == [ids[4], ids[3]]
+    last = first_page[-1]
+    second_page = storage.list_reports(BASE_TS, BASE_TS + 10, before=(last.created_ts, last.id), limit=10)
+    assert [row.id for row in second_page] == [ids[2], ids[1], ids[0]]
+
+    assert [row.id for row in storage.list_reports(BASE_TS, BASE_TS + 10, email_sent=True)] == [ids[0]]
+    assert len(storage.list_reports(BASE_TS, BASE_TS + 10, email_sent=False)) == 4
+    # % và _ trong từ khóa là ký tự thường, không phải ký tự đại diện
+    assert [row.id for row in storage.list_reports(BASE_TS, BASE_TS + 10, keyword='100%_')] == [ids[2]]
+    assert [row.id for row in storage.list_reports(BASE_TS, BASE_TS + 10, keyword='%')] == [ids[2]]
+    assert storage.list_reports(BASE_TS + 100, BASE_TS + 200) == []
+
+
+def test_report_workflow_and_queue(storage, clock):
+    first, second = _report(storage, 'A'), _report(storage, 'B')
+    assert [row.id for row in storage.list_report_queue()] == [first, second]
+
+    assert storage.assign_report(first, 'CA002')
+    assert [row.id for row in storage.list_report_queue()] == [second]
+    assert [row.id for row in storage.list_report_queue(assigned_to='CA002')] == [first]
+
+    clock.now = BASE_TS + 3600
+    assert storage.resolve_report(first, 'CA003')
+    assert not storage.resolve_report(first, 'CA003')
+    assert not storage.assign_report(first, 'CA004')
+    detail = storage.get_report(first)
+    assert (detail.status, detail.assigned_to, detail.resolved_ts) == (database.REPORT_RESOLVED, 'CA002', BASE_TS + 3600)
+    assert storage.list_report_queue(assigned_to='CA002') == []
+
+    # Xử lý thẳng phản ánh chưa ai nhận: người xử lý được ghi nhận
+    assert storage.resolve_report(second, 'CA003')
+    assert storage.get_report(second).assigned_to == 'CA003'
+    assert storage.analytics_totals()['resolved'] == (2, 2 * 3600)
+
+
+def test_unsent_reports_and_mark_sent(storage, clock):
+    queued = storage.submit_report('Có email chờ', 'x', 'y', 'z', 'ip')
+    plain = [_report(storage, f'R{i}') for i in range(3)]
+    rows = storage.list_unsent_reports(BASE_TS, BASE_TS + 1)
+    # Phản ánh còn email trong outbox do luồng nền gửi
+    assert [row[0] for row in rows] == plain
+    assert [row[0] for row in storage.list_unsent_reports(BASE_TS, BASE_TS + 1, after=(BASE_TS, plain[0]))] == plain[1:]
+
+    outbox_id = storage.claim_outbox(10, 60)[0][0]
+    storage.fail_outbox(outbox_id, 'SMTP down', None)
+    assert storage.outbox_counts() == {database.OUTBOX_DEAD: 1}
+    storage.mark_reports_email_sent(plain + [queued])
+    assert storage.list_unsent_reports(BASE_TS, BASE_TS + 1) == []
+    assert storage.outbox_counts() == {database.OUTBOX_SENT: 1}
+
+
+# ---- Outbox ----
+def test_outbox_claim_complete_and_retry(storage, clock):
+    urgent = storage.submit_report('Khẩn', 'x', 'y', 'z', 'ip', urgent=True)
+    normal = storage.submit_report('Thường', 'x', 'y', 'z', 'ip')
+    assert storage.digest_backlog() == (1, BASE_TS)
+
+    claimed = storage.claim_outbox(10, 60, urgent=True)
+    assert [row[1] for row in claimed] == [urgent]
+    # Đang được giữ: không ai nhận lại trước khi hết hạn
+    assert storage.claim_outbox(10, 60, urgent=True) == []
+    storage.complete_outbox(claimed[0][0])
+    assert storage.get_report(urgent).email_sent
+
+    claimed = storage.claim_outbox(10, 60, urgent=False)
+    assert [row[1] for row in claimed] == [normal]
+    storage.fail_outbox(claimed[0][0], 'timeout', BASE_TS + 30)
+    assert storage.claim_outbox(10, 60) == []
+    clock.now = BASE_TS + 30
+    retried = storage.claim_outbox(10, 60)
+    assert [(row[1], row[3]) for row in retried] == [(normal, 1)]
+    assert storage.outbox_counts() == {database.OUTBOX_SENT: 1, database.OUTBOX_SENDING: 1}
+
+
+# ---- Diễn đàn ----
+def test_forum_posts_replies_and_counts(storage, clock):
+    first = _post(storage, 'Câu 1', 'Cư trú')
+    clock.now += 10
+    second = _post(storage, 'Câu 2', 'Giao thông')
+    assert _post(storage, 'Câu 3', key='form-1') == _post(storage, 'Câu 3 (gửi lại)', key='form-1')
+
+    _reply(storage, first)
+    clock.now += 10
+    _reply(storage, first, official=True)
+
+    posts = storage.list_forum_posts()
+    assert all(isinstance(post, ForumPost) for post in posts)
+    assert [post.title for post in posts][-2:] == ['Câu 2', 'Câu 1']
+    by_id = {post.id: post for post in posts}
+    assert (by_id[first].reply_count, bool(by_id[first].is_answered)) == (2, True)
+    assert (by_id[second].reply_count, bool(by_id[second].is_answered)) == (0, False)
+    assert [post.id for post in storage.list_forum_posts(category='Giao thông')] == [second]
+    assert len(storage.list_forum_posts(limit=1)) == 1
+
+    replies = storage.list_forum_replies(first)
+    assert all(isinstance(reply, ForumReply) for reply in replies)
+    assert [bool(reply.is_official) for reply in replies] == [False, True]
+    assert storage.list_forum_replies(second) == []
+
+    unanswered = storage.list_unanswered_posts()
+    assert [post.id for post in unanswered][:1] == [second]
+    assert first not in [post.id for post in unanswered]
+    assert storage.list_unanswered_posts(after=(unanswered[-1].created_ts, unanswered[-1].id)) == []
+
+    stats = storage.quick_stats(vietnam_day_key(BASE_TS))
+    assert stats == {'total_reports': 0, 'total_posts': 3, 'today_reports': 0}
+    totals = storage.analytics_totals()
+    assert totals['questions'][0] == 3
+    # Chỉ phản hồi chính thức đầu tiên được tính, thời gian chờ 20 giây
+    assert totals['answered'] == (1, 20)
+
+
+def test_run_batch_commits_together(storage):
+    post_id = _post(storage)
+    results = storage.run_batch([
+        ('insert_report', ('Lô', 'x', 'y', 'z', 'ip')),
+        ('insert_forum_reply', (post_id, 'Trả lời', 'citizen', None, 'Người dân', False)),
+    ])
+    assert len(results) == 2 and all(isinstance(value, int) for value in results)
+    with pytest.raises(ValueError):
+        storage.run_batch([('insert_report', ('A', 'x', 'y', 'z', 'ip')), ('drop_everything', ())])
+    assert storage.quick_stats(vietnam_day_key())['total_reports'] == 1
+
+
+# ---- Thống kê ----
+def test_daily_and_hourly_rollups(storage, clock):
+    clock.now = BASE_TS + 15 * 3600  # 01:00 ngày 15/11 giờ Việt Nam
+    _report(storage)
+    _report(storage, latitude=21.0285, longitude=105.8542)
+    clock.now = BASE_TS
+    _report(storage, latitude=21.0285, longitude=105.8542)
+
+    daily = {(metric, day): count for metric, day, count, _ in storage.analytics_daily('2023-11-14', '2023-11-15')}
+    assert daily[('reports', '2023-11-14')] == 1
+    assert daily[('reports', '2023-11-15')] == 2
+    hourly = storage.analytics_hourly(BASE_TS, BASE_TS + 16 * 3600)
+    assert [(metric, hour_ts, count) for metric, hour_ts, count, _ in hourly] == [
+        ('reports', BASE_TS - BASE_TS % 3600, 1), ('reports', BASE_TS + 15 * 3600 - BASE_TS % 3600, 2),
+    ]
+    cell = encode_geohash(21.0285, 105.8542)[:CELL_PRECISION]
+    assert storage.report_cell_counts('2023-11-14', '2023-11-15') == [(cell, 2)]
+    assert storage.report_cell_counts('2023-11-15', '2023-11-15') == [(cell, 1)]
+    assert storage.quick_stats('2023-11-15') == {'total_reports': 3, 'total_posts': 0, 'today_reports': 2}
+
+
+def _rollup_snapshot(storage):
+    return (
+        storage.quick_stats('2023-11-14'),
+        sorted(storage.analytics_daily('2000-01-01', '2100-01-01')),
+        sorted(storage.analytics_hourly(0, 2 ** 40)),
+        sorted(storage.report_cell_counts('2000-01-01', '2100-01-01')),
+        sorted((post.id, post.reply_count) for post in storage.list_forum_posts()),
+    )
+
+
+def _wipe_rollups(storage):
+    with storage.connection() as conn:
+        cur = conn.cursor()
+        for table in ('stats_counters', 'analytics_hourly', 'analytics_daily', 'report_cells'):
+            cur.execute(f'DELETE FROM {table}')
+        cur.execute('UPDATE forum_posts SET reply_count = 0')
+
+
+def test_rebuild_rollups_matches_triggers(storage, clock):
+    _report(storage, latitude=10.77, longitude=106.70)
+    report_id = _report(storage)
+    post_id = _post(storage)
+    clock.now += 90
+    _reply(storage, post_id)
+    _reply(storage, post_id, official=True)
+    storage.resolve_report(report_id, 'CA001')
+
+    expected = _rollup_snapshot(storage)
+    _wipe_rollups(storage)
+    assert _rollup_snapshot(storage) != expected
+    storage.rebuild_rollups()
+    assert _rollup_snapshot(storage) == expected
+
+
+def test_postgres_init_schema_backfills_existing_database(postgres_storage, clock):
+    # Database PostgreSQL có dữ liệu từ trước khi có bảng tổng hợp
+    _report(postgres_storage, latitude=10.77, longitude=106.70)
+    post_id = _post(postgres_storage)
+    _reply(postgres_storage, post_id)
+    _reply(postgres_storage, post_id, official=True)
+    expected = _rollup_snapshot(postgres_storage)
+    with postgres_storage.connection() as conn, conn.cursor() as cur:
+        cur.execute('DROP TABLE stats_counters, analytics_hourly, analytics_daily, report_cells')
+        cur.execute('UPDATE forum_posts SET reply_count = 0, first_answer_ts = NULL')
+
+    postgres_storage.init_schema()
+    assert _rollup_snapshot(postgres_storage) == expected
+    # Khởi động lại không đếm lại lần nữa (bảng đã có)
+    postgres_storage.init_schema()
+    assert _rollup_snapshot(postgres_storage) == expected
+
+
+# ---- Giới hạn tốc độ dùng chung ----
+def test_rate_tokens_and_window(storage):
+    assert storage.reserve_rate_tokens('email', 1.0, 2, 1, 10) == 0
+    assert storage.reserve_rate_tokens('email', 1.0, 2, 1, 10) == 0
+    wait = storage.reserve_rate_tokens('email', 1.0, 2, 1, 10)
+    assert 0 < wait <= 1.0
+    assert storage.reserve_rate_tokens('email', 1.0, 2, 100, 1) is None
+
+    assert storage.hit_rate_window('reports', 'client-a', 2, 60) == 0
+    assert storage.hit_rate_window('reports', 'client-a', 2, 60) == 0
+    assert 0 < storage.hit_rate_window('reports', 'client-a', 2, 60) <= 60
+    assert storage.hit_rate_window('reports', 'client-b', 2, 60) == 0
+
+
+def test_rate_tokens_refill_queue_and_reject(storage, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(storage_module, 'time', SimpleNamespace(time=lambda: now[0]))
+    # Bucket mới đầy burst; nghỉ lâu cũng chỉ nạp lại tới burst
+    for _ in range(2):
+        assert storage.reserve_rate_tokens('email', 2.0, 2, 1, 10) == 0
+    now[0] += 3600
+    for _ in range(2):
+        assert storage.reserve_rate_tokens('email', 2.0, 2, 1, 10) == 0
+    # Token âm: người gọi sau xếp hàng sau người gọi trước
+    assert storage.reserve_rate_tokens('email', 2.0, 2, 1, 10) == pytest.approx(0.5)
+    assert storage.reserve_rate_tokens('email', 2.0, 2, 1, 10) == pytest.approx(1.0)
+    # Chờ quá max_wait: từ chối và không trừ token
+    assert storage.reserve_rate_tokens('email', 2.0, 2, 1, 1.0) is None
+    assert storage.reserve_rate_tokens('email', 2.0, 2, 1, 10) == pytest.approx(1.5)
+    # 1.5 giây nạp lại đúng 3 token đang nợ
+    now[0] += 1.5
+    assert storage.reserve_rate_tokens('email', 2.0, 2, 1, 10) == pytest.approx(0.5)
+
+
+# ---- Tài khoản công an ----
+def test_police_users(storage):
+    assert storage.get_police_user('CA009') is None
+    storage.create_police_user('CA009', 'Cán bộ 9', 'hash-1')
+    storage.create_police_user('CA009', 'Trùng số hiệu', 'hash-2', 'admin')
+    assert tuple(storage.get_police_user('CA009')) == ('CA009', 'Cán bộ 9', 'hash-1', 'officer')
@@ -0,0 +1,31 @@
+# Kiểm tra format_epochs định dạng cả cột giống hệt datetime.fromtimestamp theo giờ Việt Nam
+import random
+from datetime import datetime
+
+from timeutils import DAY_FORMAT, DISPLAY_TIME_FORMAT, VIETNAM_TZ, format_epochs
+
+
+def _reference(values, format_str):
+    return ["N/A" if ts is None else datetime.fromtimestamp(ts, VIETNAM_TZ).strftime(format_str)
+            for ts in values]
+
+
+def test_format_epochs_matches_per_row_conversion():
+    rng = random.Random(27)
+    values = [rng.randint(0, 2_000_000_000) for _ in range(2000)] + [None, 0, 86400 - 7 * 3600]
+    for format_str in (DISPLAY_TIME_FORMAT, DAY_FORMAT, '%d/%m/%Y %H:%M:%S', '{%H}h %A'):
+        assert format_epochs(values, format_str) == _reference(values, format_str)
+
+
+def test_format_epochs_day_boundary_in_vietnam_time():
+    # 17:00 UTC = 00:00 ngày hôm sau ở Việt Nam
+    assert format_epochs([1_700_000_000 - 1_700_000_000 % 86400 + 17 * 3600]) == ['00:00 15/11/2023']
+
+
+def test_format_epochs_other_time_directives_fall_back():
+    values = [1_700_000_000, None]
+    assert format_epochs(values, '%I:%M %p') == _reference(values, '%I:%M %p')
+
+
+def test_format_epochs_empty():
+    assert format_epochs([]) == []
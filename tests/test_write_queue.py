@@ -0,0 +1,69 @@
+# Kiểm tra GroupCommitWriter: gom lượt ghi đồng thời vào một transaction, lỗi chỉ về đúng người gửi
+import threading
+
+import pytest
+
+from write_queue import GroupCommitWriter
+
+
+@pytest.fixture
+def batches(storage, monkeypatch):
+    """Ghi lại số thao tác của mỗi lần run_batch (mỗi lần = một transaction)"""
+    sizes = []
+    run_batch = storage.run_batch
+
+    def recording(operations):
+        sizes.append(len(operations))
+        return run_batch(operations)
+
+    monkeypatch.setattr(storage, 'run_batch', recording)
+    return sizes
+
+
+def _concurrent_writes(writer, calls):
+    """Gọi writer.write đồng thời từ nhiều luồng; trả về kết quả hoặc exception của từng lượt"""
+    results = [None] * len(calls)
+    start = threading.Barrier(len(calls))
+
+    def worker(index, operation, args):
+        start.wait()
+        try:
+            results[index] = writer.write(operation, *args, timeout=10)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i, operation, args))
+               for i, (operation, args) in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_writes_commit_in_one_transaction(storage, batches):
+    writer = GroupCommitWriter(storage, max_wait=0.5)
+    calls = [('insert_forum_post', ('Câu hỏi', f'Nội dung {i}', 'Chung', f'Ẩn danh #{i}')) for i in range(6)]
+
+    ids = _concurrent_writes(writer, calls)
+
+    assert batches == [6]
+    assert writer.stats()['batches'] == 1
+    assert len(set(ids)) == 6
+    assert sorted(post.id for post in storage.list_forum_posts()) == sorted(ids)
+
+
+def test_failing_operation_does_not_drop_other_writes(storage, batches):
+    writer = GroupCommitWriter(storage, max_wait=0.5)
+    calls = [('insert_report', (f'Phản ánh {i}', 'Mô tả', 'Chợ', '', 'ip')) for i in range(4)]
+    # Thiếu tiêu đề (NOT NULL): làm hỏng cả lô
+    calls.insert(2, ('insert_report', (None, 'Mô tả', 'Chợ', '', 'ip')))
+
+    results = _concurrent_writes(writer, calls)
+
+    # Lô hỏng được ghi lại từng thao tác: 1 lô 5 thao tác rồi 5 lần ghi riêng
+    assert batches == [5, 1, 1, 1, 1, 1]
+    failed = [result for result in results if isinstance(result, Exception)]
+    assert len(failed) == 1 and isinstance(results[2], Exception)
+    saved = [result for result in results if not isinstance(result, Exception)]
+    assert sorted(storage.get_report(report_id).title for report_id in saved) == [f'Phản ánh {i}' for i in range(4)]
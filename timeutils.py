@@ -0,0 +1,112 @@
+# timeutils.py - Giờ Việt Nam và chuyển đổi timestamp epoch dùng chung
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+# Múi giờ Việt Nam (UTC+7)
+VIETNAM_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
+# Từ 13/06/1975 Việt Nam dùng cố định UTC+7 (không có giờ mùa hè)
+VIETNAM_UTC_OFFSET = 7 * 3600
+VIETNAM_FIXED_OFFSET_SINCE = 171820800
+
+DISPLAY_TIME_FORMAT = '%H:%M %d/%m/%Y'
+DAY_FORMAT = '%Y-%m-%d'
+
+# format_epochs: %H/%M/%S điền bằng số học, chỉ thị giờ khác thì định dạng từng giá trị
+_EPOCH_DAY = datetime(1970, 1, 1)
+_TIME_FIELDS = (('%H', '{0:02d}'), ('%M', '{1:02d}'), ('%S', '{2:02d}'))
+_TIME_ONLY_DIRECTIVES = re.compile(r'%[IpXcfTRrzZsk-]')
+
+
+def now_epoch():
+    """Thời điểm hiện tại dạng số giây epoch (UTC) để lưu vào database"""
+    return int(time.time())
+
+
+def get_vietnam_time():
+    """Lấy thời gian hiện tại theo giờ Việt Nam"""
+    return datetime.now(VIETNAM_TZ)
+
+
+def to_vietnam_time(value):
+    """Chuyển epoch / chuỗi UTC trong DB / datetime sang datetime giờ Việt Nam"""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, VIETNAM_TZ)
+
+    if isinstance(value, str):
+        # CURRENT_TIMESTAMP của SQLite luôn là giờ UTC
+        value = datetime.fromisoformat(value)
+
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(VIETNAM_TZ)
+
+
+def format_vietnam_time(dt, format_str=DISPLAY_TIME_FORMAT):
+    """Định dạng thời gian theo giờ Việt Nam"""
+    if dt is None:
+        return "N/A"
+
+    try:
+        return to_vietnam_time(dt).strftime(format_str)
+    except (TypeError, ValueError):
+        return str(dt)
+
+
+def format_epochs(values, format_str=DISPLAY_TIME_FORMAT):
+    """
+    Định dạng cả cột epoch sang giờ Việt Nam trong một lượt (dùng ở lớp hiển thị).
+    Giờ / phút / giây tính bằng số học trên cả cột; phần ngày chỉ strftime một lần cho mỗi
+    ngày khác nhau (một trang kết quả thường chỉ trải vài ngày).
+    """
+    if _TIME_ONLY_DIRECTIVES.search(format_str):
+        # Định dạng có chỉ thị giờ ngoài %H/%M/%S - định dạng từng giá trị
+        return [format_vietnam_time(ts, format_str) if ts is not None else "N/A" for ts in values]
+
+    local = [None if ts is None else int(ts) + VIETNAM_UTC_OFFSET for ts in values]
+    day_templates = {}
+    for ts in local:
+        if ts is not None and ts // 86400 not in day_templates:
+            day_templates[ts // 86400] = _day_template(ts // 86400, format_str)
+
+    result = []
+    for ts, local_ts in zip(values, local):
+        if ts is None:
+            result.append("N/A")
+        elif ts < VIETNAM_FIXED_OFFSET_SINCE:
+            # Trước 1975 múi giờ khác UTC+7 - để pytz tính
+            result.append(format_vietnam_time(ts, format_str))
+        else:
+            day, seconds = divmod(local_ts, 86400)
+            result.append(day_templates[day].format(seconds // 3600, seconds // 60 % 60, seconds % 60))
+    return result
+
+
+def _day_template(day, format_str):
+    """Chuỗi đã strftime phần ngày, còn chỗ trống {0}/{1}/{2} cho giờ / phút / giây"""
+    pattern = format_str.replace('{', '{{').replace('}', '}}')
+    for directive, field in _TIME_FIELDS:
+        pattern = pattern.replace(directive, field)
+    return (_EPOCH_DAY + timedelta(days=day)).strftime(pattern)
+
+
+# ================ KHOẢNG THỜI GIAN THEO NGÀY VIỆT NAM ================
+def vietnam_day_key(ts=None):
+    """Khóa ngày 'YYYY-MM-DD' theo giờ Việt Nam của một epoch (mặc định: bây giờ)"""
+    return datetime.fromtimestamp(now_epoch() if ts is None else ts, VIETNAM_TZ).strftime(DAY_FORMAT)
+
+
+def vietnam_day_bounds(day):
+    """Khoảng epoch [bắt đầu, kết thúc) của một ngày theo giờ Việt Nam"""
+    if isinstance(day, str):
+        day = datetime.strptime(day, DAY_FORMAT).date()
+    start = VIETNAM_TZ.localize(datetime(day.year, day.month, day.day))
+    end = VIETNAM_TZ.localize(datetime(day.year, day.month, day.day) + timedelta(days=1))
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def vietnam_range_bounds(start_day, end_day):
+    """Khoảng epoch [đầu ngày start_day, hết ngày end_day) theo giờ Việt Nam"""
+    return vietnam_day_bounds(start_day)[0], vietnam_day_bounds(end_day)[1]
@@ -0,0 +1,113 @@
+# write_queue.py - Luồng ghi duy nhất, gom nhiều lượt gửi vào một transaction (group commit)
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from storage import get_storage
+
+# Số thao tác tối đa trong một transaction và thời gian chờ gom thêm
+MAX_BATCH_SIZE = 32
+MAX_BATCH_WAIT_SECONDS = 0.01
+# Thời gian tối đa người gửi chờ kết quả trước khi báo lỗi
+SUBMIT_TIMEOUT_SECONDS = 30
+
+
+class GroupCommitWriter:
+    """
+    Một luồng nền duy nhất nhận yêu cầu ghi từ hàng đợi và commit theo lô.
+
+    Khi có sự cố đông người gửi cùng lúc (tai nạn, lễ hội...), thay vì mỗi
+    lượt gửi mở kết nối riêng và tranh khóa ghi của SQLite, các lượt gửi
+    trong vài mili giây được gom vào một transaction. Người gửi nhận id
+    dòng mới qua Future.
+    """
+
+    def __init__(self, storage, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT_SECONDS):
+        self.storage = storage
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.operations = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, operation, *args):
+        """Đưa một thao tác ghi (tên phương thức Storage) vào hàng đợi, trả về Future"""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((operation, args, future))
+        return future
+
+    def write(self, operation, *args, timeout=SUBMIT_TIMEOUT_SECONDS):
+        """Gửi và chờ kết quả (id dòng mới)"""
+        return self.submit(operation, *args).result(timeout=timeout)
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            live = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if live:
+                self._commit(live)
+
+    def _commit(self, batch):
+        operations = [(operation, args) for operation, args, _ in batch]
+        try:
+            results = self.storage.run_batch(operations)
+        except Exception:
+            # Một thao tác lỗi làm hỏng cả lô: ghi lại từng thao tác để chỉ
+            # người gửi có dữ liệu lỗi nhận exception
+            for operation, args, future in batch:
+                try:
+                    future.set_result(self.storage.run_batch([(operation, args)])[0])
+                except Exception as e:
+                    future.set_exception(e)
+        else:
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+        self.batches += 1
+        self.operations += len(batch)
+
+    def stats(self):
+        """Số lô đã commit, số thao tác, kích thước lô trung bình và độ dài hàng đợi"""
+        return {
+            'batches': self.batches,
+            'operations': self.operations,
+            'avg_batch_size': self.operations / self.batches if self.batches else 0.0,
+            'queue_depth': self._queue.qsize(),
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Luồng ghi dùng chung cho cả tiến trình, gắn với backend từ get_storage()"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = GroupCommitWriter(get_storage())
+    return _writer